@@ -3,6 +3,7 @@ Azure Functions for Certification Audio Platform API.
 """
 
 import base64
+import gzip
 import json
 import logging
 import os
@@ -101,6 +102,19 @@ def _normalize_episode_id(episode_num: str) -> str:
     return text
 
 
+def _read_text_blob(blob_client) -> str:
+    """Download a text blob, gunzipping it if it was stored compressed.
+
+    Scripts and sync data are uploaded with Content-Encoding: gzip; older
+    episodes' blobs are plain. The transport may already have decoded the
+    body, so the bytes themselves decide.
+    """
+    data = blob_client.download_blob().readall()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    return data.decode("utf-8")
+
+
 def _format_cert_name(cert_id: str) -> str:
     # Basic display name helper. Prefer a curated map when present.
     curated = {
@@ -822,8 +836,7 @@ def get_script(req: func.HttpRequest) -> func.HttpResponse:
             container=container_name, blob=blob_name
         )
 
-        download = blob_client.download_blob()
-        script_content = download.readall().decode("utf-8")
+        script_content = _read_text_blob(blob_client)
 
         return func.HttpResponse(
             script_content,
@@ -875,8 +888,7 @@ def get_sync(req: func.HttpRequest) -> func.HttpResponse:
             container=container_name, blob=blob_name
         )
 
-        download = blob_client.download_blob()
-        sync_content = download.readall().decode("utf-8")
+        sync_content = _read_text_blob(blob_client)
 
         return func.HttpResponse(
             sync_content,
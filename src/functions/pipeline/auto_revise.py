@@ -5,7 +5,7 @@ Auto-revise narration based on quality check results.
 import json
 import os
 
-from azure.identity import DefaultAzureCredential
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 from openai import AzureOpenAI
 
 
@@ -86,9 +86,9 @@ def auto_revise(
     else:
         client = AzureOpenAI(
             azure_endpoint=openai_endpoint,
-            azure_ad_token_provider=lambda: token_credential.get_token(
-                "https://cognitiveservices.azure.com/.default"
-            ).token,
+            azure_ad_token_provider=get_bearer_token_provider(
+                token_credential, "https://cognitiveservices.azure.com/.default"
+            ),
             api_version="2024-02-01",
         )
 
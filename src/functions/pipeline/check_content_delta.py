@@ -61,8 +61,9 @@ def check_content_delta(
     query = "SELECT * FROM c WHERE c.certificationId = @certId"
     parameters = [{"name": "@certId", "value": certification_id}]
 
+    # sources is partitioned on /certificationId, so this stays in one partition.
     sources = list(
-        sources_container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True)
+        sources_container.query_items(query=query, parameters=parameters, partition_key=certification_id)
     )
 
     changed_sources = []
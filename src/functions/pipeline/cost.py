@@ -6,6 +6,8 @@ duplicated in JavaScript, so the browser preview and the figure recorded
 against a job cannot drift apart.
 """
 
+import threading
+
 # List prices in USD per 1,000,000 units.
 RATES = {
     "gptInputPerMTok": 2.50,
@@ -103,26 +105,32 @@ def actual_cost(tts_chars: int, gpt_input_tokens: int, gpt_output_tokens: int,
 
 
 # Process-global because host.json pins the queue to batchSize 1, so exactly one
-# job runs in this worker at a time.
+# job runs in this worker at a time. That job records from several threads
+# (episodes are prepared and synthesized concurrently), hence the lock.
 _usage = {"ttsChars": 0, "gptInputTokens": 0, "gptOutputTokens": 0}
+_usage_lock = threading.Lock()
 
 
 def reset_usage() -> None:
-    for key in _usage:
-        _usage[key] = 0
+    with _usage_lock:
+        for key in _usage:
+            _usage[key] = 0
 
 
 def record_gpt_usage(usage) -> None:
     """Accumulate token counts from an OpenAI response's `usage` block."""
     if not usage:
         return
-    _usage["gptInputTokens"] += getattr(usage, "prompt_tokens", 0) or 0
-    _usage["gptOutputTokens"] += getattr(usage, "completion_tokens", 0) or 0
+    with _usage_lock:
+        _usage["gptInputTokens"] += getattr(usage, "prompt_tokens", 0) or 0
+        _usage["gptOutputTokens"] += getattr(usage, "completion_tokens", 0) or 0
 
 
 def record_tts_usage(character_count: int) -> None:
-    _usage["ttsChars"] += max(0, character_count)
+    with _usage_lock:
+        _usage["ttsChars"] += max(0, character_count)
 
 
 def snapshot_usage() -> dict:
-    return dict(_usage)
+    with _usage_lock:
+        return dict(_usage)
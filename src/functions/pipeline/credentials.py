@@ -0,0 +1,15 @@
+"""
+The Entra ID credential shared by the pipeline modules.
+"""
+
+from azure.identity import DefaultAzureCredential
+
+_credential = None
+
+
+def get_credential():
+    """Get cached DefaultAzureCredential."""
+    global _credential
+    if _credential is None:
+        _credential = DefaultAzureCredential()
+    return _credential
@@ -13,13 +13,21 @@ This module orchestrates the full episode generation pipeline:
 
 import argparse
 import hashlib
+import io
 import json
+import operator
 import os
+import random
 import sys
 import re
+import tempfile
+import threading
 import time
-import xml.etree.ElementTree as ET
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from array import array
+from collections import OrderedDict
+from copy import deepcopy
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
 from types import SimpleNamespace
 from typing import Optional
 from xml.sax.saxutils import escape
@@ -28,28 +36,118 @@ import requests
 
 from azure.cosmos import CosmosClient
 from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
 from azure.search.documents import SearchClient
 from azure.search.documents.models import VectorizedQuery
 from jinja2 import Environment, FileSystemLoader
-from openai import AzureOpenAI, RateLimitError
+from lxml import etree
+from openai import APIConnectionError, AzureOpenAI, RateLimitError
 
 # Import sibling tools
-from . import cost
-from .synthesize_audio import synthesize_audio, synthesize_audio_segments
-from .upload_to_blob import upload_to_blob
-from .save_episode import save_episode
+from . import cost, gpt_cache
+from .rate_limit import RateLimiter, estimate_chat_tokens
+from .synthesize_audio import prewarm_synthesizers, synthesize_audio, synthesize_segments_bytes
+from .upload_to_blob import commit_audio_segments, stage_audio_segment, upload_to_blob
+from .save_episode import build_episode_doc, save_episode, save_episodes
 
 # Below this many chunks, scoped retrieval is treated as a miss and the search
 # widens to the whole certification rather than narrating from almost nothing.
 MIN_SCOPED_CHUNKS = 3
 
+# Budget for the retrieved content placed in the narration prompt, in
+# characters (~4 per token, so the default is roughly 8,000 input tokens).
+# Results arrive best-first, so the chunks dropped are the least relevant.
+MAX_RETRIEVED_CHARS = int(os.environ.get("MAX_RETRIEVED_CHARS", "32000"))
+# A page the indexer could not split arrives as a single chunk; past this it is
+# cut at a word boundary so one chunk cannot spend the whole budget.
+MAX_CHUNK_CHARS = int(os.environ.get("MAX_CHUNK_CHARS", "4000"))
+
+CONTENT_SEPARATOR = "\n\n---\n\n"
+CONTENT_SEPARATOR_BYTES = CONTENT_SEPARATOR.encode()
+
+# Local cache of retrieve_content results, for iterating on prompts or voices
+# against the same certification without re-running every search. Off by
+# default: a re-index would not be seen until the entries expire.
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get("SEARCH_CACHE_TTL_SECONDS", "0"))
+SEARCH_CACHE_DIR = Path(
+    os.environ.get("SEARCH_CACHE_DIR")
+    or Path(tempfile.gettempdir()) / "certaudio" / "search"
+)
+# With the cache on, a query whose embedding is at least this similar (cosine)
+# to one already answered in this process, over the same scope, reuses that
+# answer. 0 disables the semantic match and only identical queries hit.
+SEARCH_CACHE_SIMILARITY = float(os.environ.get("SEARCH_CACHE_SIMILARITY", "0"))
+SEARCH_CACHE_MEMORY_ENTRIES = 256
+
+PROMPTS_DIR = Path(__file__).parent / "prompts"
+
+_jinja_env: Optional[Environment] = None
+
+
+def get_jinja_env() -> Environment:
+    """Process-wide prompt environment.
+
+    Templates ship with the deployment and never change under a running
+    worker, so auto_reload is off: a cached template is returned without
+    stat-ing its file on every episode, and nothing is ever evicted. Every
+    template is compiled up front, before the preparing workers start, so they
+    don't each compile the same one on their first episode.
+    """
+    global _jinja_env
+    if _jinja_env is None:
+        env = Environment(
+            loader=FileSystemLoader(PROMPTS_DIR),
+            auto_reload=False,
+            cache_size=-1,
+        )
+        for name in env.list_templates(extensions=["jinja2"]):
+            env.get_template(name)
+        _jinja_env = env
+    return _jinja_env
+
+
+@lru_cache(maxsize=None)
+def prompt_version(prompt: str) -> str:
+    """Digest of a prompt's templates, so cached GPT outputs follow prompt edits."""
+    digest = hashlib.sha256()
+    for role in ("system", "user"):
+        digest.update((PROMPTS_DIR / f"{prompt}.{role}.jinja2").read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def render_messages(jinja_env: Environment, prompt: str, **context) -> list[dict]:
+    """Render ``<prompt>.system.jinja2`` and ``<prompt>.user.jinja2`` as chat messages.
+
+    One file per role rather than one file split on "user:" afterwards: the
+    retrieved documentation is rendered into the user prompt, and any "user:"
+    it contained used to cut the prompt short at that point.
+    """
+    return [
+        {
+            "role": role,
+            "content": jinja_env.get_template(f"{prompt}.{role}.jinja2").render(**context).strip(),
+        }
+        for role in ("system", "user")
+    ]
+
 
 def _get_speech_region() -> str:
     return os.environ.get("SPEECH_REGION") or "centralus"
 
 
+# One keep-alive session for the Speech REST calls (issueToken, voices/list) so
+# repeated preflight checks don't redo the TLS handshake each time.
+_speech_http = requests.Session()
+
+# issueToken tokens are valid for 10 minutes; reuse one for 9.
+SPEECH_TOKEN_TTL_SECONDS = 9 * 60
+_speech_token: tuple[str, float] | None = None
+_speech_token_lock = threading.Lock()
+
+
 def _get_speech_headers() -> dict:
+    global _speech_token
+
     speech_key = os.environ.get("SPEECH_KEY")
     if speech_key:
         return {"Ocp-Apim-Subscription-Key": speech_key}
@@ -63,32 +161,36 @@ def _get_speech_headers() -> dict:
             "SPEECH_ENDPOINT is required for Entra authentication with the Voice List API. "
             "Set SPEECH_KEY to use API key auth instead."
         )
-    
-    credential = DefaultAzureCredential()
-    aad_token = credential.get_token("https://cognitiveservices.azure.com/.default")
-    
-    # Exchange the Entra token for a Speech service token via the resource's issueToken endpoint
-    # Custom subdomain endpoint format: https://<resource>.cognitiveservices.azure.com/
-    issue_token_url = speech_endpoint.rstrip("/") + "/sts/v1.0/issueToken"
-    resp = requests.post(
-        issue_token_url,
-        headers={"Authorization": f"Bearer {aad_token.token}"},
-        timeout=15,
-    )
-    if resp.status_code != 200:
-        raise RuntimeError(
-            f"Failed to get Speech token via issueToken ({resp.status_code}): {resp.text[:200]}"
+
+    with _speech_token_lock:
+        if _speech_token and _speech_token[1] > time.monotonic():
+            return {"Authorization": f"Bearer {_speech_token[0]}"}
+
+        credential = DefaultAzureCredential()
+        aad_token = credential.get_token("https://cognitiveservices.azure.com/.default")
+
+        # Exchange the Entra token for a Speech service token via the resource's issueToken endpoint
+        # Custom subdomain endpoint format: https://<resource>.cognitiveservices.azure.com/
+        issue_token_url = speech_endpoint.rstrip("/") + "/sts/v1.0/issueToken"
+        resp = _speech_http.post(
+            issue_token_url,
+            headers={"Authorization": f"Bearer {aad_token.token}"},
+            timeout=15,
         )
-    speech_token = resp.text
-    return {"Authorization": f"Bearer {speech_token}"}
+        if resp.status_code != 200:
+            raise RuntimeError(
+                f"Failed to get Speech token via issueToken ({resp.status_code}): {resp.text[:200]}"
+            )
+        _speech_token = (resp.text, time.monotonic() + SPEECH_TOKEN_TTL_SECONDS)
+        return {"Authorization": f"Bearer {resp.text}"}
 
 
-def _fetch_speech_voice_catalog() -> tuple[str, list[dict]]:
+def _fetch_speech_voice_catalog(region: Optional[str] = None) -> tuple[str, list[dict]]:
     """Return (region, raw voice records) from the Speech voices/list API."""
-    region = _get_speech_region()
+    region = region or _get_speech_region()
     url = f"https://{region}.tts.speech.microsoft.com/cognitiveservices/voices/list"
     headers = _get_speech_headers()
-    resp = requests.get(url, headers=headers, timeout=20)
+    resp = _speech_http.get(url, headers=headers, timeout=20)
     if resp.status_code != 200:
         raise RuntimeError(
             f"Voice list request failed ({resp.status_code}): {resp.text[:200]}"
@@ -96,11 +198,18 @@ def _fetch_speech_voice_catalog() -> tuple[str, list[dict]]:
     return region, resp.json()
 
 
-def _fetch_speech_voices() -> tuple[str, set[str]]:
-    region, data = _fetch_speech_voice_catalog()
+@lru_cache(maxsize=4)
+def _speech_voice_names(region: str) -> frozenset[str]:
+    # A region's voice list does not change within a run; failures raise and
+    # so are not cached.
+    _, data = _fetch_speech_voice_catalog(region)
     # Use ShortName which is the format used in SSML voice names (e.g., "en-US-JennyNeural")
-    voice_names = {v.get("ShortName") for v in data if v.get("ShortName")}
-    return region, voice_names
+    return frozenset(v.get("ShortName") for v in data if v.get("ShortName"))
+
+
+def _fetch_speech_voices() -> tuple[str, frozenset[str]]:
+    region = _get_speech_region()
+    return region, _speech_voice_names(region)
 
 
 def preflight_validate_voices(voices: list[str]) -> None:
@@ -146,9 +255,13 @@ def create_cosmos_client_with_retry(
     database_name: str = "certaudio",
     max_wait_seconds: int = 600,
     poll_seconds: int = 30,
+    first_poll_seconds: int = 2,
 ) -> CosmosClient:
+    # Poll quickly at first and back off to poll_seconds, so RBAC that
+    # propagates within seconds is not held up by a full polling interval.
     deadline = time.time() + max_wait_seconds
     last_error: Exception | None = None
+    delay = first_poll_seconds
 
     while time.time() < deadline:
         try:
@@ -162,19 +275,46 @@ def create_cosmos_client_with_retry(
             if "Request blocked by Auth" in msg or "Microsoft.DocumentDB" in msg or "Forbidden" in msg:
                 remaining = int(deadline - time.time())
                 print(
-                    f"Cosmos RBAC not ready/assigned yet; retrying in {poll_seconds}s (remaining ~{remaining}s)...",
+                    f"Cosmos RBAC not ready/assigned yet; retrying in {delay}s (remaining ~{remaining}s)...",
                     file=sys.stderr,
                 )
-                time.sleep(poll_seconds)
+                time.sleep(delay)
+                delay = min(delay * 2, poll_seconds)
                 continue
             raise
 
     raise last_error or TimeoutError("Timed out waiting for Cosmos RBAC")
 
 
-def call_openai_with_retry(openai_client: AzureOpenAI, max_retries: int = 5, **kwargs):
+def _retry_after_seconds(error: RateLimitError) -> Optional[float]:
+    """How long Azure OpenAI asked us to wait, if it said.
+
+    The quota window usually reopens well before the next exponential step,
+    so honouring the hint avoids sleeping through capacity we already have.
     """
-    Call OpenAI API with exponential backoff retry for rate limits.
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 1000.0), ("retry-after", 1.0)):
+        try:
+            return max(0.0, float(headers[name]) / scale)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+# Longest single wait between attempts, whatever the service or backoff says.
+OPENAI_MAX_RETRY_DELAY_SECONDS = 60
+
+# Paces chat requests against the deployment's quota (see rate_limit). Off
+# unless the limits are set; they should match the gpt-4o deployment's.
+_openai_limiter = RateLimiter(
+    requests_per_minute=int(os.environ.get("AOAI_RPM", "0")),
+    tokens_per_minute=int(os.environ.get("AOAI_TPM", "0")),
+)
+
+
+def call_openai_with_retry(openai_client: AzureOpenAI, max_retries: int = 8, **kwargs):
+    """
+    Call OpenAI API with backoff retry for rate limits and dropped connections.
     
     Args:
         openai_client: The Azure OpenAI client
@@ -185,32 +325,170 @@ def call_openai_with_retry(openai_client: AzureOpenAI, max_retries: int = 5, **k
         The API response
     """
     base_delay = 2  # Start with 2 second delay
+    if kwargs.get("stream"):
+        # Streamed responses only report usage in a final chunk when asked to.
+        kwargs.setdefault("stream_options", {"include_usage": True})
+    
+    estimated_tokens = estimate_chat_tokens(kwargs.get("messages", []), kwargs.get("max_tokens", 0))
     
     for attempt in range(max_retries):
+        _openai_limiter.acquire(estimated_tokens)
         try:
             response = openai_client.chat.completions.create(**kwargs)
+            if kwargs.get("stream"):
+                response = collect_stream(response)
             cost.record_gpt_usage(getattr(response, "usage", None))
             return response
-        except RateLimitError as e:
+        except (RateLimitError, APIConnectionError) as e:
             if attempt == max_retries - 1:
                 raise  # Re-raise on final attempt
             
-            # Extract retry-after if available, otherwise use exponential backoff
-            delay = base_delay * (2 ** attempt)  # 2, 4, 8, 16, 32 seconds
-            print(f"  Rate limit hit, retrying in {delay}s (attempt {attempt + 1}/{max_retries})...")
+            # Extract retry-after if available, otherwise use exponential backoff.
+            # The backoff is jittered so parallel workers that were throttled
+            # together do not all come back at the same moment.
+            delay = _retry_after_seconds(e) if isinstance(e, RateLimitError) else None
+            if delay is None:
+                delay = base_delay * (2 ** attempt)  # 2, 4, 8, 16, 32... seconds
+                delay += random.uniform(0, delay * 0.25)
+            delay = min(delay, OPENAI_MAX_RETRY_DELAY_SECONDS)
+            reason = "Rate limit hit" if isinstance(e, RateLimitError) else "Connection error"
+            print(f"  {reason}, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})...")
             time.sleep(delay)
     
     # Should not reach here, but just in case
     raise Exception("Max retries exceeded for OpenAI API call")
 
 
+def collect_stream(stream) -> SimpleNamespace:
+    """
+    Drain a streamed chat completion into the shape of a non-streamed one.
+
+    Tokens are consumed as the model emits them, so the connection never sits
+    idle for the full generation time, and the result can be used exactly like
+    a regular response (``choices[0].message.content`` and ``usage``).
+    """
+    parts = []
+    usage = None
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+    message = SimpleNamespace(content="".join(parts))
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+# Query embeddings are cached in process (which also covers the widened retry
+# in retrieve_content, searching with the same text a second time) and, when
+# EMBEDDING_CACHE_DIR is set, on disk across runs.
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR")
+EMBEDDING_MEMORY_ENTRIES = 1024
+
+_embeddings: "OrderedDict[str, tuple[float, ...]]" = OrderedDict()
+_embeddings_lock = threading.Lock()
+
+
+def _embedding_path(text: str) -> Optional[Path]:
+    if not EMBEDDING_CACHE_DIR:
+        return None
+    key = hashlib.sha256(f"{EMBEDDING_MODEL}::{text}".encode()).hexdigest()
+    return Path(EMBEDDING_CACHE_DIR) / f"{key}.f32"
+
+
+def _lookup_embedding(text: str) -> Optional[tuple[float, ...]]:
+    with _embeddings_lock:
+        if text in _embeddings:
+            _embeddings.move_to_end(text)
+            return _embeddings[text]
+    path = _embedding_path(text)
+    if path is None:
+        return None
+    try:
+        embedding = tuple(array("f", path.read_bytes()))
+    except OSError:
+        return None  # Not cached yet
+    _remember_embedding(text, embedding)
+    return embedding
+
+
+def _remember_embedding(text: str, embedding: tuple[float, ...]) -> None:
+    with _embeddings_lock:
+        _embeddings[text] = embedding
+        _embeddings.move_to_end(text)
+        while len(_embeddings) > EMBEDDING_MEMORY_ENTRIES:
+            _embeddings.popitem(last=False)
+
+
+def get_embeddings(texts: list[str], openai_client: AzureOpenAI) -> list[list[float]]:
+    """Embed several texts, in a single request for any not already cached."""
+    found = {text: _lookup_embedding(text) for text in dict.fromkeys(texts)}
+    missing = [text for text, embedding in found.items() if embedding is None]
+    if missing:
+        response = openai_client.embeddings.create(model=EMBEDDING_MODEL, input=missing)
+        if len(response.data) != len(missing):
+            raise RuntimeError(
+                f"Embedding request for {len(missing)} texts returned "
+                f"{len(response.data)} embeddings"
+            )
+        for item in response.data:
+            text = missing[item.index]
+            found[text] = tuple(item.embedding)
+            _remember_embedding(text, found[text])
+            path = _embedding_path(text)
+            if path is not None:
+                try:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    path.write_bytes(array("f", found[text]).tobytes())
+                except OSError as e:
+                    print(f"Warning: could not write embedding cache ({e})")
+    return [list(found[text]) for text in texts]
+
+
 def get_embedding(text: str, openai_client: AzureOpenAI) -> list[float]:
-    """Generate embedding for text using Azure OpenAI."""
-    response = openai_client.embeddings.create(
-        model="text-embedding-3-large",
-        input=text,
-    )
-    return response.data[0].embedding
+    """Generate embedding for text using Azure OpenAI, reusing cached vectors."""
+    return get_embeddings([text], openai_client)[0]
+
+
+_answered_queries: list[tuple[str, tuple[float, ...], float, dict]] = []
+_answered_queries_lock = threading.Lock()
+
+
+def _unit(vector) -> tuple[float, ...]:
+    norm = sum(x * x for x in vector) ** 0.5 or 1.0
+    return tuple(x / norm for x in vector)
+
+
+def _similar_answer(scope: str, vector: tuple[float, ...]) -> Optional[dict]:
+    """The cached retrieval for the nearest query in scope, if close enough."""
+    cutoff = time.time() - SEARCH_CACHE_TTL_SECONDS
+    best, best_score = None, SEARCH_CACHE_SIMILARITY
+    with _answered_queries_lock:
+        for entry_scope, entry_vector, stored_at, retrieved in _answered_queries:
+            if entry_scope != scope or stored_at < cutoff:
+                continue
+            score = sum(map(operator.mul, vector, entry_vector))
+            if score >= best_score:
+                best, best_score = retrieved, score
+    return best
+
+
+def _remember_answer(scope: str, vector: tuple[float, ...], retrieved: dict) -> None:
+    with _answered_queries_lock:
+        _answered_queries.append((scope, vector, time.time(), retrieved))
+        del _answered_queries[:-SEARCH_CACHE_MEMORY_ENTRIES]
+
+
+def build_query_text(skill_domain: str, skill_topics: list[str]) -> str:
+    """Search query for an episode: its domain plus the first ten topics."""
+    return f"{skill_domain}\n" + "\n".join(skill_topics[:10])
+
+
+def vector_retrieval_enabled() -> bool:
+    # "bm25" skips the embedding round trip and searches by keyword only; the
+    # model sees the same top-N chunks either way.
+    return os.environ.get("RETRIEVAL_MODE", "hybrid").lower() != "bm25"
 
 
 def retrieve_content(
@@ -233,7 +511,38 @@ def retrieve_content(
         Dict with 'content', 'source_urls', and 'content_hash'
     """
     # Build search query from domain and topics
-    query_text = f"{skill_domain}\n" + "\n".join(skill_topics[:10])  # Limit topics in query
+    query_text = build_query_text(skill_domain, skill_topics)
+    use_vector = vector_retrieval_enabled()
+
+    cache_path = None
+    semantic_scope = query_vector = None
+    if SEARCH_CACHE_TTL_SECONDS > 0:
+        cache_key = hashlib.sha256(json.dumps([
+            certification_id, query_text, source_urls or [], top, use_vector,
+            MAX_RETRIEVED_CHARS, MAX_CHUNK_CHARS,
+        ]).encode()).hexdigest()
+        cache_path = SEARCH_CACHE_DIR / f"{cache_key}.json"
+        try:
+            if time.time() - cache_path.stat().st_mtime < SEARCH_CACHE_TTL_SECONDS:
+                return json.loads(cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            pass  # Missing or unreadable: search as usual
+
+        if use_vector and SEARCH_CACHE_SIMILARITY > 0:
+            # The embedding is needed for the search anyway, and is cached.
+            semantic_scope = json.dumps([
+                certification_id, sorted(source_urls or []), top,
+                MAX_RETRIEVED_CHARS, MAX_CHUNK_CHARS,
+            ])
+            try:
+                query_vector = _unit(get_embedding(query_text, openai_client))
+            except Exception:
+                query_vector = None  # The search's own fallback will handle it
+            if query_vector is not None:
+                similar = _similar_answer(semantic_scope, query_vector)
+                if similar is not None:
+                    print("  - Reusing retrieval for a near-identical query")
+                    return similar
 
     # Defence in depth: certificationId is already validated at the admin API,
     # but OData string literals escape a quote by doubling it.
@@ -255,18 +564,23 @@ def retrieve_content(
                     k_nearest_neighbors=top,
                     fields="contentVector",
                 )],
-                select=["content", "sourceUrl", "title", "chunkId"],
+                # Filter before the ANN search, not after it: a post-filter
+                # over the shared index can leave fewer than top-k matches.
+                vector_filter_mode="preFilter",
+                select=["content", "sourceUrl", "title"],
                 filter=filter_expr,
                 top=top,
             )
         return search_client.search(
             search_text=query_text,
-            select=["content", "sourceUrl", "title", "chunkId"],
+            select=["content", "sourceUrl", "title"],
             filter=filter_expr,
             top=top,
         )
 
     def _collect(filter_expr: str) -> list:
+        if not use_vector:
+            return list(_run(filter_expr, vector=False))
         try:
             return list(_run(filter_expr, vector=True))
         except Exception as e:
@@ -283,27 +597,73 @@ def retrieve_content(
         )
         results = _collect(cert_filter)
 
-    # Aggregate results
-    content_parts = []
-    source_urls = set()
+    # Aggregate results, best-first, skipping near-duplicate chunks (the same
+    # passage is often published on more than one page) and stopping once the
+    # prompt budget is spent.
+    buf = io.StringIO()
+    chunk_count = 0
+    source_urls = {}  # ordered set: best-ranked first, stable across processes
+    seen_prefixes = set()
+    budget = MAX_RETRIEVED_CHARS
+    # Hashed as the chunks are written, over exactly the bytes of the combined
+    # content, so the digest matches hashing combined_content without a
+    # second pass over it.
+    hasher = hashlib.sha256()
 
     for result in results:
         title = result.get("title", "Content")
         content = result.get("content", "")
-        content_parts.append(f"## {title}\n\n{content}")
+        prefix = " ".join(content[:1000].lower().split())[:200]
+        if prefix in seen_prefixes:
+            continue
+        if len(content) > MAX_CHUNK_CHARS:
+            # Cut at the last word boundary, unless there is none to cut at.
+            head = content[:MAX_CHUNK_CHARS]
+            parts = head.rsplit(None, 1)
+            content = parts[0] if len(parts) > 1 else head
+        part = f"## {title}\n\n{content}"
+        if chunk_count and len(part) > budget:
+            break
+        seen_prefixes.add(prefix)
+        budget -= len(part)
+        if chunk_count:
+            buf.write(CONTENT_SEPARATOR)
+            hasher.update(CONTENT_SEPARATOR_BYTES)
+        buf.write(part)
+        hasher.update(part.encode())
+        chunk_count += 1
         if result.get("sourceUrl"):
-            source_urls.add(result["sourceUrl"])
+            source_urls[result["sourceUrl"]] = None
 
-    combined_content = "\n\n---\n\n".join(content_parts) if content_parts else "No content found for this topic."
+    if chunk_count:
+        combined_content = buf.getvalue()
+    else:
+        combined_content = "No content found for this topic."
+        hasher.update(combined_content.encode())
 
-    # Generate content hash for tracking changes
-    content_hash = hashlib.sha256(combined_content.encode()).hexdigest()[:16]
+    # Content hash for tracking changes
+    content_hash = hasher.hexdigest()[:16]
 
-    return {
+    retrieved = {
         "content": combined_content,
         "source_urls": list(source_urls),
         "content_hash": content_hash,
     }
+    if cache_path is not None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(json.dumps(retrieved), encoding="utf-8")
+        except OSError as e:
+            print(f"Warning: could not write search cache ({e})")
+    if query_vector is not None:
+        _remember_answer(semantic_scope, query_vector, retrieved)
+    return retrieved
+
+
+# The prompt asks for this much more than MIN_WORDS_PER_PART, so a narration
+# that lands a little short of what it was told still clears the floor and no
+# second, longer request is needed.
+NARRATION_LENGTH_HEADROOM = 1.2
 
 
 def generate_narration(
@@ -323,9 +683,9 @@ def generate_narration(
     min_words: int = 1200,
 ) -> str:
     """Generate narration script using Azure OpenAI."""
-    template = jinja_env.get_template("narration.jinja2")
-
-    prompt = template.render(
+    messages = render_messages(
+        jinja_env,
+        "narration",
         episode_number=episode_number,
         skill_domain=skill_domain,
         skill_topics=skill_topics,
@@ -340,20 +700,14 @@ def generate_narration(
         min_words=min_words,
     )
 
-    # Split system and user parts
-    parts = prompt.split("user:")
-    system_prompt = parts[0].replace("system:", "").strip()
-    user_prompt = parts[1].strip() if len(parts) > 1 else ""
-
     response = call_openai_with_retry(
         openai_client,
         model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
+        messages=messages,
         temperature=0.7,
-        max_tokens=4000,
+        # ~1.3 tokens per word, with room to spare so the floor is not cut off.
+        max_tokens=max(4000, int(min_words * 2.5)),
+        stream=True,
     )
 
     return response.choices[0].message.content
@@ -380,8 +734,15 @@ def generate_ssml(
     instructional_voice: str = "en-US-AndrewNeural",
     podcast_host_voice: str = "en-US-GuyNeural",
     podcast_expert_voice: str = "en-US-TonyNeural",
+    certification_id: Optional[str] = None,
+    use_gpt_cache: bool = False,
 ) -> str:
-    """Convert narration script to SSML."""
+    """Convert narration script to SSML.
+
+    With ``certification_id`` and ``use_gpt_cache``, LLM-generated SSML is
+    read from and written to the GPT output cache, keyed by the narration and
+    voices it was built from.
+    """
     # LLM-generated SSML has proven brittle (Speech rejects it with SSML parsing errors).
     # Default to deterministic SSML generation; keep LLM path for experimentation.
     use_llm = os.environ.get("USE_LLM_SSML", "false").lower() == "true"
@@ -393,8 +754,23 @@ def generate_ssml(
             podcast_expert_voice=podcast_expert_voice,
         )
 
-    template = jinja_env.get_template("ssml.jinja2")
-    prompt = template.render(
+    ssml_key = None
+    if certification_id and use_gpt_cache:
+        ssml_key = gpt_cache.cache_key(
+            prompt=prompt_version("ssml"),
+            narration=narration,
+            audio_format=audio_format,
+            instructional_voice=instructional_voice,
+            podcast_host_voice=podcast_host_voice,
+            podcast_expert_voice=podcast_expert_voice,
+        )
+        cached = gpt_cache.load(certification_id, "ssml", ssml_key)
+        if cached is not None:
+            return cached
+
+    messages = render_messages(
+        jinja_env,
+        "ssml",
         narration=narration,
         audio_format=audio_format,
         instructional_voice=instructional_voice,
@@ -402,17 +778,10 @@ def generate_ssml(
         podcast_expert_voice=podcast_expert_voice,
     )
 
-    parts = prompt.split("user:")
-    system_prompt = parts[0].replace("system:", "").strip()
-    user_prompt = parts[1].strip() if len(parts) > 1 else ""
-
     response = call_openai_with_retry(
         openai_client,
         model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
+        messages=messages,
         temperature=0.3,
         max_tokens=8000,
     )
@@ -422,13 +791,16 @@ def generate_ssml(
         lines = ssml.split("\n")
         ssml = "\n".join(lines[1:-1] if lines[-1].strip() == "```" else lines[1:])
 
-    return sanitize_ssml(
+    ssml = sanitize_ssml(
         ssml,
         audio_format,
         instructional_voice=instructional_voice,
         podcast_host_voice=podcast_host_voice,
         podcast_expert_voice=podcast_expert_voice,
     )
+    if ssml_key is not None:
+        gpt_cache.save(certification_id, "ssml", ssml_key, ssml)
+    return ssml
 
 
 def _is_dragon_hd_voice(voice_name: str) -> bool:
@@ -438,6 +810,14 @@ def _is_dragon_hd_voice(voice_name: str) -> bool:
     return is_dragon_hd_voice(voice_name)
 
 
+_SPEAKER_SPLIT = re.compile(r"(\[HOST\]|\[EXPERT\])")
+
+# The builder escapes every line it writes, so re-parsing its output is only a
+# safety net; bulk runs can turn it off. LLM SSML is always parsed, because
+# sanitize_ssml rewrites the tree.
+VALIDATE_SSML = os.environ.get("VALIDATE_SSML", "true").lower() == "true"
+
+
 def build_ssml_from_narration(
     narration: str,
     audio_format: str,
@@ -458,16 +838,21 @@ def build_ssml_from_narration(
         _is_dragon_hd_voice(podcast_expert_voice)
     )
 
-    def _normalize_text(text: str, use_breaks: bool = True) -> str:
+    use_breaks = not is_dragon_hd
+    buf = io.StringIO()
+
+    def _write_text(text: str) -> None:
         # Remove speaker markers if they appear in instructional.
         text = text.replace("[HOST]", "").replace("[EXPERT]", "")
-        lines = [ln.rstrip() for ln in text.splitlines()]
-        out_parts: list[str] = []
-        for ln in lines:
+        run = io.StringIO()
+        sep = ""
+        for ln in text.splitlines():
+            ln = ln.rstrip()
             if not ln.strip():
                 # For Dragon HD, skip break tags entirely; use space instead
                 if use_breaks:
-                    out_parts.append('<break time="300ms"/>')
+                    run.write(sep + '<break time="300ms"/>')
+                    sep = " "
                 continue
             # Escape the line FIRST to handle special characters, then replace [PAUSE]
             escaped_ln = escape(ln)
@@ -475,20 +860,29 @@ def build_ssml_from_narration(
             # For Dragon HD, just remove them
             if use_breaks:
                 escaped_ln = escaped_ln.replace("[PAUSE]", '<break time="500ms"/>')
+                run.write(sep + escaped_ln + ' <break time="200ms"/>')
             else:
-                escaped_ln = escaped_ln.replace("[PAUSE]", "")
-            out_parts.append(escaped_ln)
-            if use_breaks:
-                out_parts.append('<break time="200ms"/>')
-        return " ".join(out_parts).strip()
+                run.write(sep + escaped_ln.replace("[PAUSE]", ""))
+            sep = " "
+        buf.write(run.getvalue().strip())
+
+    def _write_voice(voice: str, text: str) -> None:
+        buf.write(f'<voice name="{voice}">')
+        # Skip prosody rate for Dragon HD voices - causes audio artifacts
+        if not is_dragon_hd:
+            buf.write('<prosody rate="-5%">')
+            _write_text(text)
+            buf.write("</prosody>")
+        else:
+            _write_text(text)
+        buf.write("</voice>")
 
-    speak_open = (
+    buf.write(
         '<speak version="1.0" '
         'xmlns="http://www.w3.org/2001/10/synthesis" '
         'xmlns:mstts="http://www.w3.org/2001/mstts" '
         'xml:lang="en-US">'
     )
-    speak_close = "</speak>"
 
     if audio_format == "podcast":
         # Two voices, switched by [HOST]/[EXPERT] markers.
@@ -496,9 +890,9 @@ def build_ssml_from_narration(
         expert_voice = podcast_expert_voice
 
         # Split while keeping markers.
-        tokens = re.split(r"(\[HOST\]|\[EXPERT\])", narration)
+        tokens = _SPEAKER_SPLIT.split(narration)
         current = "HOST"
-        chunks: list[str] = []
+        first = True
         for tok in tokens:
             if tok == "[HOST]":
                 current = "HOST"
@@ -508,28 +902,27 @@ def build_ssml_from_narration(
                 continue
             if not tok.strip():
                 continue
-            voice = host_voice if current == "HOST" else expert_voice
-            inner = _normalize_text(tok, use_breaks=not is_dragon_hd)
-            # Skip prosody rate for Dragon HD voices - causes audio artifacts
-            if not is_dragon_hd:
-                inner = f'<prosody rate="-5%">{inner}</prosody>'
-            chunks.append(f'<voice name="{voice}">{inner}</voice>')
-
-        ssml = speak_open + " ".join(chunks) + speak_close
-        ET.fromstring(ssml)  # validate
-        return ssml
-
-    # Instructional: single voice using the selected neural voice.
-    voice = instructional_voice
-    inner = _normalize_text(narration, use_breaks=not is_dragon_hd)
-    # Skip prosody rate for Dragon HD voices - causes audio artifacts
-    if not is_dragon_hd:
-        inner = f'<prosody rate="-5%">{inner}</prosody>'
-    ssml = speak_open + f'<voice name="{voice}">{inner}</voice>' + speak_close
-    ET.fromstring(ssml)  # validate
+            if not first:
+                buf.write(" ")
+            first = False
+            _write_voice(host_voice if current == "HOST" else expert_voice, tok)
+    else:
+        # Instructional: single voice using the selected neural voice.
+        _write_voice(instructional_voice, narration)
+
+    buf.write("</speak>")
+    ssml = buf.getvalue()
+    if VALIDATE_SSML:
+        etree.fromstring(ssml.encode("utf-8"))
     return ssml
 
 
+# ASCII control chars not allowed in XML, removed with one str.translate.
+_XML_CONTROL_CHARS = dict.fromkeys(c for c in range(0x20) if chr(c) not in "\t\n\r")
+_STRAY_AMPERSAND = re.compile(r"&(?!amp;|lt;|gt;|quot;|apos;|#\d+;|#x[0-9A-Fa-f]+;)")
+_XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+
 def sanitize_ssml(
     ssml: str,
     audio_format: str,
@@ -537,31 +930,18 @@ def sanitize_ssml(
     podcast_host_voice: str = "en-US-GuyNeural",
     podcast_expert_voice: str = "en-US-TonyNeural",
 ) -> str:
-    ssml_out = ssml.strip()
-
-    # Remove ASCII control chars not allowed in XML.
-    ssml_out = re.sub(r"[\x00-\x08\x0B\x0C\x0E-\x1F]", "", ssml_out)
+    ssml_out = ssml.strip().translate(_XML_CONTROL_CHARS)
 
-    # Remove any <lang> wrappers entirely (keep inner content).
-    ssml_out = re.sub(r"</?lang\b[^>]*>", "", ssml_out, flags=re.IGNORECASE)
+    # Escape stray '&' that aren't part of XML entities; nothing parses until they are.
+    ssml_out = _STRAY_AMPERSAND.sub("&amp;", ssml_out)
 
-    # Force speak root to en-US.
-    # If xml:lang exists, normalize it. If not, add it.
-    if re.search(r"<speak\b[^>]*\bxml:lang=", ssml_out, flags=re.IGNORECASE):
-        ssml_out = re.sub(
-            r"(<speak\b[^>]*\bxml:lang=)(['\"]).*?\2",
-            r"\1\2en-US\2",
-            ssml_out,
-            flags=re.IGNORECASE,
-        )
-    else:
-        ssml_out = re.sub(
-            r"<speak\b",
-            '<speak xml:lang="en-US"',
-            ssml_out,
-            count=1,
-            flags=re.IGNORECASE,
-        )
+    # Parse once and fix the tree in place, which also validates it, so we fail
+    # fast with a clearer local error if SSML is malformed.
+    try:
+        root = etree.fromstring(ssml_out.encode("utf-8"))
+    except etree.XMLSyntaxError as e:
+        snippet = ssml_out[:500].replace("\n", " ")
+        raise ValueError(f"Generated SSML is not well-formed XML: {e}. Snippet: {snippet}")
 
     # Allow the user-selected voices plus common Dragon HD and Neural voices
     # This list needs to include all voices that might be used in either format
@@ -577,36 +957,32 @@ def sanitize_ssml(
     # Replace any unexpected voice with the default neural voice.
     default_voice = instructional_voice
 
-    def _voice_repl(match: re.Match) -> str:
-        prefix = match.group(1)
-        quote = match.group(2)
-        voice_name = match.group(3)
-        if voice_name in allowed_voices:
-            return match.group(0)
-        return f"{prefix}{quote}{default_voice}{quote}"
-
-    ssml_out = re.sub(
-        r"(<voice\b[^>]*\bname=)(['\"])([^'\"]+)(\2)",
-        _voice_repl,
-        ssml_out,
-        flags=re.IGNORECASE,
-    )
+    lang_tags = set()
+    for el in root.iter():
+        if not isinstance(el.tag, str):
+            continue  # comments and processing instructions
+        name = etree.QName(el).localname.lower()
+        if name == "lang":
+            lang_tags.add(el.tag)
+        elif name == "voice" and el.get("name") not in (None, *allowed_voices):
+            el.set("name", default_voice)
 
-    # Escape stray '&' that aren't part of XML entities.
-    ssml_out = re.sub(
-        r"&(?!amp;|lt;|gt;|quot;|apos;|#\d+;|#x[0-9A-Fa-f]+;)",
-        "&amp;",
-        ssml_out,
-    )
+    # Remove any <lang> wrappers entirely (keep inner content).
+    if lang_tags:
+        etree.strip_tags(root, *lang_tags)
+
+    # Force speak root to en-US.
+    if etree.QName(root).localname.lower() == "speak":
+        root.set(_XML_LANG, "en-US")
+
+    return etree.tostring(root, encoding="unicode")
 
-    # Best-effort XML validation so we fail fast with a clearer local error if SSML is malformed.
-    try:
-        ET.fromstring(ssml_out)
-    except ET.ParseError as e:
-        snippet = ssml_out[:500].replace("\n", " ")
-        raise ValueError(f"Generated SSML is not well-formed XML: {e}. Snippet: {snippet}")
 
-    return ssml_out
+COSMOS_DB_DATABASE = os.environ.get("COSMOS_DB_DATABASE", "certaudio")
+
+
+def _episodes_container(cosmos_client: CosmosClient):
+    return cosmos_client.get_database_client(COSMOS_DB_DATABASE).get_container_client("episodes")
 
 
 def get_next_episode_number(
@@ -615,10 +991,7 @@ def get_next_episode_number(
     cosmos_client: CosmosClient,
 ) -> int:
     """Get the next episode number for a certification/format combo."""
-    database = cosmos_client.get_database_client(
-        os.environ.get("COSMOS_DB_DATABASE", "certaudio")
-    )
-    container = database.get_container_client("episodes")
+    container = _episodes_container(cosmos_client)
 
     query = """
         SELECT VALUE MAX(c.sequenceNumber)
@@ -631,11 +1004,12 @@ def get_next_episode_number(
         {"name": "@format", "value": audio_format},
     ]
 
+    # certificationId is the partition key, so this stays in one partition.
     results = list(
         container.query_items(
             query=query,
             parameters=params,
-            enable_cross_partition_query=True,
+            partition_key=certification_id,
         )
     )
 
@@ -650,11 +1024,8 @@ def episode_exists(
     cosmos_client: CosmosClient,
 ) -> bool:
     """Check if an episode already exists in Cosmos DB."""
-    database = cosmos_client.get_database_client(
-        os.environ.get("COSMOS_DB_DATABASE", "certaudio")
-    )
-    container = database.get_container_client("episodes")
-    
+    container = _episodes_container(cosmos_client)
+
     episode_id = f"{certification_id}-{audio_format}-{episode_number:03d}"
     
     try:
@@ -664,6 +1035,39 @@ def episode_exists(
         return False
 
 
+def existing_episode_numbers(
+    certification_id: str,
+    audio_format: str,
+    cosmos_client: CosmosClient,
+    first: Optional[int] = None,
+    last: Optional[int] = None,
+) -> set[int]:
+    """Sequence numbers already stored for a certification/format combo.
+
+    One query against the certification's partition, so a batch can check all
+    of its episodes without a point read each. ``first``/``last`` limit it to
+    the batch's own range, so a long course does not return every episode.
+    """
+    container = _episodes_container(cosmos_client)
+
+    query = """
+        SELECT VALUE c.sequenceNumber
+        FROM c
+        WHERE c.certificationId = @certId
+          AND c.format = @format
+    """
+    params = [
+        {"name": "@certId", "value": certification_id},
+        {"name": "@format", "value": audio_format},
+    ]
+    if first is not None and last is not None:
+        query += "  AND c.sequenceNumber BETWEEN @first AND @last\n"
+        params += [{"name": "@first", "value": first}, {"name": "@last", "value": last}]
+    return set(
+        container.query_items(query=query, parameters=params, partition_key=certification_id)
+    )
+
+
 def process_skill_domain(
     episode_number: int,
     skill_domain: str,
@@ -705,16 +1109,15 @@ def process_skill_domain(
     print(f"  - Content hash: {retrieved_content['content_hash']}")
 
     # Merge source URLs from discovery and retrieval
-    all_source_urls = list(set(source_urls + retrieved_content["source_urls"]))
+    all_source_urls = list(dict.fromkeys(source_urls + retrieved_content["source_urls"]))
     
     # Generate episode parts (may be 1 or more)
-    episode_docs = []
+    episodes = []
     part_number = 1
     current_episode_number = episode_number
     topics_covered_so_far = ""
     max_parts = 5  # Safety limit
     base_min_words = int(os.environ.get("MIN_WORDS_PER_PART", "1200"))
-    max_length_retries = 1
     
     while part_number <= max_parts:
         part_suffix = f" (Part {part_number})" if part_number > 1 else ""
@@ -723,38 +1126,32 @@ def process_skill_domain(
             domain_title = episode_title
         else:
             domain_title = f"{skill_domain}{part_suffix}"
-        
+    
         print(f"\nStep 2: Generating narration script{part_suffix}...")
-        min_words = base_min_words
-        for attempt in range(max_length_retries + 1):
-            narration = generate_narration(
-                episode_number=current_episode_number,
-                skill_domain=skill_domain,
-                skill_topics=skill_topics,
-                retrieved_content=retrieved_content,
-                audio_format=audio_format,
-                openai_client=openai_client,
-                jinja_env=jinja_env,
-                is_continuation=(part_number > 1),
-                part_number=part_number,
-                topics_covered_so_far=topics_covered_so_far,
-                min_words=min_words,
-            )
-
-            # Check if continuation is needed
-            has_more = needs_continuation(narration)
-            narration = clean_narration(narration)
-
-            word_count = len(narration.split())
-            print(f"  - Generated {word_count} words")
-            if has_more:
-                print("  - Content continues in next part...")
+        narration = generate_narration(
+            episode_number=current_episode_number,
+            skill_domain=skill_domain,
+            skill_topics=skill_topics,
+            retrieved_content=retrieved_content,
+            audio_format=audio_format,
+            openai_client=openai_client,
+            jinja_env=jinja_env,
+            is_continuation=(part_number > 1),
+            part_number=part_number,
+            topics_covered_so_far=topics_covered_so_far,
+            min_words=int(base_min_words * NARRATION_LENGTH_HEADROOM),
+        )
 
-            if word_count >= min_words or attempt == max_length_retries:
-                break
+        # Check if continuation is needed
+        has_more = needs_continuation(narration)
+        narration = clean_narration(narration)
 
-            min_words = int(min_words * 1.15)
-            print(f"  - Narration too short; retrying with min_words={min_words}")
+        word_count = len(narration.split())
+        print(f"  - Generated {word_count} words")
+        if has_more:
+            print("  - Content continues in next part...")
+        if word_count < base_min_words:
+            print(f"  - Warning: narration is short of {base_min_words} words; continuing")
 
         # 3. Convert to SSML
         print(f"Step 3: Converting to SSML{part_suffix}...")
@@ -780,79 +1177,198 @@ def process_skill_domain(
         )
         print(f"  - Duration: {audio_result['duration_seconds']:.1f} seconds")
 
-        # 5. Upload to blob storage
-        print(f"Step 5: Uploading to blob storage{part_suffix}...")
-        upload_result = upload_to_blob(
-            audio_file_path=audio_result["audio_path"],
-            script_content=narration,
-            ssml_content=ssml,
-            certification_id=certification_id,
-            audio_format=audio_format,
-            episode_number=current_episode_number,
-            word_boundaries=audio_result.get("word_boundaries"),
-        )
-        print(f"  - Audio URL: {upload_result['audio_url']}")
-
-        # 6. Save episode metadata to Cosmos DB
-        print(f"Step 6: Saving episode metadata{part_suffix}...")
-        episode_doc = save_episode(
+        # 5-6. Upload and save this part
+        episodes.append(_upload_and_save_part(
+            part_suffix=part_suffix,
+            narration=narration,
+            ssml=ssml,
+            audio_result=audio_result,
             certification_id=certification_id,
             audio_format=audio_format,
             episode_number=current_episode_number,
-            skill_domain=skill_domain,  # Original domain for grouping
+            skill_domain=skill_domain,
             skill_topics=skill_topics,
-            audio_url=upload_result["audio_url"],
-            script_url=upload_result["script_url"],
-            duration_seconds=audio_result["duration_seconds"],
-            is_amendment=False,
-            amendment_of=0,
             source_urls=all_source_urls,
             content_hash=retrieved_content["content_hash"],
-            title=domain_title,  # Title with part number for display
-            sync_url=upload_result.get("sync_url"),
-        )
-        print(f"  - Episode ID: {episode_doc['id']}")
-        
-        episode_docs.append(episode_doc)
-        
+            title=domain_title,
+        ))
+    
         if not has_more:
             break
-            
+        
         # Prepare for next part
         part_number += 1
         current_episode_number += 1
         # Track what we've covered (first ~100 words of previous narration as context)
         topics_covered_so_far = narration[:500] + "..."
-    
-    return episode_docs
+
+    return episodes
+
+
+def _upload_and_save_part(
+    part_suffix: str,
+    narration: str,
+    ssml: str,
+    audio_result: dict,
+    certification_id: str,
+    audio_format: str,
+    episode_number: int,
+    skill_domain: str,
+    skill_topics: list[str],
+    source_urls: list[str],
+    content_hash: str,
+    title: str,
+) -> dict:
+    # 5. Upload to blob storage
+    print(f"Step 5: Uploading to blob storage{part_suffix}...")
+    upload_result = upload_to_blob(
+        audio_data=audio_result["audio_data"],
+        script_content=narration,
+        ssml_content=ssml,
+        certification_id=certification_id,
+        audio_format=audio_format,
+        episode_number=episode_number,
+        word_boundaries=audio_result.get("word_boundaries"),
+    )
+    print(f"  - Audio URL: {upload_result['audio_url']}")
+
+    # 6. Save episode metadata to Cosmos DB
+    print(f"Step 6: Saving episode metadata{part_suffix}...")
+    episode_doc = save_episode(
+        certification_id=certification_id,
+        audio_format=audio_format,
+        episode_number=episode_number,
+        skill_domain=skill_domain,  # Original domain for grouping
+        skill_topics=skill_topics,
+        audio_url=upload_result["audio_url"],
+        script_url=upload_result["script_url"],
+        duration_seconds=audio_result["duration_seconds"],
+        is_amendment=False,
+        amendment_of=0,
+        source_urls=source_urls,
+        content_hash=content_hash,
+        title=title,  # Title with part number for display
+        sync_url=upload_result.get("sync_url"),
+    )
+    print(f"  - Episode ID: {episode_doc['id']}")
+    return episode_doc
 
 
 # Maximum concurrent TTS requests (Azure Speech S0 tier supports 20, we use 10 for safety)
 TTS_MAX_WORKERS = int(os.environ.get("TTS_MAX_WORKERS", "10"))
 
+# Maximum episodes prepared at once (retrieval + narration)
+PREPARE_MAX_WORKERS = int(os.environ.get("PREPARE_MAX_WORKERS", "4"))
 
-def split_narration_for_tts(narration: str, max_words_per_segment: int = 1400) -> list[str]:
-    """Split narration into segments to keep each TTS request under the Speech service limit.
+# Maximum concurrent episode uploads (pure Blob Storage I/O)
+UPLOAD_MAX_WORKERS = int(os.environ.get("UPLOAD_MAX_WORKERS", "8"))
+
+
+# Elements a segment may be cut inside of: each segment reopens them, so a cut
+# mid-voice keeps the voice, its prosody and speaking style.
+_SSML_WRAPPERS = {"speak", "voice", "prosody", "express-as", "p"}
+_SENTENCE_END = re.compile(r"(?<=[.!?])(\s+)")
+
+
+def _ssml_leaves(element, path: tuple, leaves: list) -> None:
+    """Flatten SSML into (wrapper path, text or element, words, cut after) leaves."""
+
+    def _text(text):
+        if not text:
+            return
+        pieces = _SENTENCE_END.split(text)
+        # Keep each sentence's trailing whitespace with it.
+        for i in range(0, len(pieces), 2):
+            piece = pieces[i] + (pieces[i + 1] if i + 1 < len(pieces) else "")
+            if piece:
+                leaves.append((path, piece, len(piece.split()), piece.rstrip().endswith((".", "!", "?"))))
+
+    path = path + (element,)
+    _text(element.text)
+    for child in element:
+        if not isinstance(child.tag, str):
+            pass  # comments and processing instructions
+        elif etree.QName(child).localname in _SSML_WRAPPERS:
+            _ssml_leaves(child, path, leaves)
+        else:
+            name = etree.QName(child).localname
+            words = len(" ".join(child.itertext()).split())
+            leaves.append((path, child, words, name in ("break", "s", "silence")))
+        _text(child.tail)
+
+
+def _build_ssml_segment(leaves: list) -> str:
+    root = None
+    open_path: list[tuple] = []  # (original wrapper, its copy)
+
+    for path, leaf, _, _ in leaves:
+        depth = 0
+        while depth < len(open_path) and depth < len(path) and open_path[depth][0] is path[depth]:
+            depth += 1
+        del open_path[depth:]
+        for wrapper in path[depth:]:
+            if open_path:
+                copy = etree.SubElement(open_path[-1][1], wrapper.tag, attrib=dict(wrapper.attrib))
+            else:
+                root = copy = etree.Element(wrapper.tag, attrib=dict(wrapper.attrib), nsmap=wrapper.nsmap)
+            open_path.append((wrapper, copy))
+
+        parent = open_path[-1][1]
+        if isinstance(leaf, str):
+            if len(parent):
+                parent[-1].tail = (parent[-1].tail or "") + leaf
+            else:
+                parent.text = (parent.text or "") + leaf
+        else:
+            copy = deepcopy(leaf)
+            copy.tail = None
+            parent.append(copy)
+
+    return etree.tostring(root, encoding="unicode")
+
+
+def split_ssml_for_tts(ssml: str, max_words_per_segment: int = 500) -> list[str]:
+    """Split SSML into balanced, self-contained segments for concurrent TTS requests.
+
+    The SSML is cut where it already pauses (after a sentence, a break, a
+    paragraph or a voice) and every segment reopens the <speak>, <voice> and
+    <prosody> elements it was cut inside, so whatever built the SSML, the
+    deterministic builder or the LLM, is what gets spoken. Segments are sized
+    evenly rather than greedily, so a 1,100-word narration becomes 400/400/300
+    instead of 500/500/100 and no single request dominates the episode's
+    wall-clock time.
 
     Note: this affects only audio synthesis chunking. It does NOT change narration generation
     or transcript length.
     """
-    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", narration) if p.strip()]
+    leaves: list = []
+    _ssml_leaves(etree.fromstring(ssml.encode("utf-8")), (), leaves)
+    total_words = sum(words for _, _, words, _ in leaves)
+    segment_count = max(1, -(-total_words // max(1, max_words_per_segment)))
+    target_words = total_words / segment_count
+
     segments: list[str] = []
-    current: list[str] = []
+    current: list = []
     current_words = 0
-
-    for p in paragraphs:
-        words = len(p.split())
-        if current and current_words + words > max_words_per_segment:
-            segments.append("\n\n".join(current).strip())
-            current = []
-            current_words = 0
-        current.append(p)
+    remaining = total_words
+
+    for i, leaf in enumerate(leaves):
+        path, _, words, _ = leaf
+        if current and remaining and current_words:
+            previous_path, _, _, cut_after = current[-1]
+            can_cut = cut_after or previous_path != path
+            if can_cut and (
+                current_words + words > max_words_per_segment or current_words >= target_words
+            ):
+                segments.append(_build_ssml_segment(current))
+                current = []
+                current_words = 0
+        current.append(leaf)
         current_words += words
+        remaining -= words
 
     if current:
-        segments.append("\n\n".join(current).strip())
+        segments.append(_build_ssml_segment(current))
 
     return segments
 
@@ -863,49 +1379,62 @@ def synthesize_audio_with_chunking(
     episode_number: int,
     certification_id: str,
     audio_format: str,
+    narration_words: Optional[int] = None,
+    on_segment=None,
 ) -> dict:
-    """Synthesize audio, splitting into multiple Speech requests when narration is long."""
+    """Synthesize audio, splitting into concurrent Speech requests when narration is long.
+
+    ``narration_words`` is the narration's word count when the caller already
+    has it, so it is not counted again. ``on_segment(index, audio)`` receives
+    each piece of the episode's MP3 as soon as it is ready; the result's
+    ``segment_count`` says how many there were.
+    """
     # If the SSML is already short, use the simple path.
-    narration_words = len(narration.split())
-    single_request_max_words = int(os.environ.get("TTS_SINGLE_REQUEST_MAX_WORDS", "1600"))
-    max_words_per_segment = int(os.environ.get("TTS_MAX_WORDS_PER_SEGMENT", "1400"))
+    if narration_words is None:
+        narration_words = len(narration.split())
+    single_request_max_words = int(os.environ.get("TTS_SINGLE_REQUEST_MAX_WORDS", "500"))
+    max_words_per_segment = int(os.environ.get("TTS_MAX_WORDS_PER_SEGMENT", "500"))
 
     # Clamp segment size so we don't accidentally create segments larger than the single-request threshold.
     if max_words_per_segment > single_request_max_words:
         max_words_per_segment = single_request_max_words
 
     if narration_words <= single_request_max_words:
-        return synthesize_audio(
+        audio_result = synthesize_audio(
             ssml_content=ssml,
             episode_number=episode_number,
             certification_id=certification_id,
             audio_format=audio_format,
         )
+        if on_segment is not None:
+            on_segment(0, audio_result["audio_data"])
+        audio_result["segment_count"] = 1
+        return audio_result
 
-    segments = split_narration_for_tts(narration, max_words_per_segment=max_words_per_segment)
-    ssml_segments = [build_ssml_from_narration(seg, audio_format) for seg in segments]
+    # The caller's SSML is split, not rebuilt from the narration, so LLM SSML
+    # keeps its markup however many segments the episode takes.
+    ssml_segments = split_ssml_for_tts(ssml, max_words_per_segment=max_words_per_segment)
 
-    # Build output path consistent with synthesize_audio.
-    import tempfile
-    temp_dir = tempfile.mkdtemp()
     filename = f"{certification_id}_{audio_format}_{episode_number:03d}.mp3"
-    output_path = os.path.join(temp_dir, filename)
 
     print(f"Narration is long ({narration_words} words); synthesizing in {len(ssml_segments)} segment(s)...")
 
     # Capture word boundary events across all segments
     word_boundaries: list[dict] = []
-    ok, duration = synthesize_audio_segments(ssml_segments, output_path, word_boundaries=word_boundaries)
-    if not ok:
+    audio_data, duration = synthesize_segments_bytes(
+        ssml_segments, word_boundaries=word_boundaries, on_segment=on_segment
+    )
+    if audio_data is None:
         raise RuntimeError(f"Audio synthesis failed for episode {episode_number}")
 
     print(f"  - {len(word_boundaries)} word boundaries captured across segments")
 
     return {
-        "audio_path": output_path,
+        "audio_data": audio_data,
         "duration_seconds": duration,
         "filename": filename,
         "word_boundaries": word_boundaries,
+        "segment_count": len(ssml_segments),
     }
 
 
@@ -923,10 +1452,15 @@ def prepare_episode(
     podcast_host_voice: str,
     podcast_expert_voice: str,
     episode_title: str,
+    use_gpt_cache: bool = True,
 ) -> dict:
     """
     Prepare episode content (retrieval + narration + SSML) without synthesizing audio.
     Returns a dict with all data needed for TTS and finalization.
+
+    A narration already generated from the same grounding content is reused
+    from the GPT cache unless ``use_gpt_cache`` is False; it is still written
+    back either way.
     """
     print(f"\n--- Episode {episode_number}: {episode_title} ---")
     
@@ -941,15 +1475,30 @@ def prepare_episode(
         source_urls=source_urls,
     )
     
-    all_source_urls = list(set(source_urls + retrieved_content["source_urls"]))
+    # Ordered dedupe: the episode's own units first, in discovery order, so the
+    # stored sourceUrls are the same from one run to the next.
+    all_source_urls = list(dict.fromkeys(source_urls + retrieved_content["source_urls"]))
     
     # 2. Generate narration
     print("  [2/3] Generating narration...")
     base_min_words = int(os.environ.get("MIN_WORDS_PER_PART", "1200"))
-    max_length_retries = 1
+    narration_key = gpt_cache.cache_key(
+        episode_number=episode_number,
+        skill_domain=skill_domain,
+        skill_topics=skill_topics,
+        audio_format=audio_format,
+        content_hash=retrieved_content["content_hash"],
+        min_words=base_min_words,
+        prompt=prompt_version("narration"),
+    )
+    narration = (
+        gpt_cache.load(certification_id, "narration", narration_key) if use_gpt_cache else None
+    )
     
-    min_words = base_min_words
-    for attempt in range(max_length_retries + 1):
+    if narration is not None:
+        word_count = len(narration.split())
+        print("    Reusing cached narration")
+    else:
         narration = generate_narration(
             episode_number=episode_number,
             skill_domain=skill_domain,
@@ -961,17 +1510,14 @@ def prepare_episode(
             is_continuation=False,
             part_number=1,
             topics_covered_so_far="",
-            min_words=min_words,
+            min_words=int(base_min_words * NARRATION_LENGTH_HEADROOM),
         )
-        
         narration = clean_narration(narration)
         word_count = len(narration.split())
+        if word_count < base_min_words:
+            print(f"    Warning: narration is short of {base_min_words} words; continuing")
         
-        if word_count >= min_words or attempt == max_length_retries:
-            break
-        
-        min_words = int(min_words * 1.15)
-        print(f"    Narration too short ({word_count} words); retrying...")
+        gpt_cache.save(certification_id, "narration", narration_key, narration)
     
     print(f"    Generated {word_count} words")
     
@@ -985,6 +1531,8 @@ def prepare_episode(
         instructional_voice=instructional_voice,
         podcast_host_voice=podcast_host_voice,
         podcast_expert_voice=podcast_expert_voice,
+        certification_id=certification_id,
+        use_gpt_cache=use_gpt_cache,
     )
     
     return {
@@ -993,6 +1541,7 @@ def prepare_episode(
         "skill_topics": skill_topics,
         "episode_title": episode_title,
         "narration": narration,
+        "word_count": word_count,
         "ssml": ssml,
         "source_urls": all_source_urls,
         "content_hash": retrieved_content["content_hash"],
@@ -1005,32 +1554,52 @@ def synthesize_episode_audio(
     audio_format: str,
 ) -> dict:
     """
-    Synthesize audio for a prepared episode. This is the slow step that runs in parallel.
-    Thread-safe: only uses local state and Azure Speech API calls.
+    Synthesize and upload audio for a prepared episode. This is the slow step that runs in parallel.
+    Thread-safe: only uses local state, Azure Speech and Blob Storage calls.
+
+    Each piece of the MP3 is staged in Blob Storage as soon as it is
+    synthesized, while the rest of the episode is still being spoken, and the
+    pieces are committed once all are done. The upload so overlaps synthesis
+    both within the episode and across the batch.
     """
-    return synthesize_audio_with_chunking(
+    episode_number = prepared["episode_number"]
+
+    def _stage(index: int, audio: bytes) -> None:
+        stage_audio_segment(audio, certification_id, audio_format, episode_number, index)
+
+    audio_result = synthesize_audio_with_chunking(
         narration=prepared["narration"],
         ssml=prepared["ssml"],
-        episode_number=prepared["episode_number"],
+        episode_number=episode_number,
         certification_id=certification_id,
         audio_format=audio_format,
+        narration_words=prepared.get("word_count"),
+        on_segment=_stage,
     )
+    del audio_result["audio_data"]
+    audio_result["audio_url"] = commit_audio_segments(
+        audio_result.pop("segment_count"),
+        certification_id,
+        audio_format,
+        episode_number,
+    )
+    return audio_result
 
 
-def finalize_episode(
+def upload_episode(
     prepared: dict,
     certification_id: str,
     audio_format: str,
-    cosmos_client: CosmosClient,
 ) -> dict:
     """
-    Upload audio and save episode to Cosmos DB.
+    Upload a synthesized episode's text artifacts and build its (unsaved) document.
+    The audio itself was uploaded by synthesize_episode_audio.
     """
     audio_result = prepared["audio_result"]
     
     # Upload to blob storage
     upload_result = upload_to_blob(
-        audio_file_path=audio_result["audio_path"],
+        audio_data=None,
         script_content=prepared["narration"],
         ssml_content=prepared["ssml"],
         certification_id=certification_id,
@@ -1039,14 +1608,13 @@ def finalize_episode(
         word_boundaries=audio_result.get("word_boundaries"),
     )
     
-    # Save to Cosmos DB
-    episode_doc = save_episode(
+    return build_episode_doc(
         certification_id=certification_id,
         audio_format=audio_format,
         episode_number=prepared["episode_number"],
         skill_domain=prepared["skill_domain"],
         skill_topics=prepared["skill_topics"],
-        audio_url=upload_result["audio_url"],
+        audio_url=audio_result["audio_url"],
         script_url=upload_result["script_url"],
         duration_seconds=audio_result["duration_seconds"],
         is_amendment=False,
@@ -1056,8 +1624,6 @@ def finalize_episode(
         title=prepared["episode_title"],
         sync_url=upload_result.get("sync_url"),
     )
-    
-    return episode_doc
 
 
 DEFAULT_INSTRUCTIONAL_VOICE = "en-US-Andrew:DragonHDLatestNeural"
@@ -1079,6 +1645,7 @@ def run_generation(
     force_regenerate: bool = False,
     search_index_name: str = SHARED_SEARCH_INDEX,
     progress: object = None,
+    use_gpt_cache: bool = True,
 ) -> dict:
     """Generate one batch of episodes in-process.
 
@@ -1099,6 +1666,7 @@ def run_generation(
         discovery_json=None,
         search_index_name=search_index_name,
         progress=progress,
+        use_gpt_cache=use_gpt_cache,
     )
     return _generate(args)
 
@@ -1124,6 +1692,8 @@ def main() -> None:
                         help="Path to deep_discovery_results.json (used to surface confidence score)")
     parser.add_argument("--search-index-name", default=SHARED_SEARCH_INDEX,
                         help="AI Search index to retrieve grounding content from")
+    parser.add_argument("--no-gpt-cache", dest="use_gpt_cache", action="store_false",
+                        help="Regenerate narrations even if a cached one matches the content")
 
     args = parser.parse_args()
 
@@ -1254,23 +1824,21 @@ def _generate(args) -> dict:
         openai_client = AzureOpenAI(
             azure_endpoint=openai_endpoint,
             api_key=openai_api_key,
-            api_version="2024-02-01",
+            api_version="2024-10-21",
         )
     else:
         openai_client = AzureOpenAI(
             azure_endpoint=openai_endpoint,
-            azure_ad_token_provider=lambda: token_credential.get_token(
-                "https://cognitiveservices.azure.com/.default"
-            ).token,
-            api_version="2024-02-01",
+            azure_ad_token_provider=get_bearer_token_provider(
+                token_credential, "https://cognitiveservices.azure.com/.default"
+            ),
+            api_version="2024-10-21",
         )
 
     # Cosmos DB account has disableLocalAuth=true, so we must use Entra ID tokens.
     cosmos_client = create_cosmos_client_with_retry(cosmos_endpoint, token_credential)
 
-    # Set up Jinja2 environment for prompts
-    prompts_dir = Path(__file__).parent / "prompts"
-    jinja_env = Environment(loader=FileSystemLoader(prompts_dir))
+    jinja_env = get_jinja_env()
 
     # Deterministic episode numbering to support parallel batch generation.
     # Episode numbers are based on the global index of the episode unit.
@@ -1279,17 +1847,26 @@ def _generate(args) -> dict:
     if args.force_regenerate:
         print("Force regenerate mode: will overwrite existing episodes")
 
-    # Process each episode unit in the batch
-    # Phase 1: Prepare all episodes (content retrieval + narration generation)
-    # This is done sequentially as GPT calls benefit from rate limit backoff
-    prepared_episodes = []
+    # Process each episode unit in the batch: prepare (content retrieval +
+    # narration), synthesize and upload, each stage with its own pool. Each
+    # preparing worker has one GPT call in flight at a time and
+    # call_openai_with_retry absorbs any 429s, so a small pool is safe.
     skipped_episodes = []
     errors: list[str] = []
     
     print(f"\n{'='*60}")
-    print(f"PHASE 1: Preparing narrations for {len(batch_units)} episodes")
+    print(f"PREPARE → SYNTHESIZE → UPLOAD: {len(batch_units)} episodes "
+          f"(max {PREPARE_MAX_WORKERS} preparing, {TTS_MAX_WORKERS} synthesizing)")
     print(f"{'='*60}")
     
+    existing = (
+        set() if args.force_regenerate
+        else existing_episode_numbers(
+            args.certification_id, args.audio_format, cosmos_client,
+            first=base_episode_number, last=base_episode_number + len(batch_units) - 1,
+        )
+    )
+    to_prepare = []
     for i, unit in enumerate(batch_units):
         episode_number = base_episode_number + i
         # Build episode title with part number if multi-part domain
@@ -1299,16 +1876,48 @@ def _generate(args) -> dict:
             episode_title = unit["domain"]
         
         # Check if episode already exists (skip unless force-regenerate)
-        if not args.force_regenerate and episode_exists(
-            args.certification_id, args.audio_format, episode_number, cosmos_client
-        ):
+        if episode_number in existing:
             print(f"\nSkipping episode {episode_number}: {episode_title} (already exists)")
             skipped_episodes.append({"number": episode_number, "title": episode_title})
             continue
-        
+        to_prepare.append((episode_number, episode_title, unit))
+    
+    # Embed every episode's search query in one request up front; each
+    # retrieve_content then finds its vector in the embedding cache.
+    if to_prepare and vector_retrieval_enabled():
         try:
+            get_embeddings(
+                [build_query_text(unit["domain"], unit["topics"]) for _, _, unit in to_prepare],
+                openai_client,
+            )
+        except Exception as e:
+            print(f"Warning: batched query embedding failed ({e}); embedding per episode")
+    
+    # The phases are pipelined rather than separated by barriers: an episode
+    # goes to the synthesis pool as soon as its narration is ready, and its
+    # text artifacts to the upload pool as soon as its audio is, so Speech
+    # capacity is not left idle while the rest of the batch is still being
+    # written. Each episode is saved as soon as its upload lands, so a run
+    # that dies part way keeps everything it finished and the next run skips
+    # it rather than paying for its audio again.
+    synthesized_count = 0
+    upload_futures = []
+
+    def _upload_and_save(ep: dict) -> dict:
+        doc = upload_episode(ep, args.certification_id, args.audio_format)
+        return save_episodes([doc])[0]
+
+    with ThreadPoolExecutor(max_workers=PREPARE_MAX_WORKERS) as prep_executor, \
+            ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS) as tts_executor, \
+            ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS) as upload_executor:
+        if to_prepare:
+            # Opens Speech connections while the first narrations are written.
+            tts_executor.submit(prewarm_synthesizers, min(TTS_MAX_WORKERS, len(to_prepare)))
+
+        prep_futures = {
             # Prepare episode (content retrieval + narration + SSML)
-            prepared = prepare_episode(
+            prep_executor.submit(
+                prepare_episode,
                 episode_number=episode_number,
                 skill_domain=unit["domain"],
                 skill_topics=unit["topics"],
@@ -1322,62 +1931,68 @@ def _generate(args) -> dict:
                 podcast_host_voice=args.podcast_host_voice,
                 podcast_expert_voice=args.podcast_expert_voice,
                 episode_title=episode_title,
-            )
-            prepared_episodes.append(prepared)
-        except Exception as e:
-            msg = f"Error preparing '{episode_title}' (episode {episode_number}): {e}"
-            print(f"\n{msg}", file=sys.stderr)
-            errors.append(msg)
-    
-    # Phase 2: Synthesize audio in parallel (this is the slow part)
-    print(f"\n{'='*60}")
-    print(f"PHASE 2: Synthesizing {len(prepared_episodes)} episodes in parallel (max {TTS_MAX_WORKERS} concurrent)")
-    print(f"{'='*60}")
-    
-    synthesized_episodes = []
-    with ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS) as executor:
-        future_to_episode = {
-            executor.submit(
-                synthesize_episode_audio,
-                ep,
-                args.certification_id,
-                args.audio_format,
-            ): ep
-            for ep in prepared_episodes
+                use_gpt_cache=args.use_gpt_cache,
+            ): (episode_number, episode_title)
+            for episode_number, episode_title, unit in to_prepare
         }
-        
-        for future in as_completed(future_to_episode):
-            ep = future_to_episode[future]
-            try:
-                audio_result = future.result()
-                ep["audio_result"] = audio_result
-                synthesized_episodes.append(ep)
-                print(f"  ✓ Episode {ep['episode_number']}: {audio_result['duration_seconds']:.1f}s")
-            except Exception as e:
-                msg = f"Error synthesizing episode {ep['episode_number']}: {e}"
-                print(f"  ✗ {msg}", file=sys.stderr)
-                errors.append(msg)
-    
-    # Phase 3: Upload and save (relatively fast, done sequentially)
+
+        # One loop drives both stages, so a finished episode is handed to the
+        # upload pool straight away rather than waiting for the slowest
+        # narration in the batch.
+        tts_futures = {}
+        pending = set(prep_futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in prep_futures:
+                    episode_number, episode_title = prep_futures[future]
+                    try:
+                        prepared = future.result()
+                    except Exception as e:
+                        msg = f"Error preparing '{episode_title}' (episode {episode_number}): {e}"
+                        print(f"\n{msg}", file=sys.stderr)
+                        errors.append(msg)
+                        continue
+                    print(f"  → Episode {episode_number} prepared; synthesizing (max {TTS_MAX_WORKERS} concurrent)")
+                    tts_future = tts_executor.submit(
+                        synthesize_episode_audio,
+                        prepared,
+                        args.certification_id,
+                        args.audio_format,
+                    )
+                    tts_futures[tts_future] = prepared
+                    pending.add(tts_future)
+                    continue
+
+                # Audio is done: upload the script, SSML and sync data.
+                ep = tts_futures[future]
+                try:
+                    audio_result = future.result()
+                    ep["audio_result"] = audio_result
+                    synthesized_count += 1
+                    print(f"  ✓ Episode {ep['episode_number']}: {audio_result['duration_seconds']:.1f}s")
+                except Exception as e:
+                    msg = f"Error synthesizing episode {ep['episode_number']}: {e}"
+                    print(f"  ✗ {msg}", file=sys.stderr)
+                    errors.append(msg)
+                    continue
+                upload_futures.append((ep, upload_executor.submit(_upload_and_save, ep)))
+
     print(f"\n{'='*60}")
-    print(f"PHASE 3: Uploading and saving {len(synthesized_episodes)} episodes")
+    print(f"SAVED EPISODES ({synthesized_count} synthesized)")
     print(f"{'='*60}")
-    
+
     generated_episodes = []
-    for ep in synthesized_episodes:
+    for ep, future in sorted(upload_futures, key=lambda item: item[0]["episode_number"]):
         try:
-            episode_doc = finalize_episode(
-                ep,
-                args.certification_id,
-                args.audio_format,
-                cosmos_client,
-            )
-            generated_episodes.append(episode_doc)
-            print(f"  ✓ Saved {episode_doc['id']}")
+            episode_doc = future.result()
         except Exception as e:
             msg = f"Error finalizing episode {ep['episode_number']}: {e}"
             print(f"  ✗ {msg}", file=sys.stderr)
             errors.append(msg)
+            continue
+        generated_episodes.append(episode_doc)
+        print(f"  ✓ Saved {episode_doc['id']}")
 
     # Summary
     print(f"\n{'='*60}")
@@ -5,12 +5,28 @@ Generate episode index JSON and upload to blob storage.
 import argparse
 import json
 import os
+from collections import defaultdict
 from datetime import datetime, timezone
+from functools import lru_cache
 
 from azure.cosmos import CosmosClient
-from azure.identity import DefaultAzureCredential
 from azure.storage.blob import BlobServiceClient, ContentSettings
 
+from .credentials import get_credential
+
+
+@lru_cache(maxsize=None)
+def _get_cosmos_client(cosmos_endpoint: str) -> CosmosClient:
+    return CosmosClient(cosmos_endpoint, get_credential())
+
+
+@lru_cache(maxsize=None)
+def _get_blob_service(storage_account_name: str) -> BlobServiceClient:
+    return BlobServiceClient(
+        account_url=f"https://{storage_account_name}.blob.core.windows.net",
+        credential=get_credential(),
+    )
+
 
 def generate_index(
     certification_id: str,
@@ -33,90 +49,85 @@ def generate_index(
     Returns:
         Index data
     """
-    credential = DefaultAzureCredential()
-    
     # Get episodes from Cosmos DB
-    cosmos_client = CosmosClient(cosmos_endpoint, credential)
+    cosmos_client = _get_cosmos_client(cosmos_endpoint)
     database = cosmos_client.get_database_client(database_name)
     container = database.get_container_client("episodes")
     
+    # Scoped to the certification's partition, so the query runs against one
+    # partition without a cross-partition plan, and projected to the fields
+    # the index publishes rather than whole episode documents.
     query = """
-        SELECT * FROM c 
-        WHERE c.certificationId = @certId AND c.format = @format
+        SELECT c.id, c.sequenceNumber, c.title, c.durationSeconds, c.isAmendment,
+               c.amendmentOf, c.skillTopics, c.skillDomain, c.createdAt
+        FROM c
+        WHERE c.format = @format
         ORDER BY c.sequenceNumber
     """
     params = [
-        {"name": "@certId", "value": certification_id},
         {"name": "@format", "value": audio_format},
     ]
     
-    episodes = list(
-        container.query_items(
-            query=query,
-            parameters=params,
-            enable_cross_partition_query=True,
-        )
-    )
+    # One pass over the paged results: episodes are grouped as they arrive
+    # rather than held in a list and walked again.
+    domains = defaultdict(list)
+    total_episodes = 0
+    total_duration = 0
+    base_count = 0
+    base_sequence_numbers = set()
+    for ep in container.query_items(
+        query=query,
+        parameters=params,
+        partition_key=certification_id,
+        max_item_count=1000,
+    ):
+        total_episodes += 1
+        total_duration += ep.get("durationSeconds", 0)
+        if not ep.get("isAmendment", False):
+            base_count += 1
+            base_sequence_numbers.add(int(ep.get("sequenceNumber", 0)))
+        domains[ep.get("skillDomain", "Other")].append({
+            "id": ep["id"],
+            "sequenceNumber": ep["sequenceNumber"],
+            "title": ep["title"],
+            "durationSeconds": ep.get("durationSeconds", 0),
+            "isAmendment": ep.get("isAmendment", False),
+            "amendmentOf": ep.get("amendmentOf"),
+            "skillTopics": ep.get("skillTopics", []),
+            "createdAt": ep.get("createdAt"),
+        })
 
     # Validation gate: require a complete base set of episodes when min_episodes is provided.
     # This avoids "success" when only a subset was generated (or when gaps exist due to
     # partial failures/overwrites).
-    base_episodes = [ep for ep in episodes if not ep.get("isAmendment", False)]
-    base_sequence_numbers = {int(ep.get("sequenceNumber", 0)) for ep in base_episodes}
-
-    if min_episodes and len(base_episodes) < min_episodes:
+    if min_episodes and base_count < min_episodes:
         raise RuntimeError(
-            f"Refusing to publish index: found {len(base_episodes)} base episode(s) for {certification_id}/{audio_format} "
+            f"Refusing to publish index: found {base_count} base episode(s) for {certification_id}/{audio_format} "
             f"(min required: {min_episodes})."
         )
 
     if min_episodes:
-        missing = [n for n in range(1, min_episodes + 1) if n not in base_sequence_numbers]
+        missing = sorted(set(range(1, min_episodes + 1)) - base_sequence_numbers)
         if missing:
             raise RuntimeError(
                 f"Refusing to publish index: missing base episode sequenceNumber(s) {missing} for {certification_id}/{audio_format}."
             )
     
-    # Group by skill domain
-    domains = {}
-    total_duration = 0
-    
-    for ep in episodes:
-        domain = ep.get("skillDomain", "Other")
-        if domain not in domains:
-            domains[domain] = []
-        
-        domains[domain].append({
-            "id": ep["id"],
-            "sequenceNumber": ep["sequenceNumber"],
-            "title": ep["title"],
-            "durationSeconds": ep.get("durationSeconds", 0),
-            "isAmendment": ep.get("isAmendment", False),
-            "amendmentOf": ep.get("amendmentOf"),
-            "skillTopics": ep.get("skillTopics", []),
-            "createdAt": ep.get("createdAt"),
-        })
-        
-        total_duration += ep.get("durationSeconds", 0)
-    
     # Create index
     index_data = {
         "certificationId": certification_id,
         "format": audio_format,
-        "totalEpisodes": len(episodes),
+        "totalEpisodes": total_episodes,
         "totalDurationSeconds": total_duration,
         "totalDurationMinutes": round(total_duration / 60, 1),
-        "domains": domains,
+        "domains": dict(domains),
         "generatedAt": datetime.now(timezone.utc).isoformat(),
     }
 
 
     
     # Upload to blob storage
-    blob_service = BlobServiceClient(
-        account_url=f"https://{storage_account_name}.blob.core.windows.net",
-        credential=credential,
-    )
+    blob_service = _get_blob_service(storage_account_name)
     
     # Fixed container name with path prefix for organization
     container_name = "audio"
@@ -130,13 +141,15 @@ def generate_index(
     
     # Upload index with path prefix
     blob_client = container_client.get_blob_client(f"{certification_id}/{audio_format}/metadata/index.json")
+    # Compact and already encoded: it is read by code, not people, and the
+    # indentation was a large share of the bytes downloaded.
     blob_client.upload_blob(
-        json.dumps(index_data, indent=2),
+        json.dumps(index_data, separators=(",", ":")).encode("utf-8"),
         overwrite=True,
         content_settings=ContentSettings(content_type="application/json"),
     )
     
-    print(f"Index generated: {len(episodes)} episodes, {index_data['totalDurationMinutes']} minutes total")
+    print(f"Index generated: {total_episodes} episodes, {index_data['totalDurationMinutes']} minutes total")
     
     return index_data
 
@@ -0,0 +1,53 @@
+"""Blob-backed cache for GPT outputs.
+
+A re-run of a batch (after a TTS failure, say) would otherwise pay for the same
+narration again even though the grounding content has not changed. Entries
+live under the certification's prefix in the scripts container, so a course
+teardown removes them with everything else.
+
+The cache is best-effort: any storage error is treated as a miss.
+"""
+
+import hashlib
+import json
+from typing import Optional
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import ContentSettings
+
+from .upload_to_blob import get_blob_service_client
+
+CACHE_CONTAINER = "scripts"
+
+
+def cache_key(**inputs) -> str:
+    """Stable digest of everything the cached output depends on."""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _blob(certification_id: str, kind: str, key: str):
+    return get_blob_service_client().get_blob_client(
+        container=CACHE_CONTAINER, blob=f"{certification_id}/cache/{kind}/{key}.txt"
+    )
+
+
+def load(certification_id: str, kind: str, key: str) -> Optional[str]:
+    """Return the cached text, or None on a miss."""
+    try:
+        return _blob(certification_id, kind, key).download_blob().readall().decode("utf-8")
+    except ResourceNotFoundError:
+        return None
+    except Exception as e:
+        print(f"  Warning: GPT cache read failed ({e}); regenerating")
+        return None
+
+
+def save(certification_id: str, kind: str, key: str, text: str) -> None:
+    try:
+        _blob(certification_id, kind, key).upload_blob(
+            text.encode("utf-8"),
+            overwrite=True,
+            content_settings=ContentSettings(content_type="text/plain; charset=utf-8"),
+        )
+    except Exception as e:
+        print(f"  Warning: GPT cache write failed ({e})")
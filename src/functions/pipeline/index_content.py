@@ -7,13 +7,18 @@ import hashlib
 import json
 import os
 import time
+from array import array
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
-import requests
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
 from . import source_store
-from .content_hash import HEADERS as PAGE_HEADERS, compute_content_hash
-from azure.identity import DefaultAzureCredential
+from .content_hash import NON_CONTENT_TAGS, compute_content_hash, fetch_page_content
+from .credentials import get_credential
+from azure.identity import get_bearer_token_provider
 from azure.search.documents import SearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
@@ -23,6 +28,9 @@ from azure.search.documents.indexes.models import (
     VectorSearch,
     HnswAlgorithmConfiguration,
     VectorSearchProfile,
+    BinaryQuantizationCompression,
+    RescoringOptions,
+    VectorSearchCompressionRescoreStorageMethod,
     SemanticConfiguration,
     SemanticField,
     SemanticPrioritizedFields,
@@ -34,7 +42,14 @@ from openai import AuthenticationError
 
 
 def create_search_index(index_client: SearchIndexClient, index_name: str) -> None:
-    """Create the search index with vector search capabilities."""
+    """Create the search index with vector search capabilities.
+
+    Vectors are binary-quantized (3072 floats become 384 bytes in the HNSW
+    graph), which makes candidate generation much cheaper; the original vectors
+    are kept so the top candidates are rescored at full precision. An index
+    created before compression existed cannot add it to its vector field in
+    place, so that case falls back to the uncompressed definition.
+    """
     
     fields = [
         SearchField(name="id", type=SearchFieldDataType.String, key=True),
@@ -53,17 +68,29 @@ def create_search_index(index_client: SearchIndexClient, index_name: str) -> Non
         ),
     ]
     
-    vector_search = VectorSearch(
-        algorithms=[
-            HnswAlgorithmConfiguration(name="default-algorithm"),
-        ],
-        profiles=[
-            VectorSearchProfile(
-                name="default-profile",
-                algorithm_configuration_name="default-algorithm",
-            ),
-        ],
-    )
+    def _vector_search(compressed: bool) -> VectorSearch:
+        return VectorSearch(
+            algorithms=[
+                HnswAlgorithmConfiguration(name="default-algorithm"),
+            ],
+            compressions=[
+                BinaryQuantizationCompression(
+                    compression_name="default-compression",
+                    rescoring_options=RescoringOptions(
+                        enable_rescoring=True,
+                        default_oversampling=4,
+                        rescore_storage_method=VectorSearchCompressionRescoreStorageMethod.PRESERVE_ORIGINALS,
+                    ),
+                ),
+            ] if compressed else None,
+            profiles=[
+                VectorSearchProfile(
+                    name="default-profile",
+                    algorithm_configuration_name="default-algorithm",
+                    compression_name="default-compression" if compressed else None,
+                ),
+            ],
+        )
     
     semantic_config = SemanticConfiguration(
         name="default-semantic",
@@ -73,17 +100,25 @@ def create_search_index(index_client: SearchIndexClient, index_name: str) -> Non
         ),
     )
     
-    index = SearchIndex(
-        name=index_name,
-        fields=fields,
-        vector_search=vector_search,
-        semantic_search=SemanticSearch(configurations=[semantic_config]),
-    )
+    def _index(compressed: bool) -> SearchIndex:
+        return SearchIndex(
+            name=index_name,
+            fields=fields,
+            vector_search=_vector_search(compressed),
+            semantic_search=SemanticSearch(configurations=[semantic_config]),
+        )
     
-    index_client.create_or_update_index(index)
+    try:
+        index_client.create_or_update_index(_index(compressed=True))
+    except HttpResponseError as e:
+        print(f"Warning: could not apply vector compression to {index_name} ({e.message}); keeping it uncompressed")
+        index_client.create_or_update_index(_index(compressed=False))
     print(f"Created/updated index: {index_name}")
 
 
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
 def fetch_and_chunk_content(url: str, chunk_size: int = 1000) -> tuple[list[dict], str]:
     """Fetch a URL and split into chunks.
 
@@ -91,17 +126,16 @@ def fetch_and_chunk_content(url: str, chunk_size: int = 1000) -> tuple[list[dict
     uses, so the two can never disagree about whether a page has changed.
     """
     try:
-        response = requests.get(url, headers=PAGE_HEADERS, timeout=30)
-        response.raise_for_status()
+        html = fetch_page_content(url)
     except Exception as e:
         print(f"Error fetching {url}: {e}")
         return [], ""
 
-    page_hash = compute_content_hash(response.text)
-    soup = BeautifulSoup(response.text, "lxml")
+    page_hash = compute_content_hash(html)
+    soup = BeautifulSoup(html, "lxml")
     
-    # Remove non-content elements
-    for element in soup.find_all(["nav", "footer", "aside", "script", "style"]):
+    # Remove non-content elements, the same ones the page hash ignores
+    for element in soup.find_all(NON_CONTENT_TAGS):
         element.decompose()
     
     # Get title
@@ -119,24 +153,30 @@ def fetch_and_chunk_content(url: str, chunk_size: int = 1000) -> tuple[list[dict
     # Extract text and split into chunks
     text = main.get_text(separator="\n", strip=True)
     
-    # Simple chunking by paragraphs/sentences
-    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
+    # Simple chunking by paragraphs/sentences. current_length is the length of
+    # the joined chunk, separators included, so a chunk only exceeds chunk_size
+    # when a single paragraph does.
+    paragraphs = (p.strip() for p in text.split("\n\n"))
     
     chunks = []
     current_chunk = []
     current_length = 0
     
     for para in paragraphs:
-        if current_length + len(para) > chunk_size and current_chunk:
-            chunks.append("\n\n".join(current_chunk))
+        if not para:
+            continue
+        if current_chunk and current_length + len(PARAGRAPH_SEPARATOR) + len(para) > chunk_size:
+            chunks.append(PARAGRAPH_SEPARATOR.join(current_chunk))
             current_chunk = []
             current_length = 0
         
+        if current_chunk:
+            current_length += len(PARAGRAPH_SEPARATOR)
         current_chunk.append(para)
         current_length += len(para)
     
     if current_chunk:
-        chunks.append("\n\n".join(current_chunk))
+        chunks.append(PARAGRAPH_SEPARATOR.join(current_chunk))
     
     return [
         {
@@ -148,24 +188,73 @@ def fetch_and_chunk_content(url: str, chunk_size: int = 1000) -> tuple[list[dict
     ], page_hash
 
 
-def get_embedding(text: str, openai_client: AzureOpenAI) -> list[float]:
-    """Generate embedding for text."""
+def get_embeddings(texts: list[str], openai_client: AzureOpenAI) -> list[list[float]]:
+    """Generate embeddings for several texts in one request, in input order."""
     response = openai_client.embeddings.create(
         model="text-embedding-3-large",
-        input=text[:8000],  # Truncate to model limit
+        input=[text[:8000] for text in texts],  # Truncate to model limit
     )
-    return response.data[0].embedding
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+def get_embedding(text: str, openai_client: AzureOpenAI) -> list[float]:
+    """Generate embedding for text."""
+    return get_embeddings([text], openai_client)[0]
+
+
+# Chunks are embedded EMBED_BATCH_SIZE to a request, and the requests are
+# independent round trips, so several are kept in flight while later pages are
+# still being fetched and chunked.
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "16"))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "8"))
+# Pages are fetched and chunked this many at a time, ahead of the loop that
+# turns them into documents.
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "8"))
+# Full batches of documents are uploaded in the background while the next
+# pages are processed.
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "2"))
+
+
+def _submit_embeddings(executor, openai_client, batch: list[dict], vectors: dict) -> None:
+    """Embed a batch in the background, recording where each content hash's vector will be."""
+    future = executor.submit(get_embeddings, [d["content"] for d in batch], openai_client)
+    for position, doc in enumerate(batch):
+        vectors[doc["contentHash"]] = (future, position)
+
+
+def _upload_embedded(search_client, documents: list[dict], vectors: dict) -> None:
+    """Attach each document's finished embedding and upload them together."""
+    for doc in documents:
+        entry = vectors[doc["contentHash"]]
+        if isinstance(entry, array):
+            doc["contentVector"] = entry.tolist()
+        else:
+            future, position = entry
+            doc["contentVector"] = future.result()[position]
+    search_client.upload_documents(documents)
+    print(f"Uploaded {len(documents)} documents")
+    # A later repeat of the text needs only its vector, not the whole batch's
+    # response as Python floats (~100 KB a chunk), so a float32 copy (what
+    # the index stores) replaces the future for the rest of the run.
+    for doc in documents:
+        vectors[doc["contentHash"]] = array("f", doc["contentVector"])
 
 
 def wait_for_openai_embeddings_access(
     openai_client: AzureOpenAI,
     max_wait_seconds: int = 600,
     poll_seconds: int = 30,
+    first_poll_seconds: int = 2,
 ) -> None:
-    """Wait for Azure OpenAI embeddings access (useful after RBAC changes)."""
+    """Wait for Azure OpenAI embeddings access (useful after RBAC changes).
+
+    Polls quickly at first and backs off to ``poll_seconds``, so access that
+    is ready within seconds is not held up by a full polling interval.
+    """
     deadline = time.time() + max_wait_seconds
     last_error: Optional[Exception] = None
     attempt = 0
+    delay = first_poll_seconds
 
     while time.time() < deadline:
         attempt += 1
@@ -177,16 +266,16 @@ def wait_for_openai_embeddings_access(
             # Common when principal lacks data action or RBAC hasn't propagated
             remaining = int(deadline - time.time())
             print(
-                f"OpenAI embeddings not ready yet (auth). Retrying in {poll_seconds}s (remaining ~{remaining}s)..."
+                f"OpenAI embeddings not ready yet (auth). Retrying in {delay}s (remaining ~{remaining}s)..."
             )
-            time.sleep(poll_seconds)
         except Exception as e:
             last_error = e
             remaining = int(deadline - time.time())
             print(
-                f"OpenAI embeddings not ready yet ({type(e).__name__}). Retrying in {poll_seconds}s (remaining ~{remaining}s)..."
+                f"OpenAI embeddings not ready yet ({type(e).__name__}). Retrying in {delay}s (remaining ~{remaining}s)..."
             )
-            time.sleep(poll_seconds)
+        time.sleep(delay)
+        delay = min(delay * 2, poll_seconds)
 
     if last_error:
         raise last_error
@@ -215,6 +304,31 @@ def _delete_documents(search_client, doc_ids) -> None:
         )
 
 
+def _canonical_url(url: str) -> str:
+    """The form two spellings of the same page share: case-folded scheme and
+    host, sorted query, no fragment."""
+    parts = urlsplit(url.strip())
+    return urlunsplit((
+        parts.scheme.lower(),
+        parts.netloc.lower(),
+        parts.path,
+        urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True))),
+        "",
+    ))
+
+
+def _unique_urls(urls: list[str]) -> list[str]:
+    """Drop repeats of a page already in the list, keeping first-seen order."""
+    seen: set[str] = set()
+    unique = []
+    for url in urls:
+        canonical = _canonical_url(url)
+        if canonical not in seen:
+            seen.add(canonical)
+            unique.append(url)
+    return unique
+
+
 def index_content(
     certification_id: str,
     source_urls: list[str],
@@ -235,7 +349,14 @@ def index_content(
         index_name: Custom index name (default: {certification_id}-content)
     """
 
-    token_credential = DefaultAzureCredential()
+    # A page listed twice (often once with an anchor) would be fetched,
+    # embedded and uploaded twice for nothing.
+    unique_urls = _unique_urls(source_urls)
+    if len(unique_urls) < len(source_urls):
+        print(f"Skipping {len(source_urls) - len(unique_urls)} repeated source URL(s)")
+    source_urls = unique_urls
+
+    token_credential = get_credential()
     search_admin_key = os.environ.get("SEARCH_ADMIN_KEY")
     search_credential = AzureKeyCredential(search_admin_key) if search_admin_key else token_credential
     
@@ -264,9 +385,9 @@ def index_content(
     else:
         openai_client = AzureOpenAI(
             azure_endpoint=openai_endpoint,
-            azure_ad_token_provider=lambda: token_credential.get_token(
-                "https://cognitiveservices.azure.com/.default"
-            ).token,
+            azure_ad_token_provider=get_bearer_token_provider(
+                token_credential, "https://cognitiveservices.azure.com/.default"
+            ),
             api_version="2024-02-01",
         )
     
@@ -279,12 +400,35 @@ def index_content(
     # the run's own output.
     previous_ids = _existing_document_ids(search_client, certification_id) if update_mode else set()
 
+    # What the index already holds per page, as last recorded. An update run
+    # still fetches every page to hash it, but a page whose text is unchanged
+    # keeps its existing documents instead of being embedded again.
+    indexed_hashes: dict[str, str] = {}
+    if update_mode:
+        try:
+            indexed_hashes = {
+                s["url"]: s.get("indexedHash", "")
+                for s in source_store.list_sources(certification_id)
+            }
+        except Exception as e:
+            print(f"Warning: could not read source hashes for {certification_id}: {e}")
+    previous_by_page: dict[str, set[str]] = defaultdict(set)
+    for doc_id in previous_ids:
+        previous_by_page[doc_id.rsplit("-", 1)[0]].add(doc_id)
+
     # Ensure OpenAI embeddings are available before we start heavy work
     wait_for_openai_embeddings_access(openai_client)
     
     # Process each URL
-    documents = []
+    # Learn pages repeat boilerplate passages, so each distinct chunk text is
+    # embedded once and its vector shared by every document with that hash.
+    vectors: dict[str, Optional[tuple[Future, int] | array]] = {}
+    batch: list[dict] = []  # distinct documents not yet sent for embedding
+    pending: list[dict] = []  # documents waiting for upload
+    uploads: list[Future] = []
     written_ids: set[str] = set()
+    page_hashes: dict[str, str] = {}  # recorded once the uploads have landed
+    unchanged = 0
 
     total_sources = len(source_urls)
     try:
@@ -292,54 +436,84 @@ def index_content(
     except ValueError:
         progress_every = 10
 
-    for source_index, url in enumerate(source_urls, start=1):
-        if source_index == 1 or source_index == total_sources or source_index % progress_every == 0:
-            print(f"Processing source {source_index}/{total_sources}: {url}")
-            if progress:
-                progress(
-                    "index", source_index, total_sources,
-                    f"Indexing source {source_index} of {total_sources}",
-                )
-        chunks, page_hash = fetch_and_chunk_content(url)
-        if page_hash:
-            try:
-                source_store.record_indexed(certification_id, url, page_hash)
-            except Exception as e:
-                # Tracking is not worth failing an index run over.
-                print(f"Warning: could not record source hash for {url}: {e}")
-        
-        for chunk in chunks:
-            # Generate embedding
-            embedding = get_embedding(chunk["content"], openai_client)
-            
-            # Create document ID
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as fetch_executor, \
+            ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as embed_executor, \
+            ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as upload_executor:
+        # map keeps source order, so document ids and upload order are as before.
+        fetched = fetch_executor.map(fetch_and_chunk_content, source_urls)
+        for source_index, (url, (chunks, page_hash)) in enumerate(zip(source_urls, fetched), start=1):
+            if source_index == 1 or source_index == total_sources or source_index % progress_every == 0:
+                print(f"Processing source {source_index}/{total_sources}: {url}")
+                if progress:
+                    progress(
+                        "index", source_index, total_sources,
+                        f"Indexing source {source_index} of {total_sources}",
+                    )
+            # Same for every chunk of the page, so hashed once per page.
             url_hash = hashlib.sha256(url.encode()).hexdigest()[:8]
-            doc_id = f"{certification_id}-{url_hash}-{chunk['chunkId']}"
-            
-            doc = {
-                "id": doc_id,
-                "certificationId": certification_id,
-                "sourceUrl": url,
-                "title": chunk["title"],
-                "content": chunk["content"],
-                "chunkId": chunk["chunkId"],
-                "contentHash": hashlib.sha256(chunk["content"].encode()).hexdigest()[:16],
-                "contentVector": embedding,
-            }
-            
-            documents.append(doc)
-            written_ids.add(doc_id)
-            
-            # Batch upload every 100 documents
-            if len(documents) >= 100:
-                search_client.upload_documents(documents)
-                print(f"Uploaded {len(documents)} documents")
-                documents = []
-    
-    # Upload remaining documents
-    if documents:
-        search_client.upload_documents(documents)
-        print(f"Uploaded {len(documents)} documents")
+
+            if page_hash and indexed_hashes.get(url) == page_hash:
+                kept = previous_by_page.get(f"{certification_id}-{url_hash}")
+                if kept:
+                    written_ids |= kept
+                    unchanged += 1
+                    continue
+            if page_hash:
+                page_hashes[url] = page_hash
+
+            for chunk in chunks:
+                # Create document ID
+                doc_id = f"{certification_id}-{url_hash}-{chunk['chunkId']}"
+                
+                doc = {
+                    "id": doc_id,
+                    "certificationId": certification_id,
+                    "sourceUrl": url,
+                    "title": chunk["title"],
+                    "content": chunk["content"],
+                    "chunkId": chunk["chunkId"],
+                    "contentHash": hashlib.sha256(chunk["content"].encode()).hexdigest()[:16],
+                }
+                
+                pending.append(doc)
+                written_ids.add(doc_id)
+                if doc["contentHash"] not in vectors:
+                    vectors[doc["contentHash"]] = None  # set when its batch is submitted
+                    batch.append(doc)
+                    if len(batch) >= EMBED_BATCH_SIZE:
+                        _submit_embeddings(embed_executor, openai_client, batch, vectors)
+                        batch = []
+                
+                # Batch upload every 100 documents
+                if len(pending) >= 100:
+                    if batch:
+                        _submit_embeddings(embed_executor, openai_client, batch, vectors)
+                        batch = []
+                    uploads.append(upload_executor.submit(
+                        _upload_embedded, search_client, pending, vectors
+                    ))
+                    pending = []
+        
+        # Upload remaining documents
+        if batch:
+            _submit_embeddings(embed_executor, openai_client, batch, vectors)
+        if pending:
+            uploads.append(upload_executor.submit(
+                _upload_embedded, search_client, pending, vectors
+            ))
+        for upload in uploads:
+            upload.result()  # re-raises a failed upload
+
+    # Only now does the index hold these pages, so a run that fails part way
+    # never records a hash for content it did not upload.
+    for url, page_hash in page_hashes.items():
+        try:
+            source_store.record_indexed(certification_id, url, page_hash)
+        except Exception as e:
+            # Tracking is not worth failing an index run over.
+            print(f"Warning: could not record source hash for {url}: {e}")
+    if unchanged:
+        print(f"Kept {unchanged} unchanged page(s) without re-embedding")
 
     # upload_documents only upserts. Without this, a syllabus that shrank keeps
     # serving the content it dropped: ai-103 went from 795 units to 237, and the
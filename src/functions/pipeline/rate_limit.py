@@ -0,0 +1,62 @@
+"""Client-side throttle for an Azure OpenAI deployment.
+
+Several episodes are prepared at once, and once they are all throttled the
+retry loop can only react: every worker sleeps, wakes together and is
+throttled again. Pacing requests against the deployment's own limits keeps
+them under quota in the first place.
+
+Azure counts a request against the tokens-per-minute limit by its prompt
+plus ``max_tokens`` when it is admitted, not by what it finally uses, so the
+same estimate is charged here. A limit of 0 disables that dimension.
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """Sliding one-minute window over requests and estimated tokens."""
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, window: float = 60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._admitted: deque[tuple[float, int]] = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def _wait_seconds(self, tokens: int, now: float) -> float:
+        while self._admitted and self._admitted[0][0] <= now - self.window:
+            self._tokens -= self._admitted.popleft()[1]
+        if not self._admitted:
+            return 0.0  # A request larger than the whole budget still has to go.
+        over_requests = (
+            self.requests_per_minute and len(self._admitted) >= self.requests_per_minute
+        )
+        over_tokens = (
+            self.tokens_per_minute and self._tokens + tokens > self.tokens_per_minute
+        )
+        if not (over_requests or over_tokens):
+            return 0.0
+        return self._admitted[0][0] + self.window - now
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until a request costing ``tokens`` fits in the window."""
+        if not (self.requests_per_minute or self.tokens_per_minute):
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._wait_seconds(tokens, now)
+                if wait <= 0:
+                    self._admitted.append((now, tokens))
+                    self._tokens += tokens
+                    return
+            time.sleep(wait)
+
+
+def estimate_chat_tokens(messages: list[dict], max_tokens: int = 0) -> int:
+    """Rough prompt size (about four characters per token) plus the completion cap."""
+    prompt_chars = sum(len(str(m.get("content") or "")) for m in messages)
+    return prompt_chars // 4 + max_tokens
@@ -3,15 +3,21 @@ Retrieve relevant content from Azure AI Search for RAG-based script generation.
 """
 
 import hashlib
+import io
 import os
 from dataclasses import dataclass
+from functools import lru_cache
 
-from azure.identity import DefaultAzureCredential
+from azure.identity import get_bearer_token_provider
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
 from azure.search.documents.models import VectorizedQuery
 from openai import AzureOpenAI
 
+from .credentials import get_credential
+
+CONTENT_SEPARATOR = "\n\n---\n\n"
+
 
 @dataclass
 class RetrievedContent:
@@ -23,12 +29,50 @@ class RetrievedContent:
 
 
 def get_embedding(text: str, openai_client: AzureOpenAI) -> list[float]:
-    """Generate embedding for text using Azure OpenAI."""
+    """Generate embedding for text using Azure OpenAI.
+
+    The same domain and topics are retrieved repeatedly during a run, so
+    vectors are remembered per process.
+    """
+    return list(_cached_embedding(text, openai_client))
+
+
+@lru_cache(maxsize=256)
+def _cached_embedding(text: str, openai_client: AzureOpenAI) -> tuple[float, ...]:
     response = openai_client.embeddings.create(
         model="text-embedding-3-large",
         input=text,
     )
-    return response.data[0].embedding
+    return tuple(response.data[0].embedding)
+
+
+@lru_cache(maxsize=None)
+def _get_clients(search_endpoint: str, openai_endpoint: str, index_name: str) -> tuple[SearchClient, AzureOpenAI]:
+    search_admin_key = os.environ.get("SEARCH_ADMIN_KEY")
+    search_credential = AzureKeyCredential(search_admin_key) if search_admin_key else get_credential()
+
+    search_client = SearchClient(
+        endpoint=search_endpoint,
+        index_name=index_name,
+        credential=search_credential,
+    )
+
+    openai_api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("AZURE_OPENAI_API_KEY")
+    if openai_api_key:
+        openai_client = AzureOpenAI(
+            azure_endpoint=openai_endpoint,
+            api_key=openai_api_key,
+            api_version="2024-02-01",
+        )
+    else:
+        openai_client = AzureOpenAI(
+            azure_endpoint=openai_endpoint,
+            azure_ad_token_provider=get_bearer_token_provider(
+                get_credential(), "https://cognitiveservices.azure.com/.default"
+            ),
+            api_version="2024-02-01",
+        )
+    return search_client, openai_client
 
 
 def retrieve_content(
@@ -54,67 +98,55 @@ def retrieve_content(
     if not search_endpoint or not openai_endpoint:
         raise ValueError("SEARCH_ENDPOINT and OPENAI_ENDPOINT environment variables required")
 
-    token_credential = DefaultAzureCredential()
-    search_admin_key = os.environ.get("SEARCH_ADMIN_KEY")
-    search_credential = AzureKeyCredential(search_admin_key) if search_admin_key else token_credential
-
-    # Initialize clients
-    search_client = SearchClient(
-        endpoint=search_endpoint,
-        index_name=f"{certification_id}-content",
-        credential=search_credential,
+    search_client, openai_client = _get_clients(
+        search_endpoint, openai_endpoint, f"{certification_id}-content"
     )
 
-    openai_api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("AZURE_OPENAI_API_KEY")
-    if openai_api_key:
-        openai_client = AzureOpenAI(
-            azure_endpoint=openai_endpoint,
-            api_key=openai_api_key,
-            api_version="2024-02-01",
-        )
-    else:
-        openai_client = AzureOpenAI(
-            azure_endpoint=openai_endpoint,
-            azure_ad_token_provider=lambda: token_credential.get_token(
-                "https://cognitiveservices.azure.com/.default"
-            ).token,
-            api_version="2024-02-01",
-        )
-
     # Build search query from domain and topics
     query_text = f"{skill_domain}\n" + "\n".join(skill_topics)
 
-    # Generate embedding for hybrid search
-    query_embedding = get_embedding(query_text, openai_client)
-
-    # Perform hybrid search (keyword + vector)
-    vector_query = VectorizedQuery(
-        vector=query_embedding,
-        k_nearest_neighbors=10,
-        fields="contentVector",
-    )
-
+    # RETRIEVAL_MODE=bm25 skips the embedding round trip and searches by
+    # keyword only; the default hybrid mode adds a vector query.
+    vector_queries = None
+    if os.environ.get("RETRIEVAL_MODE", "hybrid").lower() != "bm25":
+        query_embedding = get_embedding(query_text, openai_client)
+        vector_queries = [VectorizedQuery(
+            vector=query_embedding,
+            k_nearest_neighbors=10,
+            fields="contentVector",
+        )]
+
+    # Filter before the ANN search rather than after it, so the HNSW walk only
+    # visits this certification's chunks and still returns a full top-k.
     results = search_client.search(
         search_text=query_text,
-        vector_queries=[vector_query],
-        select=["content", "sourceUrl", "title", "chunkId"],
+        vector_queries=vector_queries,
+        vector_filter_mode="preFilter",
+        filter="certificationId eq '{}'".format(certification_id.replace("'", "''")),
+        select=["content", "sourceUrl", "title"],
         top=15,
     )
 
-    # Aggregate results
-    content_parts = []
-    source_urls = set()
-
-    for result in results:
-        content_parts.append(f"## {result.get('title', 'Content')}\n\n{result['content']}")
+    # Aggregate results into one buffer, hashing the same bytes as they are
+    # written rather than joining and then hashing the joined copy.
+    buf = io.StringIO()
+    hasher = hashlib.sha256()
+    source_urls = {}  # ordered set: best-ranked first, stable across processes
+
+    for index, result in enumerate(results):
+        part = f"## {result.get('title', 'Content')}\n\n{result['content']}"
+        if index:
+            buf.write(CONTENT_SEPARATOR)
+            hasher.update(CONTENT_SEPARATOR.encode())
+        buf.write(part)
+        hasher.update(part.encode())
         if result.get("sourceUrl"):
-            source_urls.add(result["sourceUrl"])
+            source_urls[result["sourceUrl"]] = None
 
-    # Combine all retrieved content
-    combined_content = "\n\n---\n\n".join(content_parts)
+    combined_content = buf.getvalue()
 
-    # Compute hash of combined content for delta tracking
-    content_hash = hashlib.sha256(combined_content.encode()).hexdigest()
+    # Hash of the combined content, for delta tracking
+    content_hash = hasher.hexdigest()
 
     return {
         "content": combined_content,
@@ -4,14 +4,41 @@ Save episode metadata to Cosmos DB.
 
 import os
 from datetime import datetime, timezone
+from functools import lru_cache
 
 from azure.cosmos import CosmosClient
-from azure.identity import DefaultAzureCredential
 
 from . import source_store
+from .credentials import get_credential
 
 
-def save_episode(
+# Cosmos rejects a transactional batch of more than 100 operations.
+MAX_BATCH_OPERATIONS = 100
+
+
+def _episodes_container():
+    cosmos_endpoint = os.environ.get("COSMOS_DB_ENDPOINT")
+    database_name = os.environ.get("COSMOS_DB_DATABASE", "certaudio")
+
+    if not cosmos_endpoint:
+        raise ValueError("COSMOS_DB_ENDPOINT environment variable required")
+
+    return _get_container(cosmos_endpoint, database_name, "episodes")
+
+
+@lru_cache(maxsize=None)
+def _get_cosmos_client(cosmos_endpoint: str) -> CosmosClient:
+    # Cosmos DB account has disableLocalAuth=true, so we must use Entra ID tokens
+    return CosmosClient(cosmos_endpoint, get_credential())
+
+
+@lru_cache(maxsize=None)
+def _get_container(cosmos_endpoint: str, database_name: str, container_name: str):
+    database = _get_cosmos_client(cosmos_endpoint).get_database_client(database_name)
+    return database.get_container_client(container_name)
+
+
+def build_episode_doc(
     certification_id: str,
     audio_format: str,
     episode_number: int,
@@ -27,41 +54,7 @@ def save_episode(
     title: str = None,
     sync_url: str = None,
 ) -> dict:
-    """
-    Save episode metadata to Cosmos DB.
-
-    Args:
-        certification_id: Certification ID
-        audio_format: 'instructional' or 'podcast'
-        episode_number: Sequential episode number
-        skill_domain: Skill domain for grouping (without part numbers)
-        skill_topics: Topics covered in this episode
-        audio_url: URL to audio file
-        script_url: URL to script file
-        duration_seconds: Audio duration in seconds
-        is_amendment: Whether this is an amendment episode
-        amendment_of: Original episode number (if amendment)
-        source_urls: Source documentation URLs
-        content_hash: Hash of source content
-        title: Display title (may include part numbers). Defaults to skill_domain.
-        sync_url: URL to word-boundary sync JSON for read-along feature
-
-    Returns:
-        Saved episode document
-    """
-    cosmos_endpoint = os.environ.get("COSMOS_DB_ENDPOINT")
-    database_name = os.environ.get("COSMOS_DB_DATABASE", "certaudio")
-
-    if not cosmos_endpoint:
-        raise ValueError("COSMOS_DB_ENDPOINT environment variable required")
-
-    # Cosmos DB account has disableLocalAuth=true, so we must use Entra ID tokens
-    credential = DefaultAzureCredential()
-    client = CosmosClient(cosmos_endpoint, credential)
-    database = client.get_database_client(database_name)
-    container = database.get_container_client("episodes")
-
-    # Create episode document
+    """Build an episode document without writing it. Arguments as for save_episode."""
     episode_id = f"{certification_id}-{audio_format}-{episode_number:03d}"
 
     # Generate title - use provided title or fall back to skill_domain
@@ -70,7 +63,7 @@ def save_episode(
     else:
         display_title = title or skill_domain
 
-    episode_doc = {
+    return {
         "id": episode_id,
         "certificationId": certification_id,
         "format": audio_format,
@@ -89,19 +82,120 @@ def save_episode(
         "createdAt": datetime.now(timezone.utc).isoformat(),
     }
 
-    # Upsert episode
-    container.upsert_item(episode_doc)
 
-    # Move the staleness baseline only now that the episode has been stored:
-    # a failed run must leave its sources still marked as changed.
-    for url in source_urls:
+def _record_sources(episode_docs: list[dict]) -> None:
+    # Move the staleness baseline only now that the episodes have been stored:
+    # a failed run must leave its sources still marked as changed. Episodes
+    # of one certification share a partition and often share sources, so
+    # they are recorded together rather than one episode (and one round trip)
+    # at a time.
+    by_certification: dict[str, list[tuple[str, str, str]]] = {}
+    for doc in episode_docs:
+        by_certification.setdefault(doc["certificationId"], []).extend(
+            (url, doc["id"], doc["contentHash"]) for url in doc["sourceUrls"]
+        )
+    for certification_id, generated in by_certification.items():
         try:
-            source_store.record_generated(
-                certification_id, url, episode_id, content_hash
-            )
+            source_store.record_generated_many(certification_id, generated)
         except Exception as e:
-            print(f"Warning: Could not update source reference for {url}: {e}")
+            print(f"Warning: Could not update source references for {certification_id}: {e}")
 
-    print(f"Saved episode metadata: {episode_id}")
+
+def save_episode(
+    certification_id: str,
+    audio_format: str,
+    episode_number: int,
+    skill_domain: str,
+    skill_topics: list[str],
+    audio_url: str,
+    script_url: str,
+    duration_seconds: float,
+    is_amendment: bool,
+    amendment_of: int,
+    source_urls: list[str],
+    content_hash: str,
+    title: str = None,
+    sync_url: str = None,
+) -> dict:
+    """
+    Save episode metadata to Cosmos DB.
+
+    Args:
+        certification_id: Certification ID
+        audio_format: 'instructional' or 'podcast'
+        episode_number: Sequential episode number
+        skill_domain: Skill domain for grouping (without part numbers)
+        skill_topics: Topics covered in this episode
+        audio_url: URL to audio file
+        script_url: URL to script file
+        duration_seconds: Audio duration in seconds
+        is_amendment: Whether this is an amendment episode
+        amendment_of: Original episode number (if amendment)
+        source_urls: Source documentation URLs
+        content_hash: Hash of source content
+        title: Display title (may include part numbers). Defaults to skill_domain.
+        sync_url: URL to word-boundary sync JSON for read-along feature
+
+    Returns:
+        Saved episode document
+    """
+    episode_doc = build_episode_doc(
+        certification_id=certification_id,
+        audio_format=audio_format,
+        episode_number=episode_number,
+        skill_domain=skill_domain,
+        skill_topics=skill_topics,
+        audio_url=audio_url,
+        script_url=script_url,
+        duration_seconds=duration_seconds,
+        is_amendment=is_amendment,
+        amendment_of=amendment_of,
+        source_urls=source_urls,
+        content_hash=content_hash,
+        title=title,
+        sync_url=sync_url,
+    )
+
+    # Upsert episode
+    _episodes_container().upsert_item(episode_doc)
+    _record_sources([episode_doc])
+
+    print(f"Saved episode metadata: {episode_doc['id']}")
 
     return episode_doc
+
+
+def save_episodes(episode_docs: list[dict]) -> list[dict]:
+    """Upsert documents from build_episode_doc in as few round trips as possible.
+
+    Episodes are partitioned by certification, so a whole batch is normally a
+    single transactional batch rather than one write per episode. A batch is
+    all-or-nothing: if it fails, none of its episodes are saved and none of
+    their sources move their baseline. Batches already committed keep both.
+    """
+    if not episode_docs:
+        return []
+
+    container = _episodes_container()
+    by_partition: dict[str, list[dict]] = {}
+    for doc in episode_docs:
+        by_partition.setdefault(doc["certificationId"], []).append(doc)
+
+    saved: list[dict] = []
+    try:
+        for certification_id, docs in by_partition.items():
+            for start in range(0, len(docs), MAX_BATCH_OPERATIONS):
+                chunk = docs[start:start + MAX_BATCH_OPERATIONS]
+                container.execute_item_batch(
+                    batch_operations=[("upsert", (doc,)) for doc in chunk],
+                    partition_key=certification_id,
+                )
+                saved.extend(chunk)
+    finally:
+        # Batches that committed before a later one failed are stored, so
+        # their sources move even though the error is re-raised.
+        _record_sources(saved)
+    for doc in episode_docs:
+        print(f"Saved episode metadata: {doc['id']}")
+
+    return episode_docs
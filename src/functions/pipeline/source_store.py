@@ -16,11 +16,17 @@ from datetime import datetime, timezone
 from typing import Optional
 
 from azure.cosmos import CosmosClient
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
 from azure.identity import DefaultAzureCredential
 
 _client = None
 _credential = None
 
+# Cosmos rejects a transactional batch of more than 100 operations, and a
+# patch of more than 10.
+MAX_BATCH_OPERATIONS = 100
+MAX_PATCH_OPERATIONS = 10
+
 
 def _get_credential():
     global _credential
@@ -57,25 +63,38 @@ def list_sources(certification_id: str, **kwargs) -> list[dict]:
         _sources(**kwargs).query_items(
             query=query,
             parameters=[{"name": "@certId", "value": certification_id}],
-            enable_cross_partition_query=True,
+            partition_key=certification_id,
         )
     )
 
 
+def _new_source(certification_id: str, url: str) -> dict:
+    return {
+        "id": source_id(certification_id, url),
+        "certificationId": certification_id,
+        "url": url,
+        "contentHash": "",
+        "indexedHash": "",
+        "episodeRefs": [],
+    }
+
+
+def _mark_generated(doc: dict, episode_id: str, content_hash: str) -> None:
+    doc["contentHash"] = content_hash
+    doc["lastGeneratedAt"] = _now()
+    refs = doc.setdefault("episodeRefs", [])
+    if episode_id not in refs:
+        refs.append(episode_id)
+
+
 def record_indexed(certification_id: str, url: str, indexed_hash: str, **kwargs) -> None:
     """Note what the Search index now holds. Never moves the generation baseline."""
     container = _sources(**kwargs)
     doc_id = source_id(certification_id, url)
     try:
-        doc = container.read_item(doc_id, partition_key=doc_id)
-    except Exception:
-        doc = {
-            "id": doc_id,
-            "certificationId": certification_id,
-            "url": url,
-            "contentHash": "",
-            "episodeRefs": [],
-        }
+        doc = container.read_item(doc_id, partition_key=certification_id)
+    except CosmosResourceNotFoundError:
+        doc = _new_source(certification_id, url)
     doc["indexedHash"] = indexed_hash
     doc["lastIndexedAt"] = _now()
     container.upsert_item(doc)
@@ -88,18 +107,70 @@ def record_generated(
     container = _sources(**kwargs)
     doc_id = source_id(certification_id, url)
     try:
-        doc = container.read_item(doc_id, partition_key=doc_id)
-    except Exception:
-        doc = {
-            "id": doc_id,
-            "certificationId": certification_id,
-            "url": url,
-            "indexedHash": "",
-            "episodeRefs": [],
-        }
-    doc["contentHash"] = content_hash
-    doc["lastGeneratedAt"] = _now()
-    refs = doc.setdefault("episodeRefs", [])
-    if episode_id not in refs:
-        refs.append(episode_id)
+        doc = container.read_item(doc_id, partition_key=certification_id)
+    except CosmosResourceNotFoundError:
+        doc = _new_source(certification_id, url)
+    _mark_generated(doc, episode_id, content_hash)
     container.upsert_item(doc)
+
+
+def _generated_patch(refs: Optional[list], episode_ids: list[str], content_hash: str) -> list[dict]:
+    """Patch operations that do what _mark_generated does to a stored source."""
+    operations = [
+        {"op": "set", "path": "/contentHash", "value": content_hash},
+        {"op": "set", "path": "/lastGeneratedAt", "value": _now()},
+    ]
+    new_refs = [e for e in dict.fromkeys(episode_ids) if e not in (refs or [])]
+    if refs is None or len(operations) + len(new_refs) > MAX_PATCH_OPERATIONS:
+        operations.append({"op": "set", "path": "/episodeRefs", "value": (refs or []) + new_refs})
+    else:
+        operations.extend({"op": "add", "path": "/episodeRefs/-", "value": e} for e in new_refs)
+    return operations
+
+
+def record_generated_many(
+    certification_id: str, generated: list[tuple[str, str, str]], **kwargs
+) -> None:
+    """record_generated for many sources at once.
+
+    ``generated`` holds ``(url, episode_id, content_hash)`` in save order, so
+    a URL shared by several episodes gathers all of their refs and ends on
+    the last one's hash. One query reads which sources exist and the refs
+    they hold; the writes then go out as transactional batches, instead of a
+    read and an upsert per URL. A stored source is patched rather than
+    rewritten, so only the changed fields are sent. Sources are partitioned
+    by certification, so everything stays within one partition.
+    """
+    if not generated:
+        return
+    by_id: dict[str, tuple[str, list[str], str]] = {}
+    for url, episode_id, content_hash in generated:
+        doc_id = source_id(certification_id, url)
+        _, episode_ids, _ = by_id.get(doc_id, (url, [], ""))
+        by_id[doc_id] = (url, episode_ids + [episode_id], content_hash)
+
+    container = _sources(**kwargs)
+    stored_refs = {
+        doc["id"]: doc.get("episodeRefs")
+        for doc in container.query_items(
+            query="SELECT c.id, c.episodeRefs FROM c WHERE ARRAY_CONTAINS(@ids, c.id)",
+            parameters=[{"name": "@ids", "value": list(by_id)}],
+            partition_key=certification_id,
+        )
+    }
+
+    operations = []
+    for doc_id, (url, episode_ids, content_hash) in by_id.items():
+        if doc_id in stored_refs:
+            patch = _generated_patch(stored_refs[doc_id], episode_ids, content_hash)
+            operations.append(("patch", (doc_id, patch)))
+        else:
+            doc = _new_source(certification_id, url)
+            for episode_id in episode_ids:
+                _mark_generated(doc, episode_id, content_hash)
+            operations.append(("upsert", (doc,)))
+    for start in range(0, len(operations), MAX_BATCH_OPERATIONS):
+        container.execute_item_batch(
+            batch_operations=operations[start:start + MAX_BATCH_OPERATIONS],
+            partition_key=certification_id,
+        )
@@ -3,14 +3,38 @@ Synthesize audio from SSML using Azure AI Speech.
 """
 
 import os
-import tempfile
+import queue
+import random
+import threading
+import time
 import uuid
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
 
 import azure.cognitiveservices.speech as speechsdk
 from azure.identity import DefaultAzureCredential
 
 
+# Every pooled synthesizer needs a fresh config, so the credential and its
+# Entra token are shared: a new DefaultAzureCredential per synthesizer walks
+# the whole credential chain and fetches a token it already had.
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+_credential = None
+_aad_token = None
+_aad_token_lock = threading.Lock()
+
+
+def _get_aad_token() -> str:
+    global _credential, _aad_token
+    with _aad_token_lock:
+        if _aad_token is None or _aad_token.expires_on - TOKEN_REFRESH_MARGIN_SECONDS <= time.time():
+            if _credential is None:
+                _credential = DefaultAzureCredential()
+            _aad_token = _credential.get_token("https://cognitiveservices.azure.com/.default")
+        return _aad_token.token
+
+
 def get_speech_config() -> speechsdk.SpeechConfig:
     """Create Speech SDK config using managed identity or key."""
     speech_endpoint = os.environ.get("SPEECH_ENDPOINT")
@@ -55,9 +79,7 @@ def get_speech_config() -> speechsdk.SpeechConfig:
             f"/providers/Microsoft.CognitiveServices/accounts/{resource_name}"
         )
 
-        credential = DefaultAzureCredential()
-        aad_token = credential.get_token("https://cognitiveservices.azure.com/.default")
-        authorization_token = f"aad#{resource_id}#{aad_token.token}"
+        authorization_token = f"aad#{resource_id}#{_get_aad_token()}"
 
         config = speechsdk.SpeechConfig(auth_token=authorization_token, region=speech_region)
     else:
@@ -71,19 +93,164 @@ def get_speech_config() -> speechsdk.SpeechConfig:
     return config
 
 
-def synthesize_ssml(
+# Synthesizers are pooled with their WebSocket already open, so only the first
+# request on each pays the TCP/TLS/auth handshake. Each carries a jittered
+# expiry: the Entra token baked into its config is short-lived, and staggering
+# replacement stops every worker reconnecting at the same moment.
+SYNTHESIZER_TTL_SECONDS = (300, 600)
+
+
+@dataclass
+class _PooledSynthesizer:
+    synthesizer: speechsdk.SpeechSynthesizer
+    connection: speechsdk.Connection
+    expires_at: float
+
+
+_synthesizers: "queue.Queue[_PooledSynthesizer]" = queue.Queue()
+
+
+def _open_synthesizer() -> _PooledSynthesizer:
+    # audio_config=None keeps the audio in the result rather than binding the
+    # synthesizer to one output file, which is what lets it be reused.
+    synthesizer = speechsdk.SpeechSynthesizer(speech_config=get_speech_config(), audio_config=None)
+    connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+    connection.open(True)
+    return _PooledSynthesizer(
+        synthesizer=synthesizer,
+        connection=connection,
+        expires_at=time.time() + random.uniform(*SYNTHESIZER_TTL_SECONDS),
+    )
+
+
+def _discard_synthesizer(pooled: _PooledSynthesizer) -> None:
+    try:
+        pooled.connection.close()
+    except Exception:
+        pass
+
+
+def _acquire_synthesizer() -> _PooledSynthesizer:
+    while True:
+        try:
+            pooled = _synthesizers.get_nowait()
+        except queue.Empty:
+            return _open_synthesizer()
+        if pooled.expires_at > time.time():
+            return pooled
+        _discard_synthesizer(pooled)
+
+
+def _release_synthesizer(pooled: _PooledSynthesizer) -> None:
+    _synthesizers.put(pooled)
+
+
+def prewarm_synthesizers(count: int) -> None:
+    """Open up to `count` connections before the first request needs one.
+
+    Best effort: a synthesizer that fails to open here is simply created on
+    demand later, where the failure is retried and reported properly.
+    """
+    for _ in range(max(0, count - _synthesizers.qsize())):
+        try:
+            _release_synthesizer(_open_synthesizer())
+        except Exception as e:
+            print(f"  Could not pre-warm Speech synthesizer: {e}")
+            return
+
+
+# Episodes and their segments are both synthesized concurrently, so the nested
+# pools can put TTS_MAX_WORKERS x TTS_SEGMENT_WORKERS requests on the wire at
+# once. This caps what is actually in flight across the whole process.
+SPEECH_MAX_CONCURRENCY = int(os.environ.get("SPEECH_MAX_CONCURRENCY", "20"))
+_in_flight = threading.BoundedSemaphore(SPEECH_MAX_CONCURRENCY)
+
+
+# MPEG Layer III tables, keyed by the header's version bits
+# (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5; 1 is reserved).
+_MP3_BITRATES_KBPS = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    0: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+
+def _mp3_frame(data: bytes, pos: int) -> tuple[int, int, int] | None:
+    """(length in bytes, samples, sample rate) of the Layer III frame at pos."""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = (data[pos + 1] >> 1) & 3
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _MP3_BITRATES_KBPS[version][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    samples = 1152 if version == 3 else 576
+    padding = (data[pos + 2] >> 1) & 1
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+
+def _mp3_duration_seconds(audio_data: bytes) -> float:
+    """Playing time, counted from the MPEG frame headers.
+
+    Sizing by bitrate also counts ID3 tags and a Xing/Info header frame as
+    audio, and those offsets accumulate when segments are joined and their
+    word boundaries shifted. Falls back to the 192 kbps size estimate if no
+    frames are found.
+    """
+    data = _strip_id3_tags(audio_data)
+    seconds = 0.0
+    first = True
+    pos = data.find(b"\xff")
+    while pos != -1:
+        frame = _mp3_frame(data, pos)
+        if frame is None or pos + frame[0] > len(data):
+            pos = data.find(b"\xff", pos + 1)
+            continue
+        length, samples, sample_rate = frame
+        # A leading Xing/Info frame carries stream metadata, not audio.
+        if not (first and (b"Xing" in data[pos:pos + 64] or b"Info" in data[pos:pos + 64])):
+            seconds += samples / sample_rate
+        first = False
+        pos += length
+    if not seconds:
+        # MP3 at 192kbps: duration = size_bytes * 8 / 192000
+        return (len(audio_data) * 8) / 192000
+    return seconds
+
+
+# Cancellation details (lower-cased) worth another attempt: throttling, an
+# unavailable or slow service, and a dropped connection.
+RETRYABLE_TTS_ERRORS = (
+    "429", "toomanyrequests", "serviceunavailable", "timeout", "connection", "websocket",
+)
+
+
+def _retry_delay(base_delay: float, attempt: int) -> float:
+    # Segments that were throttled together would otherwise all retry in the
+    # same instant and be throttled together again.
+    delay = base_delay * (2 ** attempt)
+    return delay + random.uniform(0, delay * 0.25)
+
+
+def synthesize_ssml_bytes(
     ssml_content: str,
-    output_path: str,
-    max_retries: int = 3,
+    max_retries: int = 4,
     word_boundaries: list | None = None,
     audio_offset_ms: float = 0,
-) -> tuple[bool, float]:
+) -> bytes | None:
     """
-    Synthesize SSML to audio file with retry logic.
+    Synthesize SSML to MP3 bytes with retry logic.
 
     Args:
         ssml_content: SSML markup
-        output_path: Path to save MP3 file
         max_retries: Maximum number of retry attempts
         word_boundaries: If provided, word boundary events are appended here.
             Each entry is a dict with keys: text, offset (ms), duration (ms), type.
@@ -91,152 +258,223 @@ def synthesize_ssml(
             (used when concatenating multiple segments).
 
     Returns:
-        Tuple of (success, duration_seconds)
+        The MP3 audio, or None if synthesis failed
     """
-    import time
-    
     base_delay = 2  # Start with 2 second delay
     
     for attempt in range(max_retries):
-        config = get_speech_config()
-
-        # Configure audio output to file
-        audio_config = speechsdk.audio.AudioOutputConfig(filename=output_path)
-
-        # Create synthesizer
-        synthesizer = speechsdk.SpeechSynthesizer(
-            speech_config=config, audio_config=audio_config
-        )
+        # Boundaries from an attempt that fails part way must not be kept
+        # alongside the retry's.
+        boundaries_before = len(word_boundaries) if word_boundaries is not None else 0
+        pooled = None
 
-        # Hook word boundary events to capture sync data
-        if word_boundaries is not None:
-            def _on_word_boundary(evt):
-                word_boundaries.append({
-                    "text": evt.text,
-                    "offset": evt.audio_offset / 10_000 + audio_offset_ms,  # 100ns ticks → ms
-                    "duration": evt.duration.total_seconds() * 1000,
-                    "type": evt.boundary_type.name,  # Word, Punctuation, Sentence
-                })
-            synthesizer.synthesis_word_boundary.connect(_on_word_boundary)
-
-        # Synthesize
-        result = synthesizer.speak_ssml_async(ssml_content).get()
+        try:
+            # A slot is taken before a connection, so no more synthesizers
+            # are opened, and later pooled, than can synthesize at once.
+            # Opening one can fail like a request can, so it is retried too.
+            with _in_flight:
+                pooled = _acquire_synthesizer()
+                synthesizer = pooled.synthesizer
+
+                # Hook word boundary events to capture sync data
+                if word_boundaries is not None:
+                    def _on_word_boundary(evt):
+                        word_boundaries.append({
+                            "text": evt.text,
+                            "offset": evt.audio_offset / 10_000 + audio_offset_ms,  # 100ns ticks → ms
+                            "duration": evt.duration.total_seconds() * 1000,
+                            "type": evt.boundary_type.name,  # Word, Punctuation, Sentence
+                        })
+                    synthesizer.synthesis_word_boundary.connect(_on_word_boundary)
+
+                # Synthesize
+                try:
+                    result = synthesizer.speak_ssml_async(ssml_content).get()
+                finally:
+                    # The synthesizer outlives this call; the next caller must
+                    # not append into this episode's boundaries.
+                    synthesizer.synthesis_word_boundary.disconnect_all()
+        except Exception as e:
+            # A dropped or stale connection: neither it nor this attempt's
+            # boundaries can be trusted, but a fresh connection may succeed.
+            if pooled is not None:
+                _discard_synthesizer(pooled)
+            if word_boundaries is not None:
+                del word_boundaries[boundaries_before:]
+            if attempt == max_retries - 1:
+                raise
+            delay = _retry_delay(base_delay, attempt)
+            print(f"  TTS request failed ({e}), retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})...")
+            time.sleep(delay)
+            continue
 
         if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+            _release_synthesizer(pooled)
             # Billed per character of SSML submitted, so meter on success only.
             from .cost import record_tts_usage
 
             record_tts_usage(len(ssml_content))
-            # Calculate duration from audio data
-            # MP3 at 192kbps: duration = file_size_bytes * 8 / 192000
-            file_size = os.path.getsize(output_path)
-            duration_seconds = (file_size * 8) / 192000
-            return True, duration_seconds
+            return result.audio_data
+
+        # A failed request can leave the connection unusable, so it is not
+        # returned to the pool; the retry opens a fresh one.
+        _discard_synthesizer(pooled)
+        if word_boundaries is not None:
+            del word_boundaries[boundaries_before:]
 
-        elif result.reason == speechsdk.ResultReason.Canceled:
+        if result.reason == speechsdk.ResultReason.Canceled:
             cancellation = result.cancellation_details
             error_msg = f"Speech synthesis canceled: {cancellation.reason}"
             if cancellation.reason == speechsdk.CancellationReason.Error:
                 error_msg += f" - {cancellation.error_details}"
             
             # Check if retryable (rate limit, transient errors)
-            is_retryable = (
-                "429" in str(cancellation.error_details) or
-                "TooManyRequests" in str(cancellation.error_details) or
-                "ServiceUnavailable" in str(cancellation.error_details) or
-                "timeout" in str(cancellation.error_details).lower()
-            )
+            details = str(cancellation.error_details).lower()
+            is_retryable = any(marker in details for marker in RETRYABLE_TTS_ERRORS)
             
             if is_retryable and attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt)  # 2, 4, 8 seconds
-                print(f"  TTS rate limit/transient error, retrying in {delay}s (attempt {attempt + 1}/{max_retries})...")
+                delay = _retry_delay(base_delay, attempt)  # about 2, 4, 8 seconds
+                print(f"  TTS rate limit/transient error, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})...")
                 time.sleep(delay)
                 continue
             else:
                 print(error_msg)
-                return False, 0
+                return None
         else:
             # Unknown failure
             if attempt < max_retries - 1:
-                delay = base_delay * (2 ** attempt)
-                print(f"  TTS failed (reason: {result.reason}), retrying in {delay}s...")
+                delay = _retry_delay(base_delay, attempt)
+                print(f"  TTS failed (reason: {result.reason}), retrying in {delay:.1f}s...")
                 time.sleep(delay)
                 continue
-            return False, 0
+            return None
     
-    return False, 0
+    return None
 
 
-def synthesize_audio_segments(
-    ssml_segments: list[str],
+def synthesize_ssml(
+    ssml_content: str,
     output_path: str,
+    max_retries: int = 4,
     word_boundaries: list | None = None,
+    audio_offset_ms: float = 0,
 ) -> tuple[bool, float]:
-    """Synthesize multiple SSML segments and concatenate resulting MP3 files.
+    """
+    Synthesize SSML to an MP3 file with retry logic.
 
-    This avoids the Speech service max media duration limit (~10 minutes) per request.
-    Word boundary offsets are accumulated across segments so timestamps are relative
-    to the final concatenated output.
+    See synthesize_ssml_bytes for the arguments.
+
+    Returns:
+        Tuple of (success, duration_seconds)
     """
-    if not ssml_segments:
+    audio_data = synthesize_ssml_bytes(
+        ssml_content,
+        max_retries=max_retries,
+        word_boundaries=word_boundaries,
+        audio_offset_ms=audio_offset_ms,
+    )
+    if audio_data is None:
         return False, 0
+    with open(output_path, "wb") as f:
+        f.write(audio_data)
+    return True, _mp3_duration_seconds(audio_data)
+
+
+# Segments of one episode are synthesized concurrently. Phase 2 already runs
+# several episodes at once; SPEECH_MAX_CONCURRENCY bounds the combined total.
+TTS_SEGMENT_WORKERS = int(os.environ.get("TTS_SEGMENT_WORKERS", "4"))
+
+
+def _strip_id3_tags(data: bytes) -> bytes:
+    """Remove ID3v2 (start) and ID3v1 (end) tags from MP3 data."""
+    if len(data) >= 10 and data[:3] == b"ID3":
+        # ID3v2 header: bytes 6-9 is a synchsafe size (7 bits each)
+        size_bytes = data[6:10]
+        tag_size = (
+            (size_bytes[0] & 0x7F) << 21
+            | (size_bytes[1] & 0x7F) << 14
+            | (size_bytes[2] & 0x7F) << 7
+            | (size_bytes[3] & 0x7F)
+        )
+        data = data[10 + tag_size :]
 
-    temp_paths: list[str] = []
-    total_duration = 0.0
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+
+    return data
+
+
+def synthesize_segments_bytes(
+    ssml_segments: list[str],
+    word_boundaries: list | None = None,
+    max_workers: int = TTS_SEGMENT_WORKERS,
+    on_segment: Callable[[int, bytes], None] | None = None,
+) -> tuple[bytes | None, float]:
+    """Synthesize multiple SSML segments concurrently and concatenate the MP3s.
+
+    This avoids the Speech service max media duration limit (~10 minutes) per
+    request, and lets a long episode take roughly as long as its slowest
+    segment rather than the sum of them. Segment audio is held in memory and
+    joined in order; word boundary offsets are shifted once every segment's
+    duration is known, so timestamps are relative to the final concatenated
+    output.
+
+    ``on_segment(index, audio)`` is called from the worker as soon as each
+    segment is ready, with its tags already stripped, so the caller can start
+    uploading it. An exception from it propagates.
+
+    Returns:
+        (audio bytes, duration in seconds), or (None, 0) if any segment failed
+    """
+    if not ssml_segments:
+        return None, 0
+
+    part_boundaries: list[list | None] = [
+        [] if word_boundaries is not None else None for _ in ssml_segments
+    ]
 
+    def _synthesize_part(idx: int) -> bytes | None:
+        part = synthesize_ssml_bytes(ssml_segments[idx], word_boundaries=part_boundaries[idx])
+        if part is not None and on_segment is not None:
+            on_segment(idx, _strip_id3_tags(part))
+        return part
+
+    workers = max(1, min(max_workers, len(ssml_segments)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        parts = list(executor.map(_synthesize_part, range(len(ssml_segments))))
+
+    if any(part is None for part in parts):
+        return None, 0
+
+    total_duration = 0.0
     accumulated_offset_ms = 0.0
-    base = Path(output_path)
-    for idx, segment in enumerate(ssml_segments, start=1):
-        part_path = str(base.with_name(f"{base.stem}.part{idx:02d}{base.suffix}"))
-        ok, dur = synthesize_ssml(
-            segment,
-            part_path,
-            word_boundaries=word_boundaries,
-            audio_offset_ms=accumulated_offset_ms,
-        )
-        if not ok:
-            # Best-effort cleanup
-            for p in temp_paths:
-                try:
-                    os.remove(p)
-                except Exception:
-                    pass
-            return False, 0
-        temp_paths.append(part_path)
+    for part, boundaries in zip(parts, part_boundaries):
+        dur = _mp3_duration_seconds(part)
+        if boundaries is not None:
+            for boundary in boundaries:
+                boundary["offset"] += accumulated_offset_ms
+            word_boundaries.extend(boundaries)
         total_duration += dur
         accumulated_offset_ms += dur * 1000  # seconds → ms
 
-    def _strip_id3_tags(data: bytes) -> bytes:
-        """Remove ID3v2 (start) and ID3v1 (end) tags from MP3 data."""
-        if len(data) >= 10 and data[:3] == b"ID3":
-            # ID3v2 header: bytes 6-9 is a synchsafe size (7 bits each)
-            size_bytes = data[6:10]
-            tag_size = (
-                (size_bytes[0] & 0x7F) << 21
-                | (size_bytes[1] & 0x7F) << 14
-                | (size_bytes[2] & 0x7F) << 7
-                | (size_bytes[3] & 0x7F)
-            )
-            data = data[10 + tag_size :]
+    # Concatenate MP3 parts, stripping tags to avoid audible artifacts between segments.
+    return b"".join(_strip_id3_tags(part) for part in parts), total_duration
 
-        if len(data) >= 128 and data[-128:-125] == b"TAG":
-            data = data[:-128]
 
-        return data
+def synthesize_audio_segments(
+    ssml_segments: list[str],
+    output_path: str,
+    word_boundaries: list | None = None,
+    max_workers: int = TTS_SEGMENT_WORKERS,
+) -> tuple[bool, float]:
+    """Like synthesize_segments_bytes, but write the episode to output_path."""
+    audio_data, duration = synthesize_segments_bytes(ssml_segments, word_boundaries, max_workers)
+    if audio_data is None:
+        return False, 0
 
-    # Concatenate MP3 parts, stripping tags to avoid audible artifacts between segments.
     with open(output_path, "wb") as out_f:
-        for p in temp_paths:
-            with open(p, "rb") as in_f:
-                out_f.write(_strip_id3_tags(in_f.read()))
-
-    for p in temp_paths:
-        try:
-            os.remove(p)
-        except Exception:
-            pass
-
-    return True, total_duration
+        out_f.write(audio_data)
+    return True, duration
 
 
 def synthesize_audio(
@@ -255,12 +493,9 @@ def synthesize_audio(
         audio_format: 'instructional' or 'podcast'
 
     Returns:
-        Dict with audio_path and duration_seconds
+        Dict with audio_data (the MP3 bytes) and duration_seconds
     """
-    # Create temp file for audio output
-    temp_dir = tempfile.mkdtemp()
     filename = f"{certification_id}_{audio_format}_{episode_number:03d}.mp3"
-    output_path = os.path.join(temp_dir, filename)
 
     print(f"Synthesizing audio for episode {episode_number}...")
 
@@ -268,17 +503,15 @@ def synthesize_audio(
     word_boundaries: list[dict] = []
 
     # Synthesize
-    success, duration = synthesize_ssml(
-        ssml_content, output_path, word_boundaries=word_boundaries
-    )
-
-    if not success:
+    audio_data = synthesize_ssml_bytes(ssml_content, word_boundaries=word_boundaries)
+    if audio_data is None:
         raise RuntimeError(f"Audio synthesis failed for episode {episode_number}")
+    duration = _mp3_duration_seconds(audio_data)
 
     print(f"Audio synthesized: {duration:.1f} seconds, {len(word_boundaries)} word boundaries captured")
 
     return {
-        "audio_path": output_path,
+        "audio_data": audio_data,
         "duration_seconds": duration,
         "filename": filename,
         "word_boundaries": word_boundaries,
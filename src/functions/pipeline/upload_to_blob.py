@@ -1,11 +1,24 @@
 """Upload audio, scripts, and SSML to Azure Blob Storage."""
 
+import base64
+import gzip
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import BlobBlock, BlobServiceClient, ContentSettings
+
+from .credentials import get_credential
+
+
+# The SDK only reads these, so one of each is shared by every upload.
+_AUDIO_SETTINGS = ContentSettings(content_type="audio/mpeg")
+_SCRIPT_SETTINGS = ContentSettings(content_type="text/markdown", content_encoding="gzip")
+_SSML_SETTINGS = ContentSettings(content_type="application/ssml+xml", content_encoding="gzip")
+_SYNC_SETTINGS = ContentSettings(content_type="application/json", content_encoding="gzip")
 
 
 def get_blob_service_client() -> BlobServiceClient:
@@ -14,26 +27,170 @@ def get_blob_service_client() -> BlobServiceClient:
     if not storage_account:
         raise ValueError("STORAGE_ACCOUNT_NAME environment variable required")
 
+    return _blob_service(
+        storage_account,
+        os.environ.get("AZURE_STORAGE_CONNECTION_STRING"),
+        os.environ.get("STORAGE_ACCOUNT_KEY"),
+    )
+
+
+@lru_cache(maxsize=None)
+def _blob_service(
+    storage_account: str, conn_str: str | None, account_key: str | None
+) -> BlobServiceClient:
     # Prefer connection string / account key when provided (more reliable for local dev)
-    conn_str = os.environ.get("AZURE_STORAGE_CONNECTION_STRING")
     if conn_str:
         return BlobServiceClient.from_connection_string(conn_str)
 
-    account_key = os.environ.get("STORAGE_ACCOUNT_KEY")
     if account_key:
         return BlobServiceClient(
             account_url=f"https://{storage_account}.blob.core.windows.net",
             credential=account_key,
         )
 
-    credential = DefaultAzureCredential()
-    account_url = f"https://{storage_account}.blob.core.windows.net"
+    return _entra_blob_service(storage_account)
+
+
+@lru_cache(maxsize=None)
+def _entra_blob_service(storage_account: str) -> BlobServiceClient:
+    return BlobServiceClient(
+        account_url=f"https://{storage_account}.blob.core.windows.net",
+        credential=get_credential(),
+    )
+
+
+def _upload_with_entra_fallback(upload) -> None:
+    """Run ``upload(blob_service)``, retrying with Entra ID if shared keys are refused."""
+    try:
+        upload(get_blob_service_client())
+    except Exception as e:
+        # If the storage account disallows shared key auth, retry using Entra ID tokens.
+        if "KeyBasedAuthenticationNotPermitted" in str(e):
+            storage_account = os.environ.get("STORAGE_ACCOUNT_NAME")
+            if not storage_account:
+                raise
+
+            upload(_entra_blob_service(storage_account))
+        else:
+            raise
+
+
+# Containers already created (or found to exist) by this process. Checking
+# costs a round trip that fails with 409 once they exist, and it used to run
+# for every staged segment and every episode.
+_ensured_containers: set[tuple[str, str]] = set()
+
+
+def _ensure_container(container) -> None:
+    key = (container.account_name, container.container_name)
+    if key in _ensured_containers:
+        return
+    # Containers are created by infra, but just in case
+    try:
+        container.create_container()
+    except ResourceExistsError:
+        pass
+    except Exception:
+        return  # Not known either way; let the upload itself report it
+    _ensured_containers.add(key)
+
+
+def _base_url() -> str:
+    # These will be accessed via Functions API, not directly
+    return f"https://{os.environ.get('STORAGE_ACCOUNT_NAME')}.blob.core.windows.net"
+
+
+def _audio_blob_path(certification_id: str, audio_format: str, episode_number: int) -> str:
+    return f"{certification_id}/{audio_format}/episodes/{episode_number:03d}.mp3"
+
+
+def upload_audio(
+    audio_data: bytes,
+    certification_id: str,
+    audio_format: str,
+    episode_number: int,
+) -> str:
+    """
+    Upload an episode's MP3 from memory in one request.
+
+    Returns:
+        The audio blob URL
+    """
+    audio_blob_path = _audio_blob_path(certification_id, audio_format, episode_number)
+
+    def _upload(blob_service: BlobServiceClient) -> None:
+        audio_container = blob_service.get_container_client("audio")
+        _ensure_container(audio_container)
+        print(f"Uploading audio: {audio_blob_path}")
+        audio_container.upload_blob(
+            name=audio_blob_path,
+            data=audio_data,
+            overwrite=True,
+            content_settings=_AUDIO_SETTINGS,
+        )
+
+    _upload_with_entra_fallback(_upload)
+
+    return f"{_base_url()}/audio/{audio_blob_path}"
+
+
+def _block_id(index: int) -> str:
+    # Block ids must all be the same length within a blob.
+    return base64.b64encode(f"{index:08d}".encode()).decode()
+
+
+def stage_audio_segment(
+    audio_data: bytes,
+    certification_id: str,
+    audio_format: str,
+    episode_number: int,
+    index: int,
+) -> None:
+    """
+    Stage one segment of an episode's MP3 as an uncommitted block.
+
+    Lets each segment upload as soon as it is synthesized, while the rest of
+    the episode is still being spoken. Nothing is visible until
+    commit_audio_segments, so a failed episode leaves any earlier version of
+    the blob intact; uncommitted blocks are discarded by the service.
+    """
+    audio_blob_path = _audio_blob_path(certification_id, audio_format, episode_number)
+
+    def _stage(blob_service: BlobServiceClient) -> None:
+        audio_container = blob_service.get_container_client("audio")
+        _ensure_container(audio_container)
+        audio_container.get_blob_client(audio_blob_path).stage_block(_block_id(index), audio_data)
 
-    return BlobServiceClient(account_url=account_url, credential=credential)
+    _upload_with_entra_fallback(_stage)
+
+
+def commit_audio_segments(
+    segment_count: int,
+    certification_id: str,
+    audio_format: str,
+    episode_number: int,
+) -> str:
+    """
+    Publish an episode's staged segments, in order, as its MP3.
+
+    Returns:
+        The audio blob URL
+    """
+    audio_blob_path = _audio_blob_path(certification_id, audio_format, episode_number)
+
+    def _commit(blob_service: BlobServiceClient) -> None:
+        print(f"Committing audio: {audio_blob_path} ({segment_count} segment(s))")
+        blob_service.get_blob_client("audio", audio_blob_path).commit_block_list(
+            [BlobBlock(block_id=_block_id(i)) for i in range(segment_count)],
+            content_settings=_AUDIO_SETTINGS,
+        )
+
+    _upload_with_entra_fallback(_commit)
+    return f"{_base_url()}/audio/{audio_blob_path}"
 
 
 def upload_to_blob(
-    audio_file_path: str,
+    audio_data: bytes | None,
     script_content: str,
     ssml_content: str,
     certification_id: str,
@@ -45,7 +202,8 @@ def upload_to_blob(
     Upload audio, script, SSML, and optional word-boundary sync data to blob storage.
 
     Args:
-        audio_file_path: Local path to MP3 file
+        audio_data: MP3 bytes, or None if the audio was already uploaded
+            (see stage_audio_segment)
         script_content: Narration script text
         ssml_content: SSML markup
         certification_id: Certification ID
@@ -56,100 +214,51 @@ def upload_to_blob(
     Returns:
         Dict with audio_url, script_url, ssml_url, sync_url
     """
-    blob_service = get_blob_service_client()
-
-    # Fixed container names - use path prefixes for cert/format organization
-    audio_container = blob_service.get_container_client("audio")
-    scripts_container = blob_service.get_container_client("scripts")
-
-    # Ensure containers exist (they should be created by infra, but just in case)
-    try:
-        audio_container.create_container()
-    except Exception:
-        pass  # Container already exists
-
-    try:
-        scripts_container.create_container()
-    except Exception:
-        pass  # Container already exists
-
     # File paths in blob storage - use path prefixes for organization
     episode_id = f"{episode_number:03d}"
-    audio_blob_path = f"{certification_id}/{audio_format}/episodes/{episode_id}.mp3"
+    audio_blob_path = _audio_blob_path(certification_id, audio_format, episode_number)
     script_blob_path = f"{certification_id}/{audio_format}/scripts/{episode_id}.md"
     ssml_blob_path = f"{certification_id}/{audio_format}/ssml/{episode_id}.ssml"
     sync_blob_path = f"{certification_id}/{audio_format}/sync/{episode_id}.sync.json"
 
-    def _upload_all() -> None:
-        # Upload audio file
-        print(f"Uploading audio: {audio_blob_path}")
-        with open(audio_file_path, "rb") as audio_file:
-            audio_container.upload_blob(
-                name=audio_blob_path,
-                data=audio_file,
-                overwrite=True,
-                content_settings=ContentSettings(content_type="audio/mpeg"),
-            )
+    # (label, path, data, content settings) for each text blob
+    text_blobs = [
+        ("script", script_blob_path, script_content, _SCRIPT_SETTINGS),
+        ("SSML", ssml_blob_path, ssml_content, _SSML_SETTINGS),
+    ]
+    # Word-boundary sync data (if available)
+    if word_boundaries:
+        sync_json = json.dumps(word_boundaries, separators=(",", ":"))
+        text_blobs.append((
+            f"sync data ({len(word_boundaries)} boundaries)", sync_blob_path, sync_json, _SYNC_SETTINGS,
+        ))
 
-        # Upload script
-        print(f"Uploading script: {script_blob_path}")
-        scripts_container.upload_blob(
-            name=script_blob_path,
-            data=script_content,
-            overwrite=True,
-            content_settings=ContentSettings(content_type="text/markdown"),
-        )
+    def _upload_all(blob_service: BlobServiceClient) -> None:
+        # Fixed container name - use path prefixes for cert/format organization
+        scripts_container = blob_service.get_container_client("scripts")
+        _ensure_container(scripts_container)
 
-        # Upload SSML
-        print(f"Uploading SSML: {ssml_blob_path}")
-        scripts_container.upload_blob(
-            name=ssml_blob_path,
-            data=ssml_content,
-            overwrite=True,
-            content_settings=ContentSettings(content_type="application/ssml+xml"),
-        )
-
-        # Upload word-boundary sync data (if available)
-        if word_boundaries:
-            print(f"Uploading sync data: {sync_blob_path} ({len(word_boundaries)} boundaries)")
-            sync_json = json.dumps(word_boundaries, separators=(",", ":"))
+        def _upload(label: str, path: str, data: str, settings: ContentSettings) -> None:
+            print(f"Uploading {label}: {path}")
+            # Markup and word lists compress several-fold; stored gzipped,
+            # and read back through function_app._read_text_blob.
             scripts_container.upload_blob(
-                name=sync_blob_path,
-                data=sync_json,
+                name=path,
+                data=gzip.compress(data.encode("utf-8"), compresslevel=6),
                 overwrite=True,
-                content_settings=ContentSettings(content_type="application/json"),
+                content_settings=settings,
             )
 
-    try:
-        _upload_all()
-    except Exception as e:
-        # If the storage account disallows shared key auth, retry using Entra ID tokens.
-        if "KeyBasedAuthenticationNotPermitted" in str(e):
-            storage_account = os.environ.get("STORAGE_ACCOUNT_NAME")
-            if not storage_account:
-                raise
-
-            credential = DefaultAzureCredential()
-            blob_service = BlobServiceClient(
-                account_url=f"https://{storage_account}.blob.core.windows.net",
-                credential=credential,
-            )
-            audio_container = blob_service.get_container_client("audio")
-            scripts_container = blob_service.get_container_client("scripts")
-            _upload_all()
-        else:
-            raise
-
-    # Construct URLs (these will be accessed via Functions API, not directly)
-    storage_account = os.environ.get("STORAGE_ACCOUNT_NAME")
-    base_url = f"https://{storage_account}.blob.core.windows.net"
+        # Independent blobs, so one round trip's wait rather than one each.
+        with ThreadPoolExecutor(max_workers=len(text_blobs)) as executor:
+            for future in [executor.submit(_upload, *blob) for blob in text_blobs]:
+                future.result()
 
-    # Clean up local audio file
-    try:
-        os.remove(audio_file_path)
-    except Exception:
-        pass
+    if audio_data is not None:
+        upload_audio(audio_data, certification_id, audio_format, episode_number)
+    _upload_with_entra_fallback(_upload_all)
 
+    base_url = _base_url()
     return {
         "audio_url": f"{base_url}/audio/{audio_blob_path}",
         "script_url": f"{base_url}/scripts/{script_blob_path}",
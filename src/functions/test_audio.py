@@ -1,6 +1,7 @@
 """Unit tests for the private Blob Storage audio proxy."""
 
 import base64
+import gzip
 import json
 from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
@@ -8,7 +9,7 @@ from unittest.mock import MagicMock, patch
 import azure.functions as func
 from azure.core.exceptions import ResourceNotFoundError
 
-from function_app import _parse_byte_range, get_audio, readyz
+from function_app import _parse_byte_range, _read_text_blob, get_audio, readyz
 
 
 def _principal_header() -> str:
@@ -204,3 +205,10 @@ def test_readyz_returns_503_without_leaking_error(mock_get_cosmos_client):
     assert response.status_code == 503
     assert json.loads(response.get_body()) == {"status": "not ready"}
     assert b"private endpoint unavailable" not in response.get_body()
+
+
+def test_text_blobs_read_back_whether_or_not_they_were_gzipped():
+    blob = MagicMock()
+    for stored in (gzip.compress("# Script\n".encode()), "# Script\n".encode()):
+        blob.download_blob.return_value.readall.return_value = stored
+        assert _read_text_blob(blob) == "# Script\n"
@@ -4,7 +4,7 @@ Unit tests for content staleness tracking.
 Run:  python -m pytest src/functions/test_delta.py -v
 """
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 
@@ -32,9 +32,7 @@ def test_indexer_and_delta_check_share_one_hash_function():
 
 
 def test_the_hash_the_indexer_stores_matches_what_the_checker_computes():
-    with patch.object(index_content.requests, "get") as get:
-        get.return_value.text = PAGE
-        get.return_value.raise_for_status = lambda: None
+    with patch.object(index_content, "fetch_page_content", return_value=PAGE):
         _, indexed = index_content.fetch_and_chunk_content("https://example.invalid/a")
 
     assert indexed == content_hash.compute_content_hash(PAGE)
@@ -52,13 +50,31 @@ def test_article_changes_do_count():
     assert content_hash.compute_content_hash(edited) != content_hash.compute_content_hash(PAGE)
 
 
+def test_page_fetches_share_one_session():
+    with patch.object(content_hash._http, "get") as get:
+        get.return_value.text = PAGE
+        content_hash.fetch_page_content("https://example.invalid/a")
+        content_hash.fetch_page_content("https://example.invalid/b")
+
+    assert get.call_count == 2
+    assert content_hash._http.headers["User-Agent"] == content_hash.HEADERS["User-Agent"]
+
+
 def test_a_failed_fetch_yields_no_hash_rather_than_a_wrong_one():
-    with patch.object(index_content.requests, "get", side_effect=OSError("boom")):
+    with patch.object(index_content, "fetch_page_content", side_effect=OSError("boom")):
         chunks, page_hash = index_content.fetch_and_chunk_content("https://example.invalid/a")
     assert chunks == []
     assert page_hash == ""
 
 
+def test_chunks_count_their_separators_against_the_size_limit():
+    page = "<main><p>" + "\n\n".join(["x" * 500] * 4) + "</p></main>"
+    with patch.object(index_content, "fetch_page_content", return_value=page):
+        chunks, _ = index_content.fetch_and_chunk_content("https://example.invalid/a")
+
+    assert [len(c["content"]) for c in chunks] == [500] * 4
+
+
 # ---------------------------------------------------------------------------
 # Re-indexing replaces rather than accumulates
 # ---------------------------------------------------------------------------
@@ -120,6 +136,207 @@ def test_an_odata_quote_cannot_break_out_of_the_filter():
     assert captured["filter"] == "certificationId eq 'ai''103'"
 
 
+def _index_run(monkeypatch, pages, embed, requests=None, fetch=None, client=None,
+               sources=None):
+    """Run index_content against in-memory pages, returning what it uploaded.
+
+    Passing ``sources`` (the tracked source records) makes it an update run.
+    """
+    client = client or _SearchClient()
+    monkeypatch.setattr(index_content, "SearchClient", lambda **_: client)
+    for name in ("SearchIndexClient", "AzureOpenAI", "get_credential",
+                 "create_search_index", "wait_for_openai_embeddings_access", "source_store"):
+        monkeypatch.setattr(index_content, name, MagicMock())
+    index_content.source_store.list_sources.return_value = sources or []
+    monkeypatch.setattr(
+        index_content, "fetch_and_chunk_content", fetch or (lambda url: (pages[url], "h"))
+    )
+    def _get_embeddings(texts, _client):
+        if requests is not None:
+            requests.append(texts)
+        return [embed(t) for t in texts]
+
+    monkeypatch.setattr(index_content, "get_embeddings", _get_embeddings)
+    index_content.index_content(
+        "ai-103", list(pages), "https://s", "https://o", update_mode=sources is not None
+    )
+    return client.uploaded
+
+
+def test_embeddings_are_computed_concurrently_and_attached_in_order(monkeypatch):
+    import threading
+
+    monkeypatch.setattr(index_content, "EMBED_BATCH_SIZE", 1)
+    both_started = threading.Barrier(2, timeout=5)
+
+    def _embed(text):
+        both_started.wait()  # deadlocks unless two requests are in flight at once
+        return [float(len(text))]
+
+    pages = {
+        "https://x/a": [{"title": "A", "content": "a", "chunkId": 0}],
+        "https://x/b": [{"title": "B", "content": "bb", "chunkId": 0}],
+    }
+    uploaded = _index_run(monkeypatch, pages, _embed)
+
+    assert [(d["content"], d["contentVector"]) for d in uploaded] == [("a", [1.0]), ("bb", [2.0])]
+
+
+def test_chunks_are_embedded_several_to_a_request(monkeypatch):
+    monkeypatch.setattr(index_content, "EMBED_BATCH_SIZE", 2)
+    pages = {
+        "https://x/a": [{"title": "A", "content": "a" * n, "chunkId": n} for n in (1, 2, 3)],
+        "https://x/b": [{"title": "B", "content": "b" * n, "chunkId": n} for n in (4, 5)],
+    }
+    requests = []
+    uploaded = _index_run(monkeypatch, pages, lambda t: [float(len(t))], requests)
+
+    assert sorted(len(texts) for texts in requests) == [1, 2, 2]
+    assert [d["contentVector"] for d in uploaded] == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+
+
+def test_repeated_chunk_text_is_embedded_once(monkeypatch):
+    boilerplate = "Next unit: Knowledge check"
+    pages = {
+        "https://x/a": [{"title": "A", "content": boilerplate, "chunkId": 0}],
+        "https://x/b": [{"title": "B", "content": "b", "chunkId": 0},
+                        {"title": "B", "content": boilerplate, "chunkId": 1}],
+    }
+    requests = []
+    uploaded = _index_run(monkeypatch, pages, lambda t: [float(len(t))], requests)
+
+    assert sorted(t for texts in requests for t in texts) == sorted([boilerplate, "b"])
+    assert len(uploaded) == 3
+    assert [d["contentVector"] for d in uploaded] == [[26.0], [1.0], [26.0]]
+
+
+def test_uploaded_vectors_are_kept_compactly_rather_than_as_batch_results(monkeypatch):
+    from array import array
+
+    maps = []
+    submit = index_content._submit_embeddings
+
+    def _submit(executor, client, batch, vectors):
+        maps.append(vectors)
+        submit(executor, client, batch, vectors)
+
+    monkeypatch.setattr(index_content, "_submit_embeddings", _submit)
+    # 101 chunks make two uploads; the last repeats the first chunk's text.
+    chunks = [{"title": "A", "content": f"text {i}", "chunkId": i} for i in range(100)]
+    chunks.append({"title": "A", "content": "text 0", "chunkId": 100})
+    uploaded = _index_run(monkeypatch, {"https://x/a": chunks}, lambda t: [float(len(t)), 0.5])
+
+    by_chunk = {d["chunkId"]: d["contentVector"] for d in uploaded}  # the uploads may land in either order
+    assert by_chunk[100] == by_chunk[0] == [6.0, 0.5]
+    vectors = maps[0]
+    assert len(vectors) == 100
+    assert all(isinstance(v, array) for v in vectors.values())
+
+
+def test_the_stored_chunk_hash_keeps_its_format(monkeypatch):
+    import hashlib
+
+    pages = {"https://x/a": [{"title": "A", "content": "a", "chunkId": 0}]}
+    (doc,) = _index_run(monkeypatch, pages, lambda t: [1.0])
+    # Persisted in the index, so changing it would make every chunk look new.
+    assert doc["contentHash"] == hashlib.sha256(b"a").hexdigest()[:16]
+
+
+def test_pages_are_fetched_concurrently_and_kept_in_source_order(monkeypatch):
+    import threading
+
+    both_started = threading.Barrier(2, timeout=5)
+    pages = {
+        "https://x/a": [{"title": "A", "content": "a", "chunkId": 0}],
+        "https://x/b": [{"title": "B", "content": "b", "chunkId": 0}],
+    }
+
+    def _fetch(url):
+        both_started.wait()
+        return pages[url], "h"
+
+    uploaded = _index_run(monkeypatch, pages, lambda t: [0.0], fetch=_fetch)
+
+    assert [d["sourceUrl"] for d in uploaded] == list(pages)
+
+
+def test_a_full_batch_uploads_while_later_chunks_are_embedded(monkeypatch):
+    import threading
+
+    monkeypatch.setattr(index_content, "EMBED_BATCH_SIZE", 1)
+    last_embedded = threading.Event()
+
+    class _SlowClient(_SearchClient):
+        def upload_documents(self, docs):
+            if not self.uploaded:
+                # Blocks the run unless this upload is off the main loop.
+                assert last_embedded.wait(timeout=5)
+            super().upload_documents(docs)
+
+    def _embed(text):
+        if text == "last":
+            last_embedded.set()
+        return [0.0]
+
+    pages = {
+        "https://x/a": [{"title": "A", "content": f"a{n}", "chunkId": n} for n in range(100)],
+        "https://x/b": [{"title": "B", "content": "last", "chunkId": 0}],
+    }
+    uploaded = _index_run(monkeypatch, pages, _embed, client=_SlowClient())
+
+    assert len(uploaded) == 101
+
+
+def test_a_page_listed_twice_is_indexed_once(monkeypatch):
+    fetched = []
+    pages = {
+        "https://learn.microsoft.com/a": [{"title": "A", "content": "a", "chunkId": 0}],
+        "https://Learn.microsoft.com/a#next-steps": [{"title": "A", "content": "a", "chunkId": 0}],
+    }
+
+    def _fetch(url):
+        fetched.append(url)
+        return pages[url], "h"
+
+    uploaded = _index_run(monkeypatch, pages, lambda t: [0.0], fetch=_fetch)
+
+    assert fetched == ["https://learn.microsoft.com/a"]
+    assert len(uploaded) == 1
+
+
+def test_an_update_run_keeps_unchanged_pages_without_re_embedding(monkeypatch):
+    url_hash = index_content.hashlib.sha256(b"https://x/same").hexdigest()[:8]
+    kept_ids = [f"ai-103-{url_hash}-0", f"ai-103-{url_hash}-1"]
+    client = _SearchClient(kept_ids)
+    pages = {
+        "https://x/same": [{"title": "S", "content": "s", "chunkId": 0}],
+        "https://x/edited": [{"title": "E", "content": "e", "chunkId": 0}],
+    }
+    sources = [
+        {"url": "https://x/same", "indexedHash": "h"},
+        {"url": "https://x/edited", "indexedHash": "old"},
+    ]
+    requests = []
+    uploaded = _index_run(monkeypatch, pages, lambda t: [0.0], requests,
+                          client=client, sources=sources)
+
+    assert [d["sourceUrl"] for d in uploaded] == ["https://x/edited"]
+    assert requests == [["e"]]
+    assert client.deleted == []
+    index_content.source_store.record_indexed.assert_called_once_with(
+        "ai-103", "https://x/edited", "h"
+    )
+
+
+def test_batched_embeddings_come_back_in_input_order():
+    openai = MagicMock()
+    openai.embeddings.create.return_value = MagicMock(data=[
+        MagicMock(index=1, embedding=[2.0]), MagicMock(index=0, embedding=[1.0]),
+    ])
+    assert index_content.get_embeddings(["x", "yy"], openai) == [[1.0], [2.0]]
+    openai.embeddings.create.assert_called_once()
+
+
 # ---------------------------------------------------------------------------
 # Baseline semantics
 # ---------------------------------------------------------------------------
@@ -186,6 +403,93 @@ def test_the_baseline_is_not_advanced_by_the_check_itself():
         "only save_episode may move the generation baseline"
 
 
+def test_indexing_a_source_keeps_its_generation_baseline(monkeypatch):
+    from pipeline import source_store
+
+    known = source_store._new_source("ai-103", "https://x/a")
+    known.update(contentHash="gen", episodeRefs=["ai-103-instructional-001"])
+    container = MagicMock()
+    container.read_item.return_value = known
+    monkeypatch.setattr(source_store, "_sources", lambda **_: container)
+
+    source_store.record_indexed("ai-103", "https://x/a", "idx")
+
+    assert container.read_item.call_args.kwargs["partition_key"] == "ai-103"
+    (doc,) = container.upsert_item.call_args.args
+    assert (doc["contentHash"], doc["indexedHash"]) == ("gen", "idx")
+    assert doc["episodeRefs"] == ["ai-103-instructional-001"]
+
+
+def test_a_failed_source_read_is_not_mistaken_for_a_new_source(monkeypatch):
+    from pipeline import source_store
+
+    container = MagicMock()
+    container.read_item.side_effect = RuntimeError("throttled")
+    monkeypatch.setattr(source_store, "_sources", lambda **_: container)
+
+    with pytest.raises(RuntimeError):
+        source_store.record_indexed("ai-103", "https://x/a", "idx")
+    container.upsert_item.assert_not_called()
+
+
+def test_sources_are_recorded_in_one_read_and_one_batch(monkeypatch):
+    from pipeline import source_store
+
+    a_id = source_store.source_id("ai-103", "https://x/a")
+    container = MagicMock()
+    container.query_items.return_value = iter(
+        [{"id": a_id, "episodeRefs": ["ai-103-instructional-001"]}]
+    )
+    monkeypatch.setattr(source_store, "_sources", lambda **_: container)
+
+    source_store.record_generated_many("ai-103", [
+        ("https://x/a", "ai-103-instructional-002", "h2"),
+        ("https://x/b", "ai-103-instructional-002", "h2"),
+        ("https://x/a", "ai-103-instructional-003", "h3"),
+    ])
+
+    container.query_items.assert_called_once()
+    assert container.query_items.call_args.kwargs["partition_key"] == "ai-103"
+    (batch,) = container.execute_item_batch.call_args_list
+    assert batch.kwargs["partition_key"] == "ai-103"
+    (kind_a, (patched_id, patch)), (kind_b, (created,)) = batch.kwargs["batch_operations"]
+
+    # A stored source is patched: only its hash, timestamp and new refs are sent.
+    assert (kind_a, patched_id) == ("patch", a_id)
+    assert patch[0] == {"op": "set", "path": "/contentHash", "value": "h3"}
+    assert patch[2:] == [
+        {"op": "add", "path": "/episodeRefs/-", "value": "ai-103-instructional-002"},
+        {"op": "add", "path": "/episodeRefs/-", "value": "ai-103-instructional-003"},
+    ]
+    # An unknown one is created whole.
+    assert kind_b == "upsert"
+    assert (created["url"], created["contentHash"]) == ("https://x/b", "h2")
+    assert created["episodeRefs"] == ["ai-103-instructional-002"]
+
+
+def test_sources_are_listed_from_their_certifications_partition(monkeypatch):
+    from pipeline import source_store
+
+    container = MagicMock()
+    container.query_items.return_value = iter([])
+    monkeypatch.setattr(source_store, "_sources", lambda **_: container)
+
+    source_store.list_sources("ai-103")
+
+    assert container.query_items.call_args.kwargs["partition_key"] == "ai-103"
+    assert "enable_cross_partition_query" not in container.query_items.call_args.kwargs
+
+
+def test_a_source_without_refs_has_them_set_rather_than_appended():
+    from pipeline import source_store
+
+    patch = source_store._generated_patch(None, ["e1"], "h")
+    assert patch[-1] == {"op": "set", "path": "/episodeRefs", "value": ["e1"]}
+
+    already = source_store._generated_patch(["e1"], ["e1"], "h")
+    assert [op["path"] for op in already] == ["/contentHash", "/lastGeneratedAt"]
+
+
 # ---------------------------------------------------------------------------
 # Read-only update check
 # ---------------------------------------------------------------------------
@@ -4,13 +4,23 @@ Unit tests for episode grounding and packing.
 Run:  python -m pytest src/functions/test_generation.py -v
 """
 
+import hashlib
+import os
+from collections import OrderedDict
 from unittest.mock import MagicMock
 
 import pytest
+from lxml import etree
 
 from pipeline import generate_episodes as ge
 
 
+@pytest.fixture(autouse=True)
+def _fresh_embedding_cache(monkeypatch):
+    monkeypatch.setattr(ge, "_embeddings", OrderedDict())
+    monkeypatch.setattr(ge, "_answered_queries", [])
+
+
 # ---------------------------------------------------------------------------
 # Episode packing
 # ---------------------------------------------------------------------------
@@ -66,7 +76,9 @@ def _docs(n, url="https://learn.microsoft.com/training/modules/a/1-intro/"):
 
 def _openai():
     client = MagicMock()
-    client.embeddings.create.return_value = MagicMock(data=[MagicMock(embedding=[0.1] * 8)])
+    client.embeddings.create.side_effect = lambda model, input: MagicMock(data=[
+        MagicMock(index=i, embedding=[0.1 * (i + 1)] * 8) for i in range(len(input))
+    ])
     return client
 
 
@@ -87,6 +99,12 @@ def test_retrieval_is_filtered_to_the_episodes_own_units():
     assert "search.in(sourceUrl, '" + "|".join(URLS) + "', '|')" in flt
 
 
+def test_the_vector_query_is_prefiltered():
+    client = _client(_docs(5))
+    ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai(), source_urls=URLS)
+    assert client.search.call_args.kwargs["vector_filter_mode"] == "preFilter"
+
+
 def test_without_source_urls_the_filter_stays_certification_wide():
     client = _client(_docs(5))
     ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai())
@@ -107,12 +125,145 @@ def test_a_thin_scoped_result_widens_to_the_certification():
     assert out["content"].count("##") == 12
 
 
+def test_bm25_mode_skips_the_embedding_call(monkeypatch):
+    monkeypatch.setenv("RETRIEVAL_MODE", "bm25")
+    client, openai = _client(_docs(5)), _openai()
+    ge.retrieve_content("ai-103", "Domain", ["t1"], client, openai, source_urls=URLS)
+
+    openai.embeddings.create.assert_not_called()
+    assert "vector_queries" not in client.search.call_args.kwargs
+
+
 def test_a_healthy_scoped_result_is_not_widened():
     client = _client(_docs(9))
     ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai(), source_urls=URLS)
     assert client.search.call_count == 1
 
 
+def test_retrieved_content_stops_at_the_prompt_budget(monkeypatch):
+    monkeypatch.setattr(ge, "MAX_RETRIEVED_CHARS", 30)
+    out = ge.retrieve_content("ai-103", "Domain", ["t1"], _client(_docs(5)), _openai())
+    assert out["content"].count("##") == 2  # "## Tn\n\nbody n" is 14 characters
+
+
+def test_an_oversized_chunk_is_cut_at_a_word_boundary(monkeypatch):
+    monkeypatch.setattr(ge, "MAX_CHUNK_CHARS", 12)
+    docs = [{"title": "T", "content": "alpha beta gamma delta", "sourceUrl": URLS[0]}]
+    out = ge.retrieve_content("ai-103", "Domain", ["t1"], _client(docs), _openai())
+    assert out["content"] == "## T\n\nalpha beta"
+
+
+@pytest.mark.parametrize("content,expected", [
+    (" " * 20 + "alpha", " " * 12),  # nothing but whitespace before the cut
+    ("alphabetagammadelta", "alphabetagam"),  # a single word longer than the cut
+])
+def test_an_oversized_chunk_without_a_word_boundary_is_cut_at_the_limit(monkeypatch, content, expected):
+    monkeypatch.setattr(ge, "MAX_CHUNK_CHARS", 12)
+    docs = [{"title": "T", "content": content, "sourceUrl": URLS[0]}]
+    out = ge.retrieve_content("ai-103", "Domain", ["t1"], _client(docs), _openai())
+    assert out["content"] == f"## T\n\n{expected}"
+
+
+def test_retrieved_source_urls_keep_search_rank_order():
+    docs = [{"title": f"T{i}", "content": f"body {i}", "sourceUrl": url}
+            for i, url in enumerate([URLS[1], URLS[0], URLS[1]])]
+    out = ge.retrieve_content("ai-103", "Domain", ["t1"], _client(docs), _openai())
+    assert out["source_urls"] == [URLS[1], URLS[0]]
+
+
+def test_near_duplicate_chunks_are_sent_once():
+    docs = _docs(2) + [{"title": "Copy", "content": "BODY   0", "sourceUrl": URLS[1]}]
+    out = ge.retrieve_content("ai-103", "Domain", ["t1"], _client(docs), _openai())
+    assert out["content"].count("##") == 2
+    assert "Copy" not in out["content"]
+
+
+@pytest.mark.parametrize("count", [0, 1, 4])
+def test_the_content_hash_is_the_digest_of_the_combined_content(count):
+    out = ge.retrieve_content("ai-103", "Domain", ["t1"], _client(_docs(count)), _openai())
+    assert out["content_hash"] == hashlib.sha256(out["content"].encode()).hexdigest()[:16]
+
+
+def test_a_cached_search_result_skips_the_search(monkeypatch, tmp_path):
+    monkeypatch.setattr(ge, "SEARCH_CACHE_TTL_SECONDS", 3600)
+    monkeypatch.setattr(ge, "SEARCH_CACHE_DIR", tmp_path)
+    client = _client(_docs(5), _docs(5))
+
+    first = ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai())
+    second = ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai())
+
+    assert client.search.call_count == 1
+    assert second == first
+
+
+def test_an_expired_search_result_is_searched_again(monkeypatch, tmp_path):
+    monkeypatch.setattr(ge, "SEARCH_CACHE_TTL_SECONDS", 3600)
+    monkeypatch.setattr(ge, "SEARCH_CACHE_DIR", tmp_path)
+    client = _client(_docs(5), _docs(5))
+
+    ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai())
+    for entry in tmp_path.iterdir():
+        os.utime(entry, (0, 0))
+    ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai())
+
+    assert client.search.call_count == 2
+
+
+def test_a_near_identical_query_reuses_the_retrieval(monkeypatch, tmp_path):
+    monkeypatch.setattr(ge, "SEARCH_CACHE_TTL_SECONDS", 3600)
+    monkeypatch.setattr(ge, "SEARCH_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(ge, "SEARCH_CACHE_SIMILARITY", 0.95)
+    client = _client(_docs(5), _docs(5))
+
+    first = ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai())
+    # _openai() gives every single-text request the same vector.
+    second = ge.retrieve_content("ai-103", "Domain!", ["t1"], client, _openai())
+    ge.retrieve_content("ai-103", "Domain", ["t1"], client, _openai(), source_urls=URLS)
+
+    assert second == first
+    assert client.search.call_count == 2  # the third query has a different scope
+
+
+def test_the_widened_retry_reuses_the_query_embedding():
+    client, openai = _client(_docs(1), _docs(12)), _openai()
+    ge.retrieve_content("ai-103", "Domain", ["t1"], client, openai, source_urls=URLS)
+
+    assert client.search.call_count == 2
+    openai.embeddings.create.assert_called_once()
+
+
+def test_embeddings_persist_across_runs_in_the_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(ge, "EMBEDDING_CACHE_DIR", str(tmp_path))
+    first, second = _openai(), _openai()
+
+    assert ge.get_embedding("cache me", first) == pytest.approx([0.1] * 8)
+    ge._embeddings.clear()  # a new process
+    assert ge.get_embedding("cache me", second) == pytest.approx([0.1] * 8)
+
+    first.embeddings.create.assert_called_once()
+    second.embeddings.create.assert_not_called()
+
+
+def test_only_uncached_texts_are_embedded_in_one_request():
+    openai = _openai()
+    ge.get_embedding("b", openai)
+
+    vectors = ge.get_embeddings(["a", "b", "c", "a"], openai)
+
+    assert openai.embeddings.create.call_args.kwargs["input"] == ["a", "c"]
+    assert vectors[0] == vectors[3] and vectors[0] != vectors[2]
+
+
+def test_an_embedding_response_missing_a_text_is_an_error():
+    openai = MagicMock()
+    openai.embeddings.create.return_value = MagicMock(data=[
+        MagicMock(index=0, embedding=[0.1] * 8),
+    ])
+
+    with pytest.raises(RuntimeError, match="for 2 texts returned 1"):
+        ge.get_embeddings(["short of one", "left out"], openai)
+
+
 # The old code built an escaped cert_filter and then interpolated the raw value
 # into the query anyway, so the escaping never applied.
 def test_a_quote_in_the_certification_id_is_escaped():
@@ -128,3 +279,628 @@ def test_a_quote_in_a_source_url_is_escaped():
         source_urls=["https://learn.microsoft.com/x'y/"],
     )
     assert "'https://learn.microsoft.com/x''y/'" in client.search.call_args.kwargs["filter"]
+
+
+# ---------------------------------------------------------------------------
+# TTS segmentation
+# ---------------------------------------------------------------------------
+
+def _paragraphs(*sizes):
+    return "\n\n".join(" ".join(["w"] * n) for n in sizes)
+
+
+def _words(ssml):
+    return " ".join(etree.fromstring(ssml.encode()).itertext()).split()
+
+
+def test_segments_are_balanced_rather_than_greedy():
+    ssml = ge.build_ssml_from_narration(_paragraphs(*[100] * 11), "instructional")
+    segments = ge.split_ssml_for_tts(ssml, max_words_per_segment=500)
+    assert [len(_words(s)) for s in segments] == [400, 400, 300]
+
+
+def test_no_segment_exceeds_the_limit():
+    ssml = ge.build_ssml_from_narration(_paragraphs(300, 300, 300, 50), "instructional")
+    segments = ge.split_ssml_for_tts(ssml, max_words_per_segment=500)
+    assert all(len(_words(s)) <= 500 for s in segments)
+
+
+def test_llm_ssml_is_split_with_its_markup_intact():
+    sentences = [f"<s>Sentence {i} has <emphasis>five</emphasis> words.</s>" for i in range(6)]
+    ssml = (
+        '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" '
+        'xmlns:mstts="http://www.w3.org/2001/mstts" xml:lang="en-US">'
+        '<voice name="en-US-AndrewNeural"><mstts:express-as style="friendly">'
+        f"<p>{''.join(sentences[:3])}</p><p>{''.join(sentences[3:])}</p>"
+        "</mstts:express-as></voice></speak>"
+    )
+    segments = ge.split_ssml_for_tts(ssml, max_words_per_segment=10)
+
+    assert len(segments) == 3
+    for segment in segments:
+        assert '<voice name="en-US-AndrewNeural"><mstts:express-as style="friendly"><p>' in segment
+    assert "".join(segments).count("<emphasis>five</emphasis>") == 6
+    assert sum((_words(s) for s in segments), []) == _words(ssml)
+
+
+def test_a_podcast_segment_keeps_the_active_speaker():
+    narration = "[HOST] Welcome.\n\n[EXPERT] " + " ".join(["w"] * 10) + "\n\n" + " ".join(["x"] * 10)
+    ssml = ge.build_ssml_from_narration(narration, "podcast")
+    segments = ge.split_ssml_for_tts(ssml, max_words_per_segment=12)
+    assert '<voice name="en-US-TonyNeural">' in segments[-1]
+    assert _words(segments[-1]) == ["x"] * 10
+
+
+# ---------------------------------------------------------------------------
+# Saving a batch of episodes
+# ---------------------------------------------------------------------------
+
+def test_existing_episodes_are_read_in_one_partition_query():
+    cosmos = MagicMock()
+    container = cosmos.get_database_client.return_value.get_container_client.return_value
+    container.query_items.return_value = iter([1, 2, 5])
+
+    assert ge.existing_episode_numbers("ai-103", "instructional", cosmos) == {1, 2, 5}
+    container.query_items.assert_called_once()
+    assert container.query_items.call_args.kwargs["partition_key"] == "ai-103"
+
+
+def test_the_next_episode_number_is_read_from_the_certifications_partition():
+    cosmos = MagicMock()
+    container = cosmos.get_database_client.return_value.get_container_client.return_value
+    container.query_items.return_value = iter([7])
+
+    assert ge.get_next_episode_number("ai-103", "instructional", cosmos) == 8
+    assert container.query_items.call_args.kwargs["partition_key"] == "ai-103"
+    assert "enable_cross_partition_query" not in container.query_items.call_args.kwargs
+
+
+def test_the_existing_episode_query_can_be_limited_to_the_batch():
+    cosmos = MagicMock()
+    container = cosmos.get_database_client.return_value.get_container_client.return_value
+    container.query_items.return_value = iter([])
+
+    ge.existing_episode_numbers("ai-103", "instructional", cosmos, first=11, last=20)
+
+    kwargs = container.query_items.call_args.kwargs
+    assert "BETWEEN @first AND @last" in kwargs["query"]
+    assert {"name": "@last", "value": 20} in kwargs["parameters"]
+
+
+def _episode_doc(n, cert="ai-103"):
+    from pipeline.save_episode import build_episode_doc
+
+    return build_episode_doc(
+        certification_id=cert, audio_format="instructional", episode_number=n,
+        skill_domain="Domain", skill_topics=["t"], audio_url="a", script_url="s",
+        duration_seconds=1.0, is_amendment=False, amendment_of=0,
+        source_urls=[f"https://learn.microsoft.com/{n}/"], content_hash="h",
+    )
+
+
+def test_a_batch_is_saved_in_one_transactional_batch_per_certification(monkeypatch):
+    from pipeline import save_episode as se
+
+    container = MagicMock()
+    recorded = []
+    monkeypatch.setattr(se, "_episodes_container", lambda: container)
+    monkeypatch.setattr(se.source_store, "record_generated_many", lambda *a: recorded.append(a))
+
+    docs = [_episode_doc(n) for n in range(1, 4)] + [_episode_doc(1, cert="az-104")]
+    assert se.save_episodes(docs) == docs
+
+    calls = container.execute_item_batch.call_args_list
+    assert [c.kwargs["partition_key"] for c in calls] == ["ai-103", "az-104"]
+    assert [len(c.kwargs["batch_operations"]) for c in calls] == [3, 1]
+    assert calls[0].kwargs["batch_operations"][0] == ("upsert", (docs[0],))
+    container.upsert_item.assert_not_called()
+    assert [(cert, len(generated)) for cert, generated in recorded] == [("ai-103", 3), ("az-104", 1)]
+
+
+def test_a_failed_batch_does_not_move_any_source_baseline(monkeypatch):
+    from pipeline import save_episode as se
+
+    container = MagicMock()
+    container.execute_item_batch.side_effect = RuntimeError("conflict")
+    record = MagicMock()
+    monkeypatch.setattr(se, "_episodes_container", lambda: container)
+    monkeypatch.setattr(se.source_store, "record_generated_many", record)
+
+    with pytest.raises(RuntimeError):
+        se.save_episodes([_episode_doc(1), _episode_doc(2)])
+    record.assert_not_called()
+
+
+def test_batches_committed_before_a_failure_still_record_their_sources(monkeypatch):
+    from pipeline import save_episode as se
+
+    container = MagicMock()
+    container.execute_item_batch.side_effect = [None, RuntimeError("conflict")]
+    recorded = []
+    monkeypatch.setattr(se, "_episodes_container", lambda: container)
+    monkeypatch.setattr(se.source_store, "record_generated_many", lambda *a: recorded.append(a))
+
+    with pytest.raises(RuntimeError):
+        se.save_episodes([_episode_doc(1), _episode_doc(1, cert="az-104")])
+    assert [(cert, len(generated)) for cert, generated in recorded] == [("ai-103", 1)]
+
+
+def test_saves_share_one_cosmos_client(monkeypatch):
+    from pipeline import save_episode as se
+
+    monkeypatch.setenv("COSMOS_DB_ENDPOINT", "https://cosmos.invalid")
+    cosmos = MagicMock()
+    monkeypatch.setattr(se, "CosmosClient", cosmos)
+    monkeypatch.setattr(se, "get_credential", MagicMock())
+    caches = (se._get_cosmos_client, se._get_container)
+    for cached in caches:
+        cached.cache_clear()
+
+    try:
+        assert se._episodes_container() is se._episodes_container()
+        assert cosmos.call_count == 1
+    finally:
+        for cached in caches:
+            cached.cache_clear()
+
+
+# ---------------------------------------------------------------------------
+# Prompt templates
+# ---------------------------------------------------------------------------
+
+def test_the_prompt_environment_is_shared_and_never_reloads():
+    env = ge.get_jinja_env()
+    assert ge.get_jinja_env() is env
+    assert env.auto_reload is False
+    assert env.get_template("narration.user.jinja2") is env.get_template("narration.user.jinja2")
+
+
+def test_every_prompt_is_compiled_before_first_use(monkeypatch):
+    monkeypatch.setattr(ge, "_jinja_env", None)
+    env = ge.get_jinja_env()
+    assert len(env.cache) == len(env.list_templates(extensions=["jinja2"])) >= 5
+
+
+def test_each_role_is_rendered_from_its_own_template():
+    messages = ge.render_messages(
+        ge.get_jinja_env(),
+        "narration",
+        episode_number=1,
+        skill_domain="Domain",
+        skill_topics=["t1"],
+        retrieved_content={"content": "Step 1. user: selects a region.", "source_urls": []},
+        audio_format="instructional",
+        min_words=1200,
+    )
+
+    assert [m["role"] for m in messages] == ["system", "user"]
+    assert messages[0]["content"].startswith("You are an expert instructional designer")
+    assert "user: selects a region." in messages[1]["content"]
+    assert "Generate the narration script now." in messages[1]["content"]
+
+
+# ---------------------------------------------------------------------------
+# Streamed completions
+# ---------------------------------------------------------------------------
+
+def _chunk(content=None, usage=None):
+    choices = [] if content is None else [MagicMock(delta=MagicMock(content=content))]
+    return MagicMock(choices=choices, usage=usage)
+
+
+def test_a_streamed_completion_is_collected_and_metered(monkeypatch):
+    usage = MagicMock(prompt_tokens=10, completion_tokens=3)
+    client = MagicMock()
+    client.chat.completions.create.return_value = iter(
+        [_chunk("Hello"), _chunk(), _chunk(", world"), _chunk(usage=usage)]
+    )
+    recorded = []
+    monkeypatch.setattr(ge.cost, "record_gpt_usage", recorded.append)
+
+    response = ge.call_openai_with_retry(client, model="gpt-4o", messages=[], stream=True)
+
+    assert response.choices[0].message.content == "Hello, world"
+    assert recorded == [usage]
+    assert client.chat.completions.create.call_args.kwargs["stream_options"] == {"include_usage": True}
+
+
+def _rate_limited(headers):
+    from openai import RateLimitError
+
+    response = MagicMock(headers=headers, status_code=429)
+    return RateLimitError("429", response=response, body=None)
+
+
+@pytest.mark.parametrize("headers,expected", [
+    ({"retry-after-ms": "1500", "retry-after": "2"}, 1.5),
+    ({"retry-after": "7"}, 7.0),
+    ({}, 2),
+])
+def test_a_rate_limit_waits_as_long_as_the_service_asks(monkeypatch, headers, expected):
+    client = MagicMock()
+    client.chat.completions.create.side_effect = [_rate_limited(headers), MagicMock(usage=None)]
+    sleeps = []
+    monkeypatch.setattr(ge.time, "sleep", sleeps.append)
+    monkeypatch.setattr(ge.random, "uniform", lambda a, b: 0)
+
+    ge.call_openai_with_retry(client, model="gpt-4o", messages=[])
+
+    assert sleeps == [expected]
+
+
+def test_a_dropped_connection_is_retried_with_capped_jittered_backoff(monkeypatch):
+    from openai import APIConnectionError
+
+    client = MagicMock()
+    client.chat.completions.create.side_effect = (
+        [APIConnectionError(request=MagicMock())] * 6 + [MagicMock(usage=None)]
+    )
+    sleeps = []
+    monkeypatch.setattr(ge.time, "sleep", sleeps.append)
+    monkeypatch.setattr(ge.random, "uniform", lambda a, b: b)
+
+    ge.call_openai_with_retry(client, model="gpt-4o", messages=[])
+
+    assert sleeps == [2.5, 5.0, 10.0, 20.0, 40.0, 60]
+
+
+def test_chat_calls_go_through_the_limiter(monkeypatch):
+    limiter = MagicMock()
+    monkeypatch.setattr(ge, "_openai_limiter", limiter)
+    client = MagicMock()
+    client.chat.completions.create.return_value = MagicMock(usage=None)
+
+    ge.call_openai_with_retry(
+        client, model="gpt-4o", messages=[{"role": "user", "content": "x" * 400}], max_tokens=50,
+    )
+
+    limiter.acquire.assert_called_once_with(150)
+
+
+# ---------------------------------------------------------------------------
+# GPT output cache
+# ---------------------------------------------------------------------------
+
+def _prepare(monkeypatch, cached, **kwargs):
+    monkeypatch.setattr(ge, "retrieve_content", MagicMock(return_value={
+        "content": "c", "source_urls": [], "content_hash": "abc",
+    }))
+    monkeypatch.setattr(ge.gpt_cache, "load", MagicMock(return_value=cached))
+    monkeypatch.setattr(ge.gpt_cache, "save", MagicMock())
+    monkeypatch.setattr(ge, "generate_narration", MagicMock(return_value="fresh " * 1300))
+    ge.prepare_episode(
+        episode_number=1, skill_domain="D", skill_topics=["t"], source_urls=[],
+        certification_id="ai-103", audio_format="instructional",
+        search_client=None, openai_client=None, jinja_env=None,
+        instructional_voice="v", podcast_host_voice="h", podcast_expert_voice="e",
+        episode_title="D", **kwargs,
+    )
+
+
+def test_a_cached_narration_skips_the_gpt_call(monkeypatch):
+    _prepare(monkeypatch, cached="cached narration")
+    ge.generate_narration.assert_not_called()
+    ge.gpt_cache.save.assert_not_called()
+
+
+def test_a_cache_miss_generates_and_writes_back(monkeypatch):
+    _prepare(monkeypatch, cached=None)
+    ge.generate_narration.assert_called_once()
+    assert ge.gpt_cache.save.call_args.args[:2] == ("ai-103", "narration")
+
+
+def test_a_short_narration_is_kept_rather_than_regenerated(monkeypatch):
+    monkeypatch.setenv("MIN_WORDS_PER_PART", "2000")
+    _prepare(monkeypatch, cached=None)
+    ge.generate_narration.assert_called_once()
+    assert ge.generate_narration.call_args.kwargs["min_words"] == 2400
+
+
+def test_source_urls_are_deduplicated_in_discovery_order(monkeypatch):
+    monkeypatch.setattr(ge.gpt_cache, "load", MagicMock(return_value="cached"))
+    monkeypatch.setattr(ge, "retrieve_content", MagicMock(return_value={
+        "content": "c", "source_urls": [URLS[1], "https://x/3", URLS[0]], "content_hash": "abc",
+    }))
+    prepared = ge.prepare_episode(
+        episode_number=1, skill_domain="D", skill_topics=["t"], source_urls=URLS,
+        certification_id="ai-103", audio_format="instructional",
+        search_client=None, openai_client=None, jinja_env=None,
+        instructional_voice="v", podcast_host_voice="h", podcast_expert_voice="e",
+        episode_title="D",
+    )
+    assert prepared["source_urls"] == URLS + ["https://x/3"]
+
+
+def test_the_cache_can_be_bypassed(monkeypatch):
+    _prepare(monkeypatch, cached="cached narration", use_gpt_cache=False)
+    ge.gpt_cache.load.assert_not_called()
+    ge.generate_narration.assert_called_once()
+
+
+def test_llm_ssml_is_cached_by_narration_and_voices(monkeypatch):
+    monkeypatch.setenv("USE_LLM_SSML", "true")
+    store = {}
+    monkeypatch.setattr(ge.gpt_cache, "load", lambda cert, kind, key: store.get((cert, kind, key)))
+    monkeypatch.setattr(ge.gpt_cache, "save", lambda cert, kind, key, text: store.update({(cert, kind, key): text}))
+    monkeypatch.setattr(ge, "render_messages", MagicMock(return_value=[]))
+    client = MagicMock()
+    client.chat.completions.create.return_value = MagicMock(usage=None, choices=[
+        MagicMock(message=MagicMock(content='<speak><voice name="en-US-GuyNeural">hi</voice></speak>'))
+    ])
+    kwargs = dict(narration="hi", audio_format="instructional", openai_client=client,
+                  jinja_env=None, certification_id="ai-103", use_gpt_cache=True)
+
+    first = ge.generate_ssml(**kwargs)
+    second = ge.generate_ssml(**kwargs)
+    ge.generate_ssml(**{**kwargs, "instructional_voice": "en-US-AvaNeural"})
+
+    assert first == second
+    assert client.chat.completions.create.call_count == 2
+
+
+def test_a_prompt_edit_invalidates_cached_narrations(monkeypatch):
+    keys = []
+    for version in ("v1", "v2"):
+        monkeypatch.setattr(ge, "prompt_version", lambda prompt, v=version: v)
+        _prepare(monkeypatch, cached=None)
+        keys.append(ge.gpt_cache.load.call_args.args[2])
+
+    assert keys[0] != keys[1]
+
+
+def test_the_prompt_version_covers_both_roles():
+    ge.prompt_version.cache_clear()
+    assert ge.prompt_version("narration") != ge.prompt_version("ssml")
+    assert len(ge.prompt_version("narration")) == 16
+
+
+# ---------------------------------------------------------------------------
+# Audio upload overlaps synthesis
+# ---------------------------------------------------------------------------
+
+def test_audio_segments_are_staged_as_they_finish_and_committed(monkeypatch):
+    def _synthesize(on_segment, **_):
+        on_segment(1, b"b")
+        on_segment(0, b"a")
+        return {"audio_data": b"ab", "duration_seconds": 1.0,
+                "word_boundaries": [], "segment_count": 2}
+
+    monkeypatch.setattr(ge, "synthesize_audio_with_chunking", _synthesize)
+    monkeypatch.setattr(ge, "stage_audio_segment", MagicMock())
+    monkeypatch.setattr(ge, "commit_audio_segments", MagicMock(return_value="https://x/audio/ep.mp3"))
+    prepared = {"narration": "n", "ssml": "s", "episode_number": 7}
+
+    result = ge.synthesize_episode_audio(prepared, "ai-103", "instructional")
+
+    assert [c.args for c in ge.stage_audio_segment.call_args_list] == [
+        (b"b", "ai-103", "instructional", 7, 1),
+        (b"a", "ai-103", "instructional", 7, 0),
+    ]
+    ge.commit_audio_segments.assert_called_once_with(2, "ai-103", "instructional", 7)
+    assert result["audio_url"] == "https://x/audio/ep.mp3"
+    assert "audio_data" not in result and "segment_count" not in result
+
+
+def test_staged_segments_are_committed_in_index_order(monkeypatch):
+    from pipeline import upload_to_blob as ub
+
+    service = MagicMock()
+    monkeypatch.setattr(ub, "get_blob_service_client", lambda: service)
+    monkeypatch.setenv("STORAGE_ACCOUNT_NAME", "acct")
+
+    for index in (2, 0, 1):
+        ub.stage_audio_segment(b"x", "ai-103", "instructional", 7, index)
+    url = ub.commit_audio_segments(3, "ai-103", "instructional", 7)
+
+    blocks = service.get_blob_client.return_value.commit_block_list.call_args.args[0]
+    staged = [c.args[0] for c in service.get_container_client.return_value
+              .get_blob_client.return_value.stage_block.call_args_list]
+    assert [b.id for b in blocks] == sorted(staged)
+    assert len({len(b) for b in staged}) == 1
+    assert url == "https://acct.blob.core.windows.net/audio/ai-103/instructional/episodes/007.mp3"
+
+
+def test_staged_segments_share_one_blob_client(monkeypatch):
+    from pipeline import credentials, upload_to_blob as ub
+
+    monkeypatch.setenv("STORAGE_ACCOUNT_NAME", "acct")
+    monkeypatch.delenv("AZURE_STORAGE_CONNECTION_STRING", raising=False)
+    monkeypatch.delenv("STORAGE_ACCOUNT_KEY", raising=False)
+    blob_service = MagicMock()
+    monkeypatch.setattr(ub, "BlobServiceClient", blob_service)
+    monkeypatch.setattr(credentials, "DefaultAzureCredential", MagicMock())
+    monkeypatch.setattr(credentials, "_credential", None)
+    caches = (ub._blob_service, ub._entra_blob_service)
+    for cached in caches:
+        cached.cache_clear()
+
+    try:
+        for index in range(3):
+            ub.stage_audio_segment(b"x", "ai-103", "instructional", 7, index)
+        assert blob_service.call_count == 1
+        assert credentials.DefaultAzureCredential.call_count == 1
+    finally:
+        for cached in caches:
+            cached.cache_clear()
+
+
+def test_a_container_is_only_ensured_once(monkeypatch):
+    from azure.core.exceptions import ResourceExistsError
+
+    from pipeline import upload_to_blob as ub
+
+    service = MagicMock()
+    container = service.get_container_client.return_value
+    container.create_container.side_effect = ResourceExistsError("exists")
+    monkeypatch.setattr(ub, "get_blob_service_client", lambda: service)
+    monkeypatch.setattr(ub, "_ensured_containers", set())
+
+    for index in range(3):
+        ub.stage_audio_segment(b"x", "ai-103", "instructional", 7, index)
+
+    container.create_container.assert_called_once_with()
+    assert container.get_blob_client.return_value.stage_block.call_count == 3
+
+
+# ---------------------------------------------------------------------------
+# Speech REST calls
+# ---------------------------------------------------------------------------
+
+def test_the_speech_token_is_reused_until_it_expires(monkeypatch):
+    monkeypatch.delenv("SPEECH_KEY", raising=False)
+    monkeypatch.setenv("SPEECH_ENDPOINT", "https://speech.cognitiveservices.azure.com/")
+    monkeypatch.setattr(ge, "DefaultAzureCredential", MagicMock())
+    monkeypatch.setattr(ge, "_speech_token", None)
+    http = MagicMock()
+    http.post.return_value = MagicMock(status_code=200, text="tok")
+    monkeypatch.setattr(ge, "_speech_http", http)
+
+    assert ge._get_speech_headers() == {"Authorization": "Bearer tok"}
+    assert ge._get_speech_headers() == {"Authorization": "Bearer tok"}
+    assert http.post.call_count == 1
+
+    ge._speech_token = ("tok", 0.0)
+    ge._get_speech_headers()
+    assert http.post.call_count == 2
+
+
+# ---------------------------------------------------------------------------
+# SSML sanitizing
+# ---------------------------------------------------------------------------
+
+def test_llm_ssml_is_sanitized_in_one_parse():
+    raw = (
+        '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="fr-FR">'
+        '<voice name="made-up"><lang xml:lang="en-GB">A & B\x01 <break/></lang> tail</voice>'
+        '<voice name="en-US-GuyNeural">ok &amp; fine</voice></speak>'
+    )
+    out = ge.sanitize_ssml(raw, "instructional")
+
+    assert out == (
+        '<speak xmlns="http://www.w3.org/2001/10/synthesis" version="1.0" xml:lang="en-US">'
+        '<voice name="en-US-AndrewNeural">A &amp; B <break/> tail</voice>'
+        '<voice name="en-US-GuyNeural">ok &amp; fine</voice></speak>'
+    )
+
+
+def test_malformed_ssml_is_rejected():
+    with pytest.raises(ValueError, match="not well-formed"):
+        ge.sanitize_ssml("<speak><voice>", "instructional")
+
+
+def test_the_voice_list_is_fetched_once_per_region(monkeypatch):
+    monkeypatch.setenv("SPEECH_REGION", "eastus")
+    catalog = MagicMock(return_value=("eastus", [{"ShortName": "en-US-AvaNeural"}, {}]))
+    monkeypatch.setattr(ge, "_fetch_speech_voice_catalog", catalog)
+    ge._speech_voice_names.cache_clear()
+
+    assert ge._fetch_speech_voices() == ("eastus", {"en-US-AvaNeural"})
+    ge.preflight_validate_voices(["en-US-AvaNeural"])
+
+    catalog.assert_called_once_with("eastus")
+    ge._speech_voice_names.cache_clear()
+
+
+# ---------------------------------------------------------------------------
+# Batch pipeline
+# ---------------------------------------------------------------------------
+
+def _batch_env(monkeypatch):
+    for name in ("SEARCH_ENDPOINT", "OPENAI_ENDPOINT", "COSMOS_DB_ENDPOINT"):
+        monkeypatch.setenv(name, "https://example.invalid")
+    monkeypatch.setenv("OPENAI_API_KEY", "k")
+    for name in ("DefaultAzureCredential", "SearchClient", "AzureOpenAI",
+                 "create_cosmos_client_with_retry", "preflight_validate_voices",
+                 "prewarm_synthesizers", "get_embeddings"):
+        monkeypatch.setattr(ge, name, MagicMock())
+    monkeypatch.setattr(ge, "existing_episode_numbers", MagicMock(return_value=set()))
+    monkeypatch.setattr(ge, "upload_episode", lambda ep, *_: {"id": ep["episode_number"]})
+    monkeypatch.setattr(ge, "save_episodes", lambda docs: [
+        {"id": d["id"], "title": "t", "durationSeconds": 1.0} for d in docs
+    ])
+
+
+def test_synthesis_starts_before_the_whole_batch_is_prepared(monkeypatch):
+    import threading
+
+    _batch_env(monkeypatch)
+    first_synthesized = threading.Event()
+
+    def _prepare(episode_number, **_):
+        if episode_number == 2:
+            # With a barrier between phases this would never be set.
+            assert first_synthesized.wait(timeout=5)
+        return {"episode_number": episode_number}
+
+    def _synthesize(prepared, *_):
+        if prepared["episode_number"] == 1:
+            first_synthesized.set()
+        return {"duration_seconds": 1.0}
+
+    monkeypatch.setattr(ge, "prepare_episode", _prepare)
+    monkeypatch.setattr(ge, "synthesize_episode_audio", _synthesize)
+
+    result = ge.run_generation(
+        "ai-103", [{"name": "D", "topics": ["a", "b"]}], topics_per_episode=1,
+    )
+
+    assert [ep["id"] for ep in result["generated"]] == [1, 2]
+    assert result["errors"] == []
+
+
+def test_an_episode_uploads_before_the_whole_batch_is_prepared(monkeypatch):
+    import threading
+
+    _batch_env(monkeypatch)
+    first_uploaded = threading.Event()
+
+    def _prepare(episode_number, **_):
+        if episode_number == 2:
+            # Uploads queued only after every preparation would never set this.
+            assert first_uploaded.wait(timeout=5)
+        return {"episode_number": episode_number}
+
+    def _upload(ep, *_):
+        first_uploaded.set()
+        return {"id": ep["episode_number"]}
+
+    monkeypatch.setattr(ge, "prepare_episode", _prepare)
+    monkeypatch.setattr(ge, "synthesize_episode_audio", lambda *_: {"duration_seconds": 1.0})
+    monkeypatch.setattr(ge, "upload_episode", _upload)
+
+    result = ge.run_generation(
+        "ai-103", [{"name": "D", "topics": ["a", "b"]}], topics_per_episode=1,
+    )
+
+    assert [ep["id"] for ep in result["generated"]] == [1, 2]
+    assert result["errors"] == []
+
+
+def test_an_episode_is_saved_before_the_rest_of_the_batch_is_synthesized(monkeypatch):
+    import threading
+
+    _batch_env(monkeypatch)
+    first_saved = threading.Event()
+    saves = []
+
+    def _save(docs):
+        saves.append([d["id"] for d in docs])
+        first_saved.set()
+        return [{"id": d["id"], "title": "t", "durationSeconds": 1.0} for d in docs]
+
+    def _synthesize(prepared, *_):
+        if prepared["episode_number"] == 2:
+            # A save that waited for the whole batch would never set this.
+            assert first_saved.wait(timeout=5)
+        return {"duration_seconds": 1.0}
+
+    monkeypatch.setattr(ge, "prepare_episode", lambda episode_number, **_: {"episode_number": episode_number})
+    monkeypatch.setattr(ge, "synthesize_episode_audio", _synthesize)
+    monkeypatch.setattr(ge, "save_episodes", _save)
+
+    result = ge.run_generation(
+        "ai-103", [{"name": "D", "topics": ["a", "b"]}], topics_per_episode=1,
+    )
+
+    assert saves == [[1], [2]]
+    assert [ep["id"] for ep in result["generated"]] == [1, 2]
@@ -0,0 +1,49 @@
+"""
+Unit tests for the client-side Azure OpenAI throttle.
+
+Run:  python -m pytest src/functions/test_rate_limit.py -v
+"""
+
+from pipeline import rate_limit
+from pipeline.rate_limit import RateLimiter, estimate_chat_tokens
+
+
+def _clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(rate_limit.time, "sleep", lambda s: now.__setitem__(0, now[0] + s))
+    return now
+
+
+def test_requests_are_paced_to_the_per_minute_limit(monkeypatch):
+    now = _clock(monkeypatch)
+    limiter = RateLimiter(requests_per_minute=2)
+    admitted = []
+    for _ in range(5):
+        limiter.acquire()
+        admitted.append(now[0])
+
+    assert admitted == [0.0, 0.0, 60.0, 60.0, 120.0]
+
+
+def test_tokens_are_charged_by_estimate_and_an_oversized_request_still_runs(monkeypatch):
+    now = _clock(monkeypatch)
+    limiter = RateLimiter(tokens_per_minute=1000)
+    limiter.acquire(600)
+    limiter.acquire(600)
+    assert now[0] == 60.0
+    limiter.acquire(5000)
+    assert now[0] == 120.0
+
+
+def test_a_limiter_without_limits_never_waits(monkeypatch):
+    now = _clock(monkeypatch)
+    limiter = RateLimiter()
+    for _ in range(100):
+        limiter.acquire(10_000)
+    assert now[0] == 0.0
+
+
+def test_chat_tokens_are_the_prompt_estimate_plus_the_completion_cap():
+    messages = [{"role": "system", "content": "x" * 40}, {"role": "user", "content": None}]
+    assert estimate_chat_tokens(messages, max_tokens=50) == 60
@@ -0,0 +1,319 @@
+"""
+Unit tests for Speech synthesis.
+
+Run:  python -m pytest src/functions/test_synthesis.py -v
+"""
+
+import queue
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from pipeline import synthesize_audio as sa
+
+
+@pytest.fixture(autouse=True)
+def _empty_pool(monkeypatch):
+    monkeypatch.setattr(sa, "_synthesizers", queue.Queue())
+
+
+def _speechsdk(*reasons):
+    """A Speech SDK whose synthesizers complete (or not) in the given order."""
+    sdk = MagicMock()
+    completed = sdk.ResultReason.SynthesizingAudioCompleted
+
+    def _result(reason):
+        result = MagicMock(reason=reason, audio_data=b"\xff" * 24000)
+        result.cancellation_details.error_details = "429 TooManyRequests"
+        return result
+
+    results = iter([_result(completed if ok else sdk.ResultReason.Canceled) for ok in reasons])
+    sdk.SpeechSynthesizer.return_value.speak_ssml_async.side_effect = (
+        lambda _ssml: MagicMock(get=lambda: next(results))
+    )
+    return sdk
+
+
+# ---------------------------------------------------------------------------
+# Synthesizer pool
+# ---------------------------------------------------------------------------
+
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_a_synthesizer_is_reused_across_requests(tmp_path):
+    sdk = _speechsdk(True, True)
+    with patch.object(sa, "speechsdk", sdk):
+        assert sa.synthesize_ssml("<speak/>", str(tmp_path / "a.mp3"))[0]
+        assert sa.synthesize_ssml("<speak/>", str(tmp_path / "b.mp3"))[0]
+
+    assert sdk.SpeechSynthesizer.call_count == 1
+    sdk.Connection.from_speech_synthesizer.return_value.open.assert_called_once_with(True)
+
+
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_audio_is_written_from_the_result_and_timed(tmp_path):
+    out = tmp_path / "a.mp3"
+    with patch.object(sa, "speechsdk", _speechsdk(True)):
+        ok, duration = sa.synthesize_ssml("<speak/>", str(out))
+
+    assert ok
+    assert out.read_bytes() == b"\xff" * 24000
+    assert duration == pytest.approx(1.0)  # 24,000 bytes at 192 kbps
+
+
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_an_expired_synthesizer_is_replaced(tmp_path, monkeypatch):
+    sdk = _speechsdk(True, True)
+    with patch.object(sa, "speechsdk", sdk):
+        sa.synthesize_ssml("<speak/>", str(tmp_path / "a.mp3"))
+        sa._synthesizers.queue[0].expires_at = 0
+        sa.synthesize_ssml("<speak/>", str(tmp_path / "b.mp3"))
+
+    assert sdk.SpeechSynthesizer.call_count == 2
+    sdk.Connection.from_speech_synthesizer.return_value.close.assert_called_once_with()
+
+
+@patch.object(sa.time, "sleep", MagicMock())
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_a_failed_synthesizer_is_not_returned_to_the_pool(tmp_path):
+    sdk = _speechsdk(False, True)
+    with patch.object(sa, "speechsdk", sdk):
+        ok, _ = sa.synthesize_ssml("<speak/>", str(tmp_path / "a.mp3"))
+
+    assert ok
+    assert sdk.SpeechSynthesizer.call_count == 2
+    assert sa._synthesizers.qsize() == 1
+
+
+@patch.object(sa.time, "sleep", MagicMock())
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_a_synthesizer_that_raises_is_discarded_with_its_boundaries():
+    sdk = _speechsdk()
+    synthesizer = sdk.SpeechSynthesizer.return_value
+
+    def _speak(_ssml):
+        handler = synthesizer.synthesis_word_boundary.connect.call_args.args[0]
+        handler(MagicMock(text="Hello", audio_offset=0, boundary_type=MagicMock()))
+        raise RuntimeError("connection reset")
+
+    synthesizer.speak_ssml_async.side_effect = _speak
+    boundaries = [{"text": "earlier segment"}]
+    with patch.object(sa, "speechsdk", sdk), pytest.raises(RuntimeError):
+        sa.synthesize_ssml_bytes("<speak/>", word_boundaries=boundaries)
+
+    assert boundaries == [{"text": "earlier segment"}]
+    assert sa._synthesizers.qsize() == 0
+    assert sdk.Connection.from_speech_synthesizer.return_value.close.call_count == 4  # every attempt
+
+
+@patch.object(sa.time, "sleep", MagicMock())
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_a_dropped_connection_is_retried_on_a_fresh_one():
+    sdk = _speechsdk(True)
+    speak = sdk.SpeechSynthesizer.return_value.speak_ssml_async.side_effect
+    calls = iter([RuntimeError("websocket closed")])
+
+    def _speak(ssml):
+        error = next(calls, None)
+        if error:
+            raise error
+        return speak(ssml)
+
+    sdk.SpeechSynthesizer.return_value.speak_ssml_async.side_effect = _speak
+    with patch.object(sa, "speechsdk", sdk):
+        assert sa.synthesize_ssml_bytes("<speak/>") == b"\xff" * 24000
+
+    assert sdk.SpeechSynthesizer.call_count == 2
+
+
+@patch.object(sa.time, "sleep", MagicMock())
+def test_a_connection_that_fails_to_open_is_retried():
+    opened = MagicMock()
+    opened.synthesizer.speak_ssml_async.return_value.get.return_value = MagicMock(
+        reason="done", audio_data=b"mp3"
+    )
+    sdk = MagicMock()
+    sdk.ResultReason.SynthesizingAudioCompleted = "done"
+    with patch.object(sa, "speechsdk", sdk), \
+            patch.object(sa, "_open_synthesizer", side_effect=[RuntimeError("no token"), opened]):
+        assert sa.synthesize_ssml_bytes("<speak/>") == b"mp3"
+
+
+@patch.object(sa.time, "sleep", MagicMock())
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_a_retry_does_not_keep_the_failed_attempts_boundaries():
+    sdk = _speechsdk(False, True)
+    signal = sdk.SpeechSynthesizer.return_value.synthesis_word_boundary
+    speak = sdk.SpeechSynthesizer.return_value.speak_ssml_async.side_effect
+
+    def _speak(ssml):
+        # Both attempts get as far as the first word before finishing.
+        handler = signal.connect.call_args.args[0]
+        handler(MagicMock(text="Hello", audio_offset=0, boundary_type=MagicMock()))
+        return speak(ssml)
+
+    sdk.SpeechSynthesizer.return_value.speak_ssml_async.side_effect = _speak
+    boundaries: list[dict] = []
+    with patch.object(sa, "speechsdk", sdk):
+        assert sa.synthesize_ssml_bytes("<speak/>", word_boundaries=boundaries)
+
+    assert [b["text"] for b in boundaries] == ["Hello"]
+
+
+def test_retry_delays_are_jittered_upwards():
+    delays = {sa._retry_delay(2, 1) for _ in range(20)}
+    assert all(4 <= d <= 5 for d in delays)
+    assert len(delays) > 1
+
+
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_word_boundary_handlers_do_not_outlive_the_request(tmp_path):
+    sdk = _speechsdk(True)
+    with patch.object(sa, "speechsdk", sdk):
+        sa.synthesize_ssml("<speak/>", str(tmp_path / "a.mp3"), word_boundaries=[])
+
+    signal = sdk.SpeechSynthesizer.return_value.synthesis_word_boundary
+    signal.connect.assert_called_once()
+    signal.disconnect_all.assert_called_once_with()
+
+
+def test_prewarm_fills_the_pool_only_up_to_the_count():
+    with patch.object(sa, "_open_synthesizer", side_effect=lambda: MagicMock()) as opener:
+        sa.prewarm_synthesizers(3)
+        sa.prewarm_synthesizers(3)
+
+    assert opener.call_count == 3
+    assert sa._synthesizers.qsize() == 3
+
+
+def test_prewarm_failure_is_not_fatal():
+    with patch.object(sa, "_open_synthesizer", side_effect=RuntimeError("no token")):
+        sa.prewarm_synthesizers(3)
+
+    assert sa._synthesizers.qsize() == 0
+
+
+# ---------------------------------------------------------------------------
+# Duration
+# ---------------------------------------------------------------------------
+
+# MPEG-1 Layer III, 192 kbps, 48 kHz, mono: 576-byte frames of 24 ms each.
+FRAME = b"\xff\xfb\xb4\xc4" + b"\x00" * 572
+
+
+def test_duration_is_counted_from_frames_not_file_size():
+    id3 = b"ID3\x04\x00\x00\x00\x00\x07\x76" + b"\x00" * 1014  # 1 KB tag
+    xing = FRAME[:4] + b"\x00" * 32 + b"Xing" + FRAME[40:]
+    audio = id3 + xing + FRAME * 50
+
+    assert sa._mp3_duration_seconds(audio) == pytest.approx(1.2)
+    assert len(audio) * 8 / 192000 == pytest.approx(1.267, abs=1e-3)  # sizing by bitrate
+
+
+def test_junk_between_frames_is_skipped():
+    assert sa._mp3_duration_seconds(FRAME * 10 + b"\x01\x02" + FRAME * 10) == pytest.approx(0.48)
+
+
+# ---------------------------------------------------------------------------
+# Concurrent segments
+# ---------------------------------------------------------------------------
+
+def test_segments_are_concatenated_in_order_with_shifted_boundaries(tmp_path):
+    def _fake(ssml, word_boundaries=None, **_):
+        word_boundaries.append({"text": ssml, "offset": 100.0})
+        return ssml.encode() * 24000  # one second per byte of "ssml"
+
+    boundaries: list[dict] = []
+    out = tmp_path / "ep.mp3"
+    with patch.object(sa, "synthesize_ssml_bytes", side_effect=_fake):
+        ok, duration = sa.synthesize_audio_segments(["a", "bb", "c"], str(out), boundaries)
+
+    assert ok and duration == 4.0
+    assert out.read_bytes() == b"a" * 24000 + b"bb" * 24000 + b"c" * 24000
+    assert [(b["text"], b["offset"]) for b in boundaries] == [
+        ("a", 100.0), ("bb", 1100.0), ("c", 3100.0),
+    ]
+    assert list(tmp_path.iterdir()) == [out]
+
+
+def test_a_failed_segment_fails_the_episode_and_cleans_up(tmp_path):
+    def _fake(ssml, **_):
+        return None if ssml == "bad" else b"\xff" * 24000
+
+    with patch.object(sa, "synthesize_ssml_bytes", side_effect=_fake):
+        ok, _ = sa.synthesize_audio_segments(["a", "bad"], str(tmp_path / "ep.mp3"))
+
+    assert not ok
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_id3_tags_are_stripped_between_segments(tmp_path):
+    tagged = b"ID3\x04\x00\x00\x00\x00\x00\x02TT" + b"\xff" * 10 + b"TAG" + b"\x00" * 125
+    out = tmp_path / "ep.mp3"
+    with patch.object(sa, "synthesize_ssml_bytes", return_value=tagged):
+        sa.synthesize_audio_segments(["a", "b"], str(out))
+
+    assert out.read_bytes() == b"\xff" * 20
+
+
+def test_an_episode_is_returned_in_memory():
+    with patch.object(sa, "synthesize_ssml_bytes", return_value=b"\xff" * 24000):
+        result = sa.synthesize_audio("<speak/>", 1, "ai-103", "instructional")
+
+    assert result["audio_data"] == b"\xff" * 24000
+    assert result["duration_seconds"] == pytest.approx(1.0)
+    assert "audio_path" not in result
+
+
+def test_each_segment_is_handed_off_as_soon_as_it_is_ready():
+    handed = {}
+
+    def _fake(ssml, **_):
+        return b"ID3\x04\x00\x00\x00\x00\x00\x00" + ssml.encode()
+
+    with patch.object(sa, "synthesize_ssml_bytes", side_effect=_fake):
+        audio, _ = sa.synthesize_segments_bytes(["a", "b"], on_segment=handed.__setitem__)
+
+    assert handed == {0: b"a", 1: b"b"}
+    assert audio == b"ab"
+
+
+@patch.object(sa, "get_speech_config", MagicMock())
+def test_requests_in_flight_are_capped_across_the_process(tmp_path, monkeypatch):
+    monkeypatch.setattr(sa, "_in_flight", sa.threading.BoundedSemaphore(2))
+    sdk = _speechsdk(*[True] * 6)
+    active, peak = [0], [0]
+    lock = sa.threading.Lock()
+    speak = sdk.SpeechSynthesizer.return_value.speak_ssml_async.side_effect
+
+    def _speak(ssml):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        sa.time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return speak(ssml)
+
+    sdk.SpeechSynthesizer.return_value.speak_ssml_async.side_effect = _speak
+    with patch.object(sa, "speechsdk", sdk):
+        audio, _ = sa.synthesize_segments_bytes(["<speak/>"] * 6, max_workers=6)
+
+    assert audio is not None
+    assert peak[0] == 2
+    assert sdk.SpeechSynthesizer.call_count <= 2  # no connection opened just to wait
+
+
+def test_the_entra_token_is_shared_until_near_expiry(monkeypatch):
+    credential = MagicMock()
+    credential.get_token.side_effect = lambda _scope: MagicMock(
+        token="tok", expires_on=sa.time.time() + 3600
+    )
+    monkeypatch.setattr(sa, "_credential", credential)
+    monkeypatch.setattr(sa, "_aad_token", None)
+
+    assert sa._get_aad_token() == sa._get_aad_token() == "tok"
+    assert credential.get_token.call_count == 1
+
+    sa._aad_token.expires_on = sa.time.time() + 60
+    sa._get_aad_token()
+    assert credential.get_token.call_count == 2